@@ -26,77 +26,169 @@ if "bpy" in locals():
 
 #just for Break
 
-import bpy
-from bpy_extras.io_utils import ExportHelper,ImportHelper
-from bpy.props import StringProperty, BoolProperty, EnumProperty
-
-class ImportNier2blender(bpy.types.Operator, ImportHelper):
-    '''Load a Nier: Automata WMB File.'''
-    bl_idname = "import.wmb_data"
-    bl_label = "Import WMB Data"
-    bl_options = {'PRESET'}
-    filename_ext = ".wmb"
-    filter_glob = StringProperty(default="*.wmb", options={'HIDDEN'})
-
-    def execute(self, context):
-        from nier2blender import wmb_importer
-        return wmb_importer.main( self.filepath)
-
-class ImportNierMotion2blender(bpy.types.Operator, ImportHelper):
-    '''Load a Nier: Automata Motion File.'''
-    bl_idname = "import.mot_data"
-    bl_label = "Import MOT Data"
-    bl_options = {'PRESET'}
-    filename_ext = ".mot"
-    filter_glob = StringProperty(default="*.mot", options={'HIDDEN'})
-
-    def execute(self, context):
-        armature = None
-        for obj in context.selected_objects:
-            if obj.get("bone_mapping"):
-                print('[Info] Selected obj: %s' % (obj.name))
-                armature = obj
-                break
-
-        if armature is None:
-            print('[Error] context.selected_objects not found: bone_mapping')
-            self.report({'ERROR'}, "No armature is selected!")
+try:
+    import os
+    import bpy
+except ImportError:
+    # the parsers (wmb, wta, mot) only need numpy, they are also imported by
+    # worker processes and command line tools running without blender
+    bpy = None
+
+if bpy is not None:
+    from bpy_extras.io_utils import ExportHelper,ImportHelper
+    from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty, FloatProperty, FloatVectorProperty, CollectionProperty
+    from nier2blender.log import get_logger
+
+    log = get_logger('addon')
+
+    class ImportNier2blender(bpy.types.Operator, ImportHelper):
+        '''Load a Nier: Automata WMB File.'''
+        bl_idname = "import.wmb_data"
+        bl_label = "Import WMB Data"
+        bl_options = {'PRESET'}
+        filename_ext = ".wmb"
+        filter_glob = StringProperty(default="*.wmb", options={'HIDDEN'})
+        lod_level = IntProperty(
+            name="LOD Level",
+            description="LOD level to import, 0 is the most detailed one",
+            default=0, min=0)
+        import_all_lods = BoolProperty(
+            name="Import All LODs",
+            description="Import every LOD level instead of only the selected one",
+            default=False)
+        profile_import = BoolProperty(
+            name="Profile Import",
+            description="Collect per-phase timings and counters of the import",
+            default=False)
+        profile_file = StringProperty(
+            name="Profile Report",
+            description="Optional json file the profile report is written to",
+            default="", subtype='FILE_PATH')
+        profile_memory = BoolProperty(
+            name="Profile Memory",
+            description="Track peak memory per phase and the top allocation sites with tracemalloc (slow)",
+            default=False)
+        texture_mode = EnumProperty(
+            name="Textures",
+            items=(('FULL', "Full Resolution", "Dump and load the textures as they are"),
+                   ('PREVIEW', "Preview", "Keep only the mip levels at or below the preview size, for layout work")),
+            default='FULL')
+        preview_size = IntProperty(
+            name="Preview Size",
+            description="Largest texture width or height of preview textures",
+            default=512, min=4)
+        use_region = BoolProperty(
+            name="Import Region",
+            description="Only import the mesh groups whose bounding box intersects the region",
+            default=False)
+        region_min = FloatVectorProperty(
+            name="Region Min",
+            description="Corner of the region in wmb (file) coordinates",
+            default=(-10.0, -10.0, -10.0), size=3)
+        region_max = FloatVectorProperty(
+            name="Region Max",
+            description="Opposite corner of the region in wmb (file) coordinates",
+            default=(10.0, 10.0, 10.0), size=3)
+
+        def execute(self, context):
+            from nier2blender import wmb_importer
+            from nier2blender.wmb import make_region
+            from nier2blender.profiler import profiler, format_report
+            lods = None if self.import_all_lods else (self.lod_level,)
+            profile_file = bpy.path.abspath(self.profile_file) if self.profile_file else None
+            texture_size = self.preview_size if self.texture_mode == 'PREVIEW' else None
+            region = make_region(self.region_min, self.region_max) if self.use_region else None
+            result = wmb_importer.main( self.filepath, lods, self.profile_import, profile_file, self.profile_memory, texture_size, region)
+            if (self.profile_import or profile_file or self.profile_memory) and profiler.last_report:
+                self.report({'INFO'}, format_report(profiler.last_report))
+            return result
+
+    class ImportNierMotion2blender(bpy.types.Operator, ImportHelper):
+        '''Load a Nier: Automata Motion File.'''
+        bl_idname = "import.mot_data"
+        bl_label = "Import MOT Data"
+        bl_options = {'PRESET'}
+        filename_ext = ".mot"
+        filter_glob = StringProperty(default="*.mot", options={'HIDDEN'})
+        keyframe_mode = EnumProperty(
+            name="Keyframes",
+            items=(('BAKE', "Bake", "Insert a key on every frame"),
+                   ('SPARSE', "Source Keys", "Keep the hermite keys of the motion as bezier keys, bake only the other tracks")),
+            default='BAKE')
+        simplify_tolerance = FloatProperty(
+            name="Simplify Tolerance",
+            description="Remove baked keys while the curve stays within this error, 0 keeps every key",
+            default=0.0, min=0.0)
+        files = CollectionProperty(type=bpy.types.OperatorFileListElement, options={'HIDDEN'})
+        directory = StringProperty(subtype='DIR_PATH', options={'HIDDEN'})
+        import_folder = BoolProperty(
+            name="Import Whole Folder",
+            description="Import every .mot file of the folder instead of the selected files",
+            default=False)
+        processes = IntProperty(
+            name="Processes",
+            description="Worker processes parsing the motions of a multi-file import, 0 uses every cpu",
+            default=0, min=0)
+
+        def get_mot_files(self):
+            if self.import_folder and self.directory:
+                return sorted([os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.lower().endswith('.mot')])
+            mot_files = [os.path.join(self.directory, f.name) for f in self.files if f.name]
+            return mot_files or [self.filepath]
+
+        def execute(self, context):
+            armature = None
+            for obj in context.selected_objects:
+                if obj.get("bone_mapping"):
+                    log.info('Selected obj: %s', obj.name)
+                    armature = obj
+                    break
+
+            if armature is None:
+                log.error('context.selected_objects not found: bone_mapping')
+                self.report({'ERROR'}, "No armature is selected!")
+                return {'FINISHED'}
+
+            from nier2blender import mot_importer
+            mot_files = self.get_mot_files()
+            if len(mot_files) == 1:
+                return mot_importer.main(mot_files[0], armature, self.keyframe_mode, self.simplify_tolerance)
+            failed = mot_importer.main_batch(mot_files, armature, self.keyframe_mode, self.simplify_tolerance, self.processes)
+            if failed:
+                self.report({'WARNING'}, "%d of %d motions failed to load" % (len(failed), len(mot_files)))
             return {'FINISHED'}
 
-        from nier2blender import mot_importer
-        return mot_importer.main(self.filepath, armature)
-
-# Registration
-def menu_func_import(self, context):
-    self.layout.operator(ImportNier2blender.bl_idname, text="WMB File for Nier: Automata (.wmb)")
-    self.layout.operator(ImportNierMotion2blender.bl_idname,
-                         text="MOT File for Nier: Automata (.mot)")
-
-# store keymaps here to access after registration
-addon_keymaps = []
-
-def register():
-    bpy.utils.register_module(__name__)
-    bpy.types.INFO_MT_file_import.append(menu_func_import)
-
-    # handle the keymap
-    wm = bpy.context.window_manager
-    km = wm.keyconfigs.addon.keymaps.new(name='Object Mode', space_type='EMPTY')
-    km_importWMB = km.keymap_items.new(ImportNier2blender.bl_idname, 'W', 'PRESS', ctrl=True, shift=True)
-    km_importMotion = km.keymap_items.new(ImportNierMotion2blender.bl_idname, 'M', 'PRESS', ctrl=True, shift=True)
-    addon_keymaps.append(km)
-
-def unregister():
-    bpy.utils.unregister_module(__name__)
-    bpy.types.INFO_MT_file_import.remove(menu_func_import)
-
-    # handle the keymap
-    wm = bpy.context.window_manager
-    for km in addon_keymaps:
-        wm.keyconfigs.addon.keymaps.remove(km)
-    # clear the list
-    del addon_keymaps[:]
-
-
-if __name__ == '__main__':
-    register()
+    # Registration
+    def menu_func_import(self, context):
+        self.layout.operator(ImportNier2blender.bl_idname, text="WMB File for Nier: Automata (.wmb)")
+        self.layout.operator(ImportNierMotion2blender.bl_idname,
+                             text="MOT File for Nier: Automata (.mot)")
+
+    # store keymaps here to access after registration
+    addon_keymaps = []
+
+    def register():
+        bpy.utils.register_module(__name__)
+        bpy.types.INFO_MT_file_import.append(menu_func_import)
+
+        # handle the keymap
+        wm = bpy.context.window_manager
+        km = wm.keyconfigs.addon.keymaps.new(name='Object Mode', space_type='EMPTY')
+        km_importWMB = km.keymap_items.new(ImportNier2blender.bl_idname, 'W', 'PRESS', ctrl=True, shift=True)
+        km_importMotion = km.keymap_items.new(ImportNierMotion2blender.bl_idname, 'M', 'PRESS', ctrl=True, shift=True)
+        addon_keymaps.append(km)
+
+    def unregister():
+        bpy.utils.unregister_module(__name__)
+        bpy.types.INFO_MT_file_import.remove(menu_func_import)
+
+        # handle the keymap
+        wm = bpy.context.window_manager
+        for km in addon_keymaps:
+            wm.keyconfigs.addon.keymaps.remove(km)
+        # clear the list
+        del addon_keymaps[:]
+
+
+    if __name__ == '__main__':
+        register()
@@ -0,0 +1,262 @@
+#encoding = utf-8
+"""batch import .wmb files to .blend files with a pool of background blender workers
+
+driver (plain python, no bpy needed):
+    python batch_import.py --blender path/to/blender --jobs 4 --out blend_dir wmb_files_or_dirs...
+
+every worker is a `blender --background` process running this file with --worker,
+it reads jobs as json lines from stdin and answers with RESULT_MARKER lines on stdout.
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import argparse
+import threading
+import subprocess
+
+RESULT_MARKER = 'NIER2BLENDER_RESULT '
+ADDON_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def create_dir(dirpath):
+	if not os.path.exists(dirpath):
+		os.makedirs(dirpath)
+
+def find_wmb_files(paths):
+	wmb_files = []
+	for path in paths:
+		if os.path.isdir(path):
+			for dirpath, dirnames, filenames in os.walk(path):
+				for filename in filenames:
+					if filename.lower().endswith('.wmb'):
+						wmb_files.append(os.path.join(dirpath, filename))
+		elif path.lower().endswith('.wmb'):
+			wmb_files.append(path)
+	return sorted(set(wmb_files))
+
+def make_jobs(wmb_files, out_dir, group_by='model', lods=(0,)):
+	"""one job per .blend file, large jobs first"""
+	groups = {}
+	for wmb_file in wmb_files:
+		if group_by == 'dir':
+			name = os.path.basename(os.path.dirname(os.path.abspath(wmb_file)))
+		else:
+			name = os.path.splitext(os.path.basename(wmb_file))[0]
+		groups.setdefault(name, []).append(wmb_file)
+	jobs = []
+	for name, files in groups.items():
+		jobs.append({
+			'name': name,
+			'files': files,
+			'blend': os.path.abspath(os.path.join(out_dir, name + '.blend')),
+			'lods': None if lods is None else list(lods),
+			'size': sum([os.path.getsize(f) for f in files]),
+			'attempts': 0,
+		})
+	jobs.sort(key=lambda job: job['size'], reverse=True)
+	return jobs
+
+class JobQueue(object):
+	"""largest job first, shared by the worker threads of the driver"""
+	def __init__(self, jobs):
+		self.lock = threading.Lock()
+		self.heap = []
+		self.counter = 0
+		for job in jobs:
+			self.push(job)
+
+	def push(self, job):
+		with self.lock:
+			heapq.heappush(self.heap, (-job['size'], self.counter, job))
+			self.counter += 1
+
+	def pop(self):
+		with self.lock:
+			if not self.heap:
+				return None
+			return heapq.heappop(self.heap)[2]
+
+class WorkerThread(threading.Thread):
+	"""drive one blender process, restart it when it crashes"""
+	def __init__(self, index, blender, queue, results, retries, timeout, log_dir):
+		super(WorkerThread, self).__init__()
+		self.index = index
+		self.blender = blender
+		self.queue = queue
+		self.results = results
+		self.retries = retries
+		self.timeout = timeout
+		self.log_dir = log_dir
+		self.proc = None
+
+	def start_worker(self):
+		cmd = [self.blender, '--background', '--factory-startup',
+			'--python', os.path.realpath(__file__), '--', '--worker']
+		self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+			stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1)
+
+	def stop_worker(self):
+		if self.proc is None:
+			return
+		try:
+			self.proc.stdin.close()
+		except (IOError, OSError):
+			pass
+		self.proc.wait()
+		self.proc = None
+
+	def run_job(self, job):
+		"""send a job and wait for its result, returns None if the worker died"""
+		killer = None
+		if self.timeout:
+			killer = threading.Timer(self.timeout, self.proc.kill)
+			killer.start()
+		log = []
+		try:
+			self.proc.stdin.write(json.dumps(job) + '\n')
+			self.proc.stdin.flush()
+			for line in self.proc.stdout:
+				if line.startswith(RESULT_MARKER):
+					return json.loads(line[len(RESULT_MARKER):])
+				log.append(line)
+		except (IOError, OSError):
+			pass
+		finally:
+			if killer is not None:
+				killer.cancel()
+			if self.log_dir:
+				with open(os.path.join(self.log_dir, job['name'] + '.log'), 'a') as log_fp:
+					log_fp.writelines(log)
+		return None
+
+	def run(self):
+		while True:
+			job = self.queue.pop()
+			if job is None:
+				break
+			if self.proc is None:
+				self.start_worker()
+			job['attempts'] += 1
+			start = time.time()
+			result = self.run_job(job)
+			if result is None:
+				self.proc.wait()
+				exit_code = self.proc.returncode
+				self.proc = None
+				print('[Error] worker %d crashed on %s (exit code %s), attempt %d' % (self.index, job['name'], exit_code, job['attempts']))
+				if job['attempts'] <= self.retries:
+					self.queue.push(job)
+					continue
+				result = {
+					'name': job['name'],
+					'blend': job['blend'],
+					'status': 'failed',
+					'error': 'worker crashed (exit code %s)' % exit_code,
+					'files': [],
+				}
+			result['attempts'] = job['attempts']
+			result['wall_seconds'] = time.time() - start
+			result['worker'] = self.index
+			print('[Info] %s %s in %.2fs' % (result['status'], job['name'], result['wall_seconds']))
+			self.results.append(result)
+		self.stop_worker()
+
+def run_batch(blender, wmb_files, out_dir, workers=4, group_by='model', lods=(0,), retries=1, timeout=None, report_file=None, log_dir=None):
+	"""import wmb_files to .blend files in out_dir, returns the report dict"""
+	create_dir(out_dir)
+	if log_dir:
+		create_dir(log_dir)
+	start = time.time()
+	jobs = make_jobs(wmb_files, out_dir, group_by, lods)
+	queue = JobQueue(jobs)
+	results = []
+	threads = [WorkerThread(i, blender, queue, results, retries, timeout, log_dir) for i in range(max(1, min(workers, len(jobs))))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	report = {
+		'blender': blender,
+		'workers': len(threads),
+		'total_seconds': time.time() - start,
+		'job_count': len(jobs),
+		'failed_count': len([result for result in results if result['status'] != 'ok']),
+		'jobs': sorted(results, key=lambda result: result['name']),
+	}
+	if report_file:
+		with open(report_file, 'w') as report_fp:
+			json.dump(report, report_fp, indent=2)
+	return report
+
+def worker_import(job):
+	"""import every file of a job into an empty scene and save it, runs inside blender"""
+	import bpy
+	from nier2blender import wmb_importer
+	start = time.time()
+	bpy.ops.wm.read_factory_settings()
+	wmb_importer.reset_blend()
+	lods = job['lods']
+	files = []
+	for wmb_file in job['files']:
+		file_start = time.time()
+		file_result = {'file': wmb_file, 'size': os.path.getsize(wmb_file), 'error': None}
+		try:
+			wmb_importer.main(wmb_file, None if lods is None else tuple(lods))
+		except Exception as e:
+			file_result['error'] = '%s: %s' % (type(e).__name__, e)
+		file_result['seconds'] = time.time() - file_start
+		files.append(file_result)
+	result = {'name': job['name'], 'blend': job['blend'], 'files': files, 'error': None}
+	if len([f for f in files if f['error'] is None]) > 0:
+		try:
+			create_dir(os.path.dirname(job['blend']))
+			bpy.ops.wm.save_as_mainfile(filepath=job['blend'], check_existing=False)
+		except Exception as e:
+			result['error'] = 'save failed, %s: %s' % (type(e).__name__, e)
+	else:
+		result['error'] = 'nothing imported'
+	result['status'] = 'ok' if result['error'] is None and all([f['error'] is None for f in files]) else 'failed'
+	result['seconds'] = time.time() - start
+	return result
+
+def worker_main():
+	if not ADDON_PATH in sys.path:
+		sys.path.append(ADDON_PATH)
+	for line in iter(sys.stdin.readline, ''):
+		if not line.strip():
+			continue
+		result = worker_import(json.loads(line))
+		sys.stdout.write(RESULT_MARKER + json.dumps(result) + '\n')
+		sys.stdout.flush()
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description='batch import Nier:Automata .wmb files to .blend files')
+	parser.add_argument('inputs', nargs='+', help='.wmb files or folders to search')
+	parser.add_argument('--blender', default='blender', help='blender executable')
+	parser.add_argument('--out', required=True, help='output folder of the .blend files')
+	parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='number of blender workers')
+	parser.add_argument('--group-by', choices=['model', 'dir'], default='model', help='one .blend per model or per folder')
+	parser.add_argument('--lod', type=int, default=0, help='LOD level to import')
+	parser.add_argument('--all-lods', action='store_true', help='import every LOD level')
+	parser.add_argument('--retries', type=int, default=1, help='retries of a job whose worker crashed')
+	parser.add_argument('--timeout', type=float, default=None, help='seconds before a job is killed')
+	parser.add_argument('--report', default=None, help='json report file, default is out/batch_report.json')
+	parser.add_argument('--log-dir', default=None, help='folder for the blender output of every job')
+	return parser.parse_args(argv)
+
+if __name__ == '__main__':
+	argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+	if '--worker' in argv:
+		worker_main()
+	else:
+		args = parse_args(argv)
+		wmb_files = find_wmb_files(args.inputs)
+		if not wmb_files:
+			print('[Error] no .wmb file found')
+			sys.exit(1)
+		report = run_batch(args.blender, wmb_files, args.out, args.jobs, args.group_by,
+			None if args.all_lods else (args.lod,), args.retries, args.timeout,
+			args.report or os.path.join(args.out, 'batch_report.json'), args.log_dir)
+		print('[Info] %d job(s), %d failed, %.2fs' % (report['job_count'], report['failed_count'], report['total_seconds']))
+		sys.exit(1 if report['failed_count'] else 0)
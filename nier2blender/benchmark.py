@@ -0,0 +1,147 @@
+#encoding = utf-8
+"""parser benchmarks on synthetic files, results as json
+
+    python benchmark.py --sizes small,medium,large --repeat 3 --out bench.json
+
+every case is timed `repeat` times (best time is kept) and run once more under
+tracemalloc for its peak memory, throughput is given in MB/s of input file and
+in items (vertices, keys, meshes) per second.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+ADDON_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if not ADDON_PATH in sys.path:
+	sys.path.append(ADDON_PATH)
+
+import numpy as np
+from nier2blender import synthetic
+from nier2blender.util import open_reader
+from nier2blender.wmb import WMB3
+from nier2blender.mot import read_track, read_motionData
+
+# vertices per vertex group of the models, bones and frames of the motions
+SIZES = {
+	'small': {'wmb': {'vertices': 1000, 'vertex_groups': 1, 'meshes': 4, 'bones': 16},
+		'mot': {'bones': 16, 'frames': 60, 'keys': 8}},
+	'medium': {'wmb': {'vertices': 20000, 'vertex_groups': 2, 'meshes': 16, 'bones': 64},
+		'mot': {'bones': 64, 'frames': 300, 'keys': 32}},
+	'large': {'wmb': {'vertices': 60000, 'vertex_groups': 4, 'meshes': 64, 'bones': 200, 'index_size': 4},
+		'mot': {'bones': 200, 'frames': 1200, 'keys': 128}},
+}
+
+def measure(func, repeat):
+	"""(best seconds, peak traced bytes, result of the last call)"""
+	best = None
+	result = None
+	for i in range(max(1, repeat)):
+		start = time.perf_counter()
+		result = func()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	tracemalloc.start()
+	try:
+		func()
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+	return best, peak, result
+
+def make_result(name, size, seconds, peak, nbytes, items, item_name):
+	return {
+		'name': name,
+		'size': size,
+		'seconds': seconds,
+		'bytes': nbytes,
+		'mb_per_s': nbytes / seconds / 1e6 if seconds else None,
+		item_name: items,
+		'%s_per_s' % item_name: items / seconds if seconds else None,
+		'peak_bytes': peak,
+	}
+
+def bench_wmb(work_dir, size, params, repeat):
+	summary = synthetic.make_model(work_dir, 'bench_%s' % size, **params)
+	wmb_file = summary['file']
+	nbytes = os.path.getsize(wmb_file)
+	results = []
+	seconds, peak, wmb = measure(lambda: WMB3(wmb_file), repeat)
+	results.append(make_result('WMB3', size, seconds, peak, nbytes, summary['vertices'], 'vertices'))
+
+	def extract_submeshes():
+		for meshIndex, mesh in enumerate(wmb.meshArray):
+			wmb.clear_unused_vertex(meshIndex, mesh.vertexGroupIndex)
+		# clear_unused_vertex drops the skinning of meshes without bone set
+		wmb.hasBone = wmb.wmb3_header.boneCount > 0
+	seconds, peak, unused = measure(extract_submeshes, repeat)
+	results.append(make_result('clear_unused_vertex', size, seconds, peak, nbytes, len(wmb.meshArray), 'meshes'))
+	return results
+
+def bench_mot(work_dir, size, params, repeat):
+	mot_file = os.path.join(work_dir, 'bench_%s.mot' % size)
+	summary = synthetic.write_mot(mot_file, **params)
+	nbytes = os.path.getsize(mot_file)
+	with open_reader(mot_file) as reader:
+		frame_count = reader.get('H', 0xa)
+		track_offset, track_count = reader.get('2I', 0xc)
+	def parse_tracks():
+		with open_reader(mot_file) as reader:
+			return read_track(reader, track_offset, track_count)
+	results = []
+	seconds, peak, tracks = measure(parse_tracks, repeat)
+	keys = sum([track.keycount for track in tracks])
+	results.append(make_result('read_track', size, seconds, peak, nbytes, keys, 'keys'))
+	seconds, peak, motion = measure(lambda: read_motionData(frame_count, tracks), repeat)
+	results.append(make_result('read_motionData', size, seconds, peak, nbytes, summary['tracks'] * frame_count, 'samples'))
+	return results
+
+def run_benchmarks(sizes=('small', 'medium'), repeat=3, work_dir=None):
+	"""run every case at every size, returns the report dict"""
+	keep = work_dir is not None
+	if work_dir is None:
+		work_dir = tempfile.mkdtemp(prefix='nier2blender_bench_')
+	results = []
+	try:
+		for size in sizes:
+			results += bench_wmb(work_dir, size, SIZES[size]['wmb'], repeat)
+			results += bench_mot(work_dir, size, SIZES[size]['mot'], repeat)
+	finally:
+		if not keep:
+			shutil.rmtree(work_dir, ignore_errors=True)
+	return {
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'platform': platform.platform(),
+		'repeat': repeat,
+		'results': results,
+	}
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description='benchmark the nier2blender parsers on synthetic files')
+	parser.add_argument('--sizes', default='small,medium', help='comma separated: %s' % ', '.join(sorted(SIZES.keys())))
+	parser.add_argument('--repeat', type=int, default=3, help='timed runs of every case, the best one is kept')
+	parser.add_argument('--work-dir', default=None, help='keep the synthetic files in this folder')
+	parser.add_argument('--out', default=None, help='json report file, default prints to stdout')
+	return parser.parse_args(argv)
+
+if __name__ == '__main__':
+	args = parse_args(sys.argv[1:])
+	sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+	unknown = [size for size in sizes if not size in SIZES]
+	if unknown:
+		print('[Error] unknown size: %s' % ', '.join(unknown))
+		sys.exit(2)
+	report = run_benchmarks(sizes, args.repeat, args.work_dir)
+	text = json.dumps(report, indent=2)
+	if args.out:
+		with open(args.out, 'w') as out_fp:
+			out_fp.write(text)
+	else:
+		print(text)
@@ -0,0 +1,190 @@
+#encoding = utf-8
+"""convert a cpk unpacked folder to model and texture files without blender
+
+    python convert.py cpk_unpacked_folder --out out_folder --formats glb,obj,dds --jobs 8
+
+every .dtt (model, texture data) is paired with the .dat of the same name (texture
+table), the needed entries are streamed out of both archives into
+out/<relative path>/<name>.dtt|.dat/ and converted there by a pool of processes.
+textures go to the texture folder next to the models, a json report sums it up.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+ADDON_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if not ADDON_PATH in sys.path:
+	sys.path.append(ADDON_PATH)
+
+from nier2blender.util import open_reader, create_dir
+from nier2blender.dat_unpacker import read_entries, extract_entry
+from nier2blender.wmb import WMB3, export_obj
+from nier2blender.glb_exporter import export_glb
+from nier2blender.log import get_logger
+
+log = get_logger('convert')
+
+FORMATS = ('glb', 'obj', 'dds')
+# archive entries a conversion needs, the rest stays in the archives
+DTT_EXTENSIONS = ('wmb', 'wtp')
+DAT_EXTENSIONS = ('wta',)
+TEXTURE_DIR = 'texture'
+
+def find_pairs(root):
+	"""[(dtt_file, dat_file or None)] under root"""
+	pairs = []
+	for dirpath, dirnames, filenames in os.walk(root):
+		lower_names = dict([(filename.lower(), filename) for filename in filenames])
+		for filename in filenames:
+			name, ext = os.path.splitext(filename)
+			if ext.lower() != '.dtt':
+				continue
+			dat_name = lower_names.get(name.lower() + '.dat')
+			pairs.append((os.path.join(dirpath, filename), dat_name and os.path.join(dirpath, dat_name)))
+	return sorted(pairs)
+
+def extract_entries(archive, out_dir, extensions):
+	"""stream the entries with extensions out of archive, returns the written files"""
+	files = []
+	with open_reader(archive) as fp:
+		for index, filename, offset, size, extension in read_entries(fp):
+			if extension.lower() in extensions:
+				create_dir(out_dir)
+				files.append(extract_entry(fp, offset, size, os.path.join(out_dir, filename)))
+	return files
+
+def dump_textures(wmb, texture_dir):
+	"""every texture of the model's wta/wtp as <identifier>.dds"""
+	if not wmb.wta or not wmb.wtp_file:
+		return 0
+	create_dir(texture_dir)
+	count = 0
+	for index in wmb.wta.getUniqueTextureIndices():
+		identifier = wmb.wta.getTextureIdentifier(index)
+		wmb.wta.extractTextureByIndex(index, wmb.wtp_file, os.path.join(texture_dir, '%s.dds' % identifier))
+		count += 1
+	return count
+
+def convert_pair(job):
+	"""extract and convert one dtt/dat pair, runs in a worker process"""
+	start = time.time()
+	result = {'dtt': job['dtt'], 'dat': job['dat'], 'models': [], 'outputs': [], 'textures': 0, 'error': None}
+	try:
+		dtt_dir = os.path.join(job['out'], job['name'] + '.dtt')
+		extracted = extract_entries(job['dtt'], dtt_dir, DTT_EXTENSIONS)
+		if job['dat']:
+			# WMB3 looks for the wta in the .dat folder next to the .dtt folder
+			extracted += extract_entries(job['dat'], os.path.join(job['out'], job['name'] + '.dat'), DAT_EXTENSIONS)
+		lods = None if job['lods'] is None else tuple(job['lods'])
+		texture_dir = os.path.join(dtt_dir, TEXTURE_DIR)
+		for wmb_file in [f for f in extracted if f.lower().endswith('.wmb')]:
+			model = os.path.splitext(os.path.basename(wmb_file))[0]
+			wmb = WMB3(wmb_file)
+			if 'dds' in job['formats']:
+				result['textures'] += dump_textures(wmb, texture_dir)
+			if 'glb' in job['formats']:
+				glb_file = os.path.join(dtt_dir, model + '.glb')
+				export_glb(wmb, glb_file, lods, TEXTURE_DIR + '/')
+				result['outputs'].append(glb_file)
+			if 'obj' in job['formats']:
+				# the mtl files reference ../texture, filled by the dds format
+				result['outputs'] += export_obj(wmb, model, dtt_dir, lods, dump_textures = False)
+			result['models'].append(model)
+		if not job['keep']:
+			for extracted_file in extracted:
+				os.remove(extracted_file)
+	except Exception as e:
+		# a broken archive must not stop the whole conversion
+		result['error'] = '%s: %s' % (type(e).__name__, e)
+	result['status'] = 'failed' if result['error'] else 'ok'
+	result['seconds'] = time.time() - start
+	return result
+
+def make_jobs(root, out_dir, formats, lods=(0,), keep=True):
+	jobs = []
+	for dtt_file, dat_file in find_pairs(root):
+		rel_dir = os.path.relpath(os.path.dirname(dtt_file), root)
+		jobs.append({
+			'name': os.path.splitext(os.path.basename(dtt_file))[0],
+			'dtt': dtt_file,
+			'dat': dat_file,
+			'out': os.path.normpath(os.path.join(out_dir, rel_dir)),
+			'formats': list(formats),
+			'lods': None if lods is None else list(lods),
+			'keep': keep,
+			'size': os.path.getsize(dtt_file),
+		})
+	# large archives first keeps the pool busy at the end
+	jobs.sort(key=lambda job: job['size'], reverse=True)
+	return jobs
+
+def run_conversion(root, out_dir, formats=FORMATS, jobs=None, lods=(0,), keep=True, report_file=None):
+	"""convert every dtt/dat pair under root, returns the report dict"""
+	start = time.time()
+	create_dir(out_dir)
+	job_list = make_jobs(root, out_dir, formats, lods, keep)
+	processes = max(1, min(jobs or multiprocessing.cpu_count(), len(job_list) or 1))
+	results = []
+	if processes == 1:
+		iterator = map(convert_pair, job_list)
+		pool = None
+	else:
+		pool = multiprocessing.Pool(processes)
+		iterator = pool.imap_unordered(convert_pair, job_list)
+	try:
+		for result in iterator:
+			if result['error']:
+				log.error('%s: %s', result['dtt'], result['error'])
+			else:
+				log.info('%s: %d model(s), %d output(s), %d texture(s) in %.2fs', result['dtt'],
+					len(result['models']), len(result['outputs']), result['textures'], result['seconds'])
+			results.append(result)
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+	report = {
+		'root': root,
+		'formats': list(formats),
+		'processes': processes,
+		'total_seconds': time.time() - start,
+		'job_count': len(job_list),
+		'failed_count': len([result for result in results if result['status'] != 'ok']),
+		'model_count': sum([len(result['models']) for result in results]),
+		'output_count': sum([len(result['outputs']) for result in results]),
+		'texture_count': sum([result['textures'] for result in results]),
+		'jobs': sorted(results, key=lambda result: result['dtt']),
+	}
+	if report_file:
+		with open(report_file, 'w') as report_fp:
+			json.dump(report, report_fp, indent=2)
+	return report
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description='convert Nier:Automata dtt/dat pairs to model and texture files')
+	parser.add_argument('input', help='cpk unpacked folder')
+	parser.add_argument('--out', required=True, help='output folder')
+	parser.add_argument('--formats', default=','.join(FORMATS), help='comma separated: %s' % ', '.join(FORMATS))
+	parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+	parser.add_argument('--lod', type=int, default=0, help='LOD level to convert')
+	parser.add_argument('--all-lods', action='store_true', help='convert every LOD level')
+	parser.add_argument('--clean', action='store_true', help='remove the extracted wmb/wtp/wta files afterwards')
+	parser.add_argument('--report', default=None, help='json report file, default is out/convert_report.json')
+	return parser.parse_args(argv)
+
+if __name__ == '__main__':
+	args = parse_args(sys.argv[1:])
+	formats = [f.strip().lower() for f in args.formats.split(',') if f.strip()]
+	unknown = [f for f in formats if not f in FORMATS]
+	if unknown:
+		print('[Error] unknown format: %s' % ', '.join(unknown))
+		sys.exit(2)
+	report = run_conversion(args.input, args.out, formats, args.jobs,
+		None if args.all_lods else (args.lod,), not args.clean,
+		args.report or os.path.join(args.out, 'convert_report.json'))
+	print('[Info] %d pair(s), %d failed, %d model(s), %d texture(s), %.2fs' % (report['job_count'],
+		report['failed_count'], report['model_count'], report['texture_count'], report['total_seconds']))
+	sys.exit(1 if report['failed_count'] else 0)
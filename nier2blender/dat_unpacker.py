@@ -2,6 +2,15 @@
 import os
 import sys
 import struct
+try:
+	from nier2blender.util import open_reader
+	from nier2blender.log import get_logger
+except ImportError:
+	# run as a standalone script from the addon folder
+	from util import open_reader
+	from log import get_logger
+
+log = get_logger('dat')
 
 def little_endian_to_float(bs):
     return struct.unpack("<f", bs)[0]
@@ -23,7 +32,7 @@ def read_header(fp):
 		SizeTableOffset = little_endian_to_int(fp.read(4))
 		UnknownOffset1C = little_endian_to_int(fp.read(4))
 		Unknown20 = little_endian_to_int(fp.read(4))
-		print(
+		log.debug(
 '''FileCount: %08x
 FileTableOffset: %08x
 ExtensionTableOffset:%08x
@@ -31,12 +40,12 @@ NameTableOffset:%08x
 SizeTableOffset:%08x
 UnknownOffset1C:%08x
 Unknown20:%08x
-'''%
-			(FileCount, FileTableOffset, ExtensionTableOffset,NameTableOffset,SizeTableOffset,UnknownOffset1C,Unknown20)
+''',
+			FileCount, FileTableOffset, ExtensionTableOffset,NameTableOffset,SizeTableOffset,UnknownOffset1C,Unknown20
 		)
 		return (FileCount, FileTableOffset, ExtensionTableOffset,NameTableOffset,SizeTableOffset,UnknownOffset1C,Unknown20)
 	else:
-		print('[-] error magic number detected')
+		log.error('error magic number detected')
 		return False
 
 def get_fileinfo(fp, index, FileTableOffset, ExtensionTableOffset, NameTableOffset, SizeTableOffset):
@@ -53,23 +62,64 @@ def get_fileinfo(fp, index, FileTableOffset, ExtensionTableOffset, NameTableOffs
 		if list(fp.read(FilenameAlignment))[FilenameAlignment-1] == 0:
 			i += 1
 	Filename = fp.read(256).split(b'\x00')[0].decode('ascii')
-	print(
+	log.debug(
 '''
 FileIndex: %d
 Filename: %s
 FileOffset: %08x
 Size: %08x
-Extension: %s'''%
-(index,Filename,FileOffset,Size,Extension)
+Extension: %s''',
+index,Filename,FileOffset,Size,Extension
 		)
 	return index,Filename,FileOffset,Size,Extension
 
+def read_entries(fp):
+	"""[(index, Filename, FileOffset, Size, Extension)] of every file, the tables are read in one pass"""
+	headers = read_header(fp)
+	if not headers:
+		return []
+	FileCount, FileTableOffset, ExtensionTableOffset, NameTableOffset, SizeTableOffset = headers[:5]
+	fp.seek(FileTableOffset)
+	FileOffsets = struct.unpack('<%dI' % FileCount, fp.read(FileCount * 4))
+	fp.seek(ExtensionTableOffset)
+	Extensions = fp.read(FileCount * 4)
+	fp.seek(SizeTableOffset)
+	Sizes = struct.unpack('<%dI' % FileCount, fp.read(FileCount * 4))
+	fp.seek(NameTableOffset)
+	FilenameAlignment = little_endian_to_int(fp.read(4))
+	entries = []
+	for index in range(FileCount):
+		# a name takes records of FilenameAlignment bytes up to one ending with 0
+		name = b''
+		while True:
+			record = fp.read(FilenameAlignment)
+			name += record
+			if not record or record[-1] == 0:
+				break
+		Filename = name.split(b'\x00')[0].decode('ascii')
+		Extension = Extensions[index * 4: index * 4 + 4].split(b'\x00')[0].decode('utf-8')
+		entries.append((index, Filename, FileOffsets[index], Sizes[index], Extension))
+	return entries
+
+def extract_entry(fp, FileOffset, Size, out_file, chunk_size = 0x100000):
+	"""copy one file of the archive to out_file in chunks"""
+	fp.seek(FileOffset)
+	remain = Size
+	with open(out_file, 'wb') as out_fp:
+		while remain > 0:
+			chunk = fp.read(min(chunk_size, remain))
+			if not chunk:
+				break
+			out_fp.write(chunk)
+			remain -= len(chunk)
+	return out_file
+
 def extract_file(fp, filename, FileOffset, Size, extract_dir):
 	create_dir(extract_dir)
 	fp.seek(FileOffset)
 	FileContent = fp.read(Size)
 	outfile = open(extract_dir + '/'+filename,'wb')
-	print("extracting file %s to %s/%s"%(filename,extract_dir,filename))
+	log.info("extracting file %s to %s/%s", filename, extract_dir, filename)
 	outfile.write(FileContent)
 	outfile.close()
 	if filename.find('wtp') > -1 :
@@ -78,20 +128,20 @@ def extract_file(fp, filename, FileOffset, Size, extract_dir):
 		dds_group = content.split(b'DDS ')
 		dds_group = dds_group[1:]
 		for i in range(len(dds_group)):
-			print("unpacking %s to %s/%s"%(filename,extract_dir ,filename.replace('.wtp','_%d.dds'%i)))
+			log.debug("unpacking %s to %s/%s", filename, extract_dir, filename.replace('.wtp','_%d.dds'%i))
 			dds_fp = open(extract_dir + '/'+filename.replace('.wtp','_%d.dds'%i), "wb")
 			dds_fp.write(b'DDS ')
 			dds_fp.write(dds_group[i])
 			dds_fp.close()
 		wtp_fp.close()
+		log.info("unpacked %d dds from %s", len(dds_group), filename)
 		#os.remove("%s/%s"%(extract_dir,filename))
-	print("done")
 
 def get_all_files(path):
 	pass
 
 def main(filename, extract_dir, ROOT_DIR):
-	fp = open(filename,"rb")
+	fp = open_reader(filename)
 	headers = read_header(fp)
 	if headers:
 		FileCount, FileTableOffset, ExtensionTableOffset,NameTableOffset,SizeTableOffset,UnknownOffset1C,Unknown20 = headers
@@ -101,6 +151,7 @@ def main(filename, extract_dir, ROOT_DIR):
 			if extract_dir != '':
 				extract_dir_sub = extract_dir + '\\' + filename.replace(ROOT_DIR ,'') 
 				extract_file(fp, Filename, FileOffset, Size, extract_dir_sub)
+	fp.close()
 
 
 if __name__ == '__main__':
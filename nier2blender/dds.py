@@ -0,0 +1,165 @@
+#encoding = utf-8
+"""DDS header parsing and mip chain slicing
+
+a preview DDS keeps only the mip levels at or below a target size, copied as they
+are from the source (no recompression). the levels of a 4096 texture from 1024 down
+take 1/16 of the memory, from 512 down 1/64.
+"""
+from nier2blender.util import get_struct
+
+DDS_MAGIC = b'DDS '
+DDS_HEADER_SIZE = 4 + 124
+DX10_HEADER_SIZE = 20
+
+DDSD_PITCH = 0x8
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_LINEARSIZE = 0x80000
+DDPF_FOURCC = 0x4
+DDSCAPS_COMPLEX = 0x8
+DDSCAPS_MIPMAP = 0x400000
+DDSCAPS2_CUBEMAP = 0x200
+DDSCAPS2_VOLUME = 0x200000
+
+# bytes per 4x4 block
+FOURCC_BLOCK_SIZES = {
+	b'DXT1': 8, b'ATI1': 8, b'BC4U': 8, b'BC4S': 8,
+	b'DXT2': 16, b'DXT3': 16, b'DXT4': 16, b'DXT5': 16,
+	b'ATI2': 16, b'BC5U': 16, b'BC5S': 16,
+}
+DXGI_BLOCK_SIZES = {}
+for dxgi_format in (70, 71, 72, 79, 80, 81):
+	DXGI_BLOCK_SIZES[dxgi_format] = 8
+for dxgi_format in (73, 74, 75, 76, 77, 78, 82, 83, 84, 94, 95, 96, 97, 98, 99):
+	DXGI_BLOCK_SIZES[dxgi_format] = 16
+# bytes per pixel of the common uncompressed dxgi formats
+DXGI_PIXEL_SIZES = {
+	2: 16, 10: 8, 11: 8, 24: 4, 27: 4, 28: 4, 29: 4, 41: 4,
+	49: 2, 61: 1, 65: 1, 85: 2, 86: 2, 87: 4, 88: 4, 91: 4,
+}
+
+class DDSHeader(object):
+	"""DDS_HEADER (+ DDS_HEADER_DX10) of a DDS file"""
+	def __init__(self, data):
+		if len(data) < DDS_HEADER_SIZE or data[:4] != DDS_MAGIC:
+			raise ValueError('not a DDS file')
+		(self.size, self.flags, self.height, self.width, self.pitchOrLinearSize, self.depth,
+			self.mipMapCount) = get_struct('<7I').unpack_from(data, 4)
+		(self.pixelFormatSize, self.pixelFormatFlags, self.fourCC, self.rgbBitCount,
+			self.rBitMask, self.gBitMask, self.bBitMask, self.aBitMask) = get_struct('<2I4s5I').unpack_from(data, 0x4c)
+		self.caps, self.caps2, self.caps3, self.caps4 = get_struct('<4I').unpack_from(data, 0x6c)
+		self.dxgiFormat = None
+		self.arraySize = 1
+		self.dataOffset = DDS_HEADER_SIZE
+		if self.pixelFormatFlags & DDPF_FOURCC and self.fourCC == b'DX10':
+			if len(data) < DDS_HEADER_SIZE + DX10_HEADER_SIZE:
+				raise ValueError('truncated DX10 header')
+			(self.dxgiFormat, self.resourceDimension, self.miscFlag, self.arraySize,
+				self.miscFlags2) = get_struct('<5I').unpack_from(data, DDS_HEADER_SIZE)
+			self.dataOffset += DX10_HEADER_SIZE
+
+	def get_mip_count(self):
+		if self.flags & DDSD_MIPMAPCOUNT or self.caps & DDSCAPS_MIPMAP:
+			return max(1, self.mipMapCount)
+		return 1
+
+	def get_face_count(self):
+		"""surfaces stored one after the other, each with its own mip chain"""
+		faces = max(1, self.arraySize)
+		if self.caps2 & DDSCAPS2_CUBEMAP:
+			faces *= 6
+		return faces
+
+	def get_block_size(self):
+		"""bytes per 4x4 block, None for uncompressed formats"""
+		if self.dxgiFormat is not None:
+			return DXGI_BLOCK_SIZES.get(self.dxgiFormat)
+		if self.pixelFormatFlags & DDPF_FOURCC:
+			return FOURCC_BLOCK_SIZES.get(self.fourCC)
+		return None
+
+	def get_pixel_size(self):
+		"""bytes per pixel of uncompressed formats, None when unknown"""
+		if self.dxgiFormat is not None:
+			return DXGI_PIXEL_SIZES.get(self.dxgiFormat)
+		if self.pixelFormatFlags & DDPF_FOURCC:
+			return None
+		return self.rgbBitCount // 8 or None
+
+	def get_level_size(self, width, height):
+		block_size = self.get_block_size()
+		if block_size is not None:
+			return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * block_size
+		pixel_size = self.get_pixel_size()
+		if pixel_size is None:
+			return None
+		return width * height * pixel_size
+
+	def get_levels(self):
+		"""[(width, height, size)] of the mip chain of one face, None for unknown formats"""
+		levels = []
+		width, height = self.width, self.height
+		for level in range(self.get_mip_count()):
+			size = self.get_level_size(width, height)
+			if size is None:
+				return None
+			levels.append((width, height, size))
+			width, height = max(1, width // 2), max(1, height // 2)
+		return levels
+
+	def can_slice(self):
+		return self.get_levels() is not None and not self.caps2 & DDSCAPS2_VOLUME and self.depth <= 1
+
+def read_header(fp):
+	"""DDSHeader and the raw header bytes read from the current position of fp"""
+	data = fp.read(DDS_HEADER_SIZE)
+	if data[0x54:0x58] == b'DX10':
+		data += fp.read(DX10_HEADER_SIZE)
+	return DDSHeader(data), data
+
+def select_levels(levels, max_size):
+	"""index of the first level at or below max_size, the smallest level when none is"""
+	for index, (width, height, size) in enumerate(levels):
+		if max(width, height) <= max_size:
+			return index
+	return len(levels) - 1
+
+def make_preview_header(header, raw_header, levels, first_level):
+	"""raw_header describing the mip chain from first_level on"""
+	width, height, size = levels[first_level]
+	data = bytearray(raw_header)
+	pitch = size
+	if header.get_block_size() is None:
+		pitch = width * header.get_pixel_size()
+	get_struct('<4I').pack_into(data, 0xc, height, width, pitch, header.depth)
+	get_struct('<I').pack_into(data, 0x1c, len(levels) - first_level)
+	return bytes(data)
+
+def write_preview(fp, base_offset, out_fp, max_size, chunk_size=0x100000):
+	"""copy the DDS at base_offset of fp to out_fp with only the mips at or below max_size
+
+	only the kept levels are read from fp. returns (width, height) of the written
+	top level, or None without writing anything when the data isn't a DDS or its
+	format can't be sliced
+	"""
+	fp.seek(base_offset)
+	try:
+		header, raw_header = read_header(fp)
+	except ValueError:
+		return None
+	levels = header.get_levels() if header.can_slice() else None
+	if levels is None:
+		return None
+	first_level = select_levels(levels, max_size)
+	out_fp.write(make_preview_header(header, raw_header, levels, first_level))
+	face_size = sum([size for width, height, size in levels])
+	skip_size = sum([size for width, height, size in levels[:first_level]])
+	for face in range(header.get_face_count()):
+		fp.seek(base_offset + header.dataOffset + face * face_size + skip_size)
+		remain = face_size - skip_size
+		while remain > 0:
+			chunk = fp.read(min(chunk_size, remain))
+			if not chunk:
+				break
+			out_fp.write(chunk)
+			remain -= len(chunk)
+	return levels[first_level][:2]
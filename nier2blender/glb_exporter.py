@@ -0,0 +1,275 @@
+#encoding = utf-8
+"""binary glTF 2.0 export of a WMB3 model, no blender needed
+
+the vertex and index buffers of every vertex group are written once, every
+mesh is a primitive indexing into them. bones become nodes of one skin and
+textures are referenced by identifier as .dds images (MSFT_texture_dds).
+"""
+import os
+import sys
+import json
+import struct
+import numpy as np
+from nier2blender.wmb import WMB3
+from nier2blender.log import get_logger
+
+log = get_logger('glb')
+
+GLB_MAGIC = b'glTF'
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+COMPONENT_TYPES = {
+	np.dtype('int8'): 5120,
+	np.dtype('uint8'): 5121,
+	np.dtype('int16'): 5122,
+	np.dtype('uint16'): 5123,
+	np.dtype('uint32'): 5125,
+	np.dtype('float32'): 5126,
+}
+ACCESSOR_TYPES = {1: 'SCALAR', 2: 'VEC2', 3: 'VEC3', 4: 'VEC4', 16: 'MAT4'}
+
+class GLBBuilder(object):
+	"""collect buffer views and accessors of one binary buffer"""
+	def __init__(self):
+		self.gltf = {
+			'asset': {'version': '2.0', 'generator': 'nier2blender'},
+			'scene': 0,
+			'scenes': [{'nodes': []}],
+			'nodes': [],
+			'meshes': [],
+			'materials': [],
+			'textures': [],
+			'images': [],
+			'skins': [],
+			'accessors': [],
+			'bufferViews': [],
+			'buffers': [],
+		}
+		self.chunks = []
+		self.size = 0
+
+	def add_buffer_view(self, data, target=None):
+		"""append a numpy array to the binary buffer, returns the buffer view index"""
+		data = np.ascontiguousarray(data)
+		padding = (-self.size) % 4
+		if padding:
+			self.chunks.append(b'\x00' * padding)
+			self.size += padding
+		view = {'buffer': 0, 'byteOffset': self.size, 'byteLength': data.nbytes}
+		if target is not None:
+			view['target'] = target
+		self.chunks.append(data.tobytes())
+		self.size += data.nbytes
+		self.gltf['bufferViews'].append(view)
+		return len(self.gltf['bufferViews']) - 1
+
+	def add_accessor(self, view, dtype, count, components, byte_offset=0, normalized=False, min_max=None):
+		accessor = {
+			'bufferView': view,
+			'componentType': COMPONENT_TYPES[np.dtype(dtype)],
+			'count': int(count),
+			'type': ACCESSOR_TYPES[components],
+		}
+		if byte_offset:
+			accessor['byteOffset'] = int(byte_offset)
+		if normalized:
+			accessor['normalized'] = True
+		if min_max is not None:
+			accessor['min'] = [float(v) for v in min_max[0]]
+			accessor['max'] = [float(v) for v in min_max[1]]
+		self.gltf['accessors'].append(accessor)
+		return len(self.gltf['accessors']) - 1
+
+	def add_array(self, data, target=None, normalized=False, with_min_max=False):
+		"""buffer view and accessor of a (count, components) array"""
+		data = np.ascontiguousarray(data)
+		components = data.shape[1] if data.ndim > 1 else 1
+		if data.ndim > 2:
+			components = data.shape[1] * data.shape[2]
+		min_max = None
+		if with_min_max and len(data):
+			min_max = (data.min(axis=0), data.max(axis=0))
+		view = self.add_buffer_view(data, target)
+		return self.add_accessor(view, data.dtype, len(data), components, normalized=normalized, min_max=min_max)
+
+	def write(self, glb_file):
+		gltf = dict([(key, value) for key, value in self.gltf.items() if value != []])
+		gltf['buffers'] = [{'byteLength': self.size}]
+		json_chunk = json.dumps(gltf, separators=(',', ':')).encode('utf8')
+		json_chunk += b' ' * ((-len(json_chunk)) % 4)
+		bin_padding = b'\x00' * ((-self.size) % 4)
+		bin_length = self.size + len(bin_padding)
+		length = 12 + 8 + len(json_chunk) + 8 + bin_length
+		with open(glb_file, 'wb') as glb:
+			glb.write(struct.pack('<4sII', GLB_MAGIC, GLB_VERSION, length))
+			glb.write(struct.pack('<II', len(json_chunk), CHUNK_JSON))
+			glb.write(json_chunk)
+			glb.write(struct.pack('<II', bin_length, CHUNK_BIN))
+			for chunk in self.chunks:
+				glb.write(chunk)
+			glb.write(bin_padding)
+		return length
+
+def decode_normals(normal):
+	"""unit float normals of the packed signed byte normals"""
+	normals = normal[:, :3].astype(np.float32)
+	normals[normals > 127] -= 256
+	length = np.sqrt((normals * normals).sum(axis=1))
+	normals[length == 0] = (0.0, 1.0, 0.0)
+	length[length == 0] = 1.0
+	return normals / length[:, None]
+
+def get_vertex_joints(wmb, vertexGroupIndex, meshIndices):
+	"""global joint indices of a vertex group, the boneIndices of a mesh are local to its bone set"""
+	vertexData = wmb.vertexGroupArray[vertexGroupIndex].vertexData
+	joints = np.zeros((len(vertexData), 4), np.uint16)
+	boneMap = np.array(wmb.boneMap, np.int64)
+	for meshIndex in meshIndices:
+		mesh = wmb.meshArray[meshIndex]
+		if mesh.bonesetIndex >= len(wmb.boneSetArray):
+			continue
+		boneSet = np.array(wmb.boneSetArray[mesh.bonesetIndex], np.int64)
+		rows = slice(mesh.vertexStart, mesh.vertexStart + mesh.vertexCount)
+		joints[rows] = boneMap[boneSet[vertexData['boneIndices'][rows]]]
+	return joints
+
+def add_skeleton(builder, wmb):
+	"""one node per bone, returns the skin index"""
+	nodes = builder.gltf['nodes']
+	positions = np.array([bone.world_position for bone in wmb.boneArray], np.float32).reshape(-1, 3)
+	for bone in wmb.boneArray:
+		nodes.append({'name': bone.boneName, 'extras': {'boneNumber': bone.boneNumber}})
+	for bone in wmb.boneArray:
+		translation = positions[bone.boneIndex]
+		if bone.parentName is not None:
+			translation = translation - positions[bone.parentIndex]
+			nodes[bone.parentIndex].setdefault('children', []).append(bone.boneIndex)
+		else:
+			builder.gltf['scenes'][0]['nodes'].append(bone.boneIndex)
+		nodes[bone.boneIndex]['translation'] = [float(v) for v in translation]
+	# bones carry no rest rotation, the inverse bind matrix only undoes the position
+	matrices = np.tile(np.identity(4, np.float32), (len(positions), 1, 1))
+	matrices[:, 3, :3] = -positions
+	skin = {
+		'joints': list(range(len(positions))),
+		'inverseBindMatrices': builder.add_array(matrices.reshape(-1, 4, 4)),
+	}
+	builder.gltf['skins'].append(skin)
+	return len(builder.gltf['skins']) - 1
+
+def add_materials(builder, wmb, texture_dir=''):
+	"""glTF materials of the wmb materials, textures are <texture_dir><identifier>.dds images"""
+	textureIndex = {}
+	def get_texture(identifier):
+		if not identifier in textureIndex:
+			builder.gltf['images'].append({'uri': '%s%s.dds' % (texture_dir, identifier), 'name': identifier})
+			builder.gltf['textures'].append({'extensions': {'MSFT_texture_dds': {'source': len(builder.gltf['images']) - 1}}})
+			textureIndex[identifier] = len(builder.gltf['textures']) - 1
+		return textureIndex[identifier]
+	for material in wmb.materialArray:
+		gltfMaterial = {
+			'name': material.materialName,
+			'pbrMetallicRoughness': {'metallicFactor': 0.0},
+			'extras': {
+				'effect': material.effectName,
+				'technique': material.techniqueName,
+				'textures': material.textureArray,
+				'uniforms': material.uniformArray,
+			},
+		}
+		if 'g_AlbedoMap' in material.textureArray:
+			gltfMaterial['pbrMetallicRoughness']['baseColorTexture'] = {'index': get_texture(material.textureArray['g_AlbedoMap'])}
+		if 'g_NormalMap' in material.textureArray:
+			gltfMaterial['normalTexture'] = {'index': get_texture(material.textureArray['g_NormalMap'])}
+		builder.gltf['materials'].append(gltfMaterial)
+	if textureIndex:
+		builder.gltf['extensionsUsed'] = ['MSFT_texture_dds']
+
+def add_vertex_group(builder, wmb, vertexGroupIndex, meshIndices, skinned):
+	"""attribute accessors and the index buffer view of a vertex group"""
+	vertexGroup = wmb.vertexGroupArray[vertexGroupIndex]
+	vertexData = vertexGroup.vertexData
+	attributes = {
+		'POSITION': builder.add_array(vertexData['position'], ARRAY_BUFFER, with_min_max=True),
+		'NORMAL': builder.add_array(decode_normals(vertexData['normal']), ARRAY_BUFFER),
+		'TEXCOORD_0': builder.add_array(vertexData['uv'].astype(np.float32), ARRAY_BUFFER),
+	}
+	if skinned and 'boneWeights' in vertexData.dtype.names:
+		attributes['JOINTS_0'] = builder.add_array(get_vertex_joints(wmb, vertexGroupIndex, meshIndices), ARRAY_BUFFER)
+		attributes['WEIGHTS_0'] = builder.add_array(vertexData['boneWeights'], ARRAY_BUFFER, normalized=True)
+	indexView = builder.add_buffer_view(vertexGroup.faceData, ELEMENT_ARRAY_BUFFER)
+	return attributes, indexView
+
+def get_lod_meshes(wmb, lods, region=None):
+	"""[(meshArrayIndex, materialIndex, meshGroupIndex)] of the selected LODs, lods None means all
+
+	region (min xyz, max xyz) keeps the mesh groups whose bounding box intersects it
+	"""
+	meshes = []
+	meshGroups = wmb.get_region_mesh_groups(region)
+	for lodIndex, meshGroupInfo in enumerate(wmb.meshGroupInfoArray):
+		if lods is not None and not lodIndex in lods:
+			continue
+		for groupedMeshIndex, groupedMesh in enumerate(meshGroupInfo.groupedMeshArray):
+			if not groupedMesh.meshGroupIndex in meshGroups:
+				continue
+			meshes.append((meshGroupInfo.meshStart + groupedMeshIndex, groupedMesh.materialIndex, groupedMesh.meshGroupIndex))
+	return meshes
+
+def export_glb(wmb, glb_file, lods=(0,), texture_dir='', region=None):
+	"""write wmb as a .glb file, returns its size in bytes
+
+	texture_dir is the uri prefix of the .dds images, relative to glb_file,
+	region limits the export to the mesh groups intersecting it
+	"""
+	builder = GLBBuilder()
+	skin = None
+	if wmb.hasBone and wmb.boneArray:
+		skin = add_skeleton(builder, wmb)
+	add_materials(builder, wmb, texture_dir)
+
+	lodMeshes = get_lod_meshes(wmb, lods, region)
+	groupMeshes = {}
+	for meshArrayIndex, materialIndex, meshGroupIndex in lodMeshes:
+		groupMeshes.setdefault(wmb.meshArray[meshArrayIndex].vertexGroupIndex, []).append(meshArrayIndex)
+	vertexGroups = {}
+	for vertexGroupIndex in sorted(groupMeshes.keys()):
+		vertexGroups[vertexGroupIndex] = add_vertex_group(builder, wmb, vertexGroupIndex, groupMeshes[vertexGroupIndex], skin is not None)
+
+	for meshArrayIndex, materialIndex, meshGroupIndex in lodMeshes:
+		mesh = wmb.meshArray[meshArrayIndex]
+		faceCount = mesh.faceCount - mesh.faceCount % 3
+		if faceCount <= 0:
+			continue
+		vertexGroup = wmb.vertexGroupArray[mesh.vertexGroupIndex]
+		attributes, indexView = vertexGroups[mesh.vertexGroupIndex]
+		indices = builder.add_accessor(indexView, vertexGroup.faceData.dtype, faceCount, 1,
+			byte_offset=mesh.faceStart * vertexGroup.faceData.itemsize)
+		primitive = {'attributes': attributes, 'indices': indices}
+		if materialIndex < len(wmb.materialArray):
+			primitive['material'] = materialIndex
+		name = '%s_%d_%d' % (wmb.meshGroupArray[meshGroupIndex].meshGroupname, meshArrayIndex, mesh.vertexGroupIndex)
+		builder.gltf['meshes'].append({'name': name, 'primitives': [primitive]})
+		node = {'name': name, 'mesh': len(builder.gltf['meshes']) - 1}
+		if skin is not None and 'JOINTS_0' in attributes:
+			node['skin'] = skin
+		builder.gltf['nodes'].append(node)
+		builder.gltf['scenes'][0]['nodes'].append(len(builder.gltf['nodes']) - 1)
+
+	size = builder.write(glb_file)
+	log.info('exported %d meshes to %s (%d bytes)', len(builder.gltf['meshes']), glb_file, size)
+	return size
+
+def main(wmb_file, glb_file=None, lods=(0,)):
+	if glb_file is None:
+		glb_file = os.path.splitext(wmb_file)[0] + '.glb'
+	return export_glb(WMB3(wmb_file), glb_file, lods)
+
+if __name__ == '__main__':
+	for wmb_file in sys.argv[1:]:
+		main(wmb_file)
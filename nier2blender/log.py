@@ -0,0 +1,94 @@
+#encoding = utf-8
+"""shared logging of the parsers and importers
+
+every module logs through get_logger(subsystem), a child of the 'nier2blender'
+logger. messages take %-style arguments and are only formatted when their level
+is enabled, per-element details go to DEBUG and are summed up with Tally.
+
+switches, from code or the NIER2BLENDER_LOG environment variable:
+    NIER2BLENDER_LOG="info,wmb=debug,mot=warning"
+"""
+import os
+import sys
+import logging
+from collections import OrderedDict
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+LEVELS = {
+	'debug': DEBUG,
+	'info': INFO,
+	'warning': WARNING,
+	'error': ERROR,
+	'off': logging.CRITICAL + 1,
+}
+
+ROOT_NAME = 'nier2blender'
+ENV_VAR = 'NIER2BLENDER_LOG'
+
+class PrefixFormatter(logging.Formatter):
+	"""'[Info] message', the format the addon always printed"""
+	def format(self, record):
+		return '[%s] %s' % (record.levelname.capitalize(), record.getMessage())
+
+root_logger = logging.getLogger(ROOT_NAME)
+
+def get_logger(subsystem):
+	return logging.getLogger('%s.%s' % (ROOT_NAME, subsystem))
+
+def set_level(level, subsystem=None):
+	"""level name or number, for the whole package or one subsystem"""
+	if not isinstance(level, int):
+		level = LEVELS[level.lower()]
+	logger = root_logger if subsystem is None else get_logger(subsystem)
+	logger.setLevel(level)
+
+def configure(spec):
+	"""apply a 'level,subsystem=level,...' spec"""
+	for item in spec.split(','):
+		item = item.strip()
+		if not item:
+			continue
+		if '=' in item:
+			subsystem, level = item.split('=', 1)
+			set_level(level.strip(), subsystem.strip())
+		else:
+			set_level(item)
+
+def setup():
+	if not root_logger.handlers:
+		handler = logging.StreamHandler(sys.stdout)
+		handler.setFormatter(PrefixFormatter())
+		root_logger.addHandler(handler)
+		root_logger.propagate = False
+	root_logger.setLevel(INFO)
+	configure(os.environ.get(ENV_VAR, ''))
+
+class Tally(object):
+	"""count repeated events and report them as one line instead of one per element"""
+	def __init__(self, logger, level=WARNING):
+		self.logger = logger
+		self.level = level
+		self.counts = OrderedDict()
+		self.examples = {}
+
+	def add(self, key, example=None):
+		self.counts[key] = self.counts.get(key, 0) + 1
+		if example is not None and not key in self.examples:
+			self.examples[key] = example
+
+	def report(self, title):
+		if not self.counts or not self.logger.isEnabledFor(self.level):
+			return
+		items = []
+		for key, count in self.counts.items():
+			if key in self.examples:
+				items.append('%s x%d (e.g. %s)' % (key, count, self.examples[key]))
+			else:
+				items.append('%s x%d' % (key, count))
+		self.logger.log(self.level, '%s: %s', title, ', '.join(items))
+
+setup()
@@ -1,9 +1,38 @@
 import numpy
 import struct
+import multiprocessing
 from io import IOBase
+from nier2blender.util import BufferReader, open_reader
+from nier2blender.log import get_logger, Tally
+
+log = get_logger('mot')
+
+SIGN = b"mot\x00"
+VERSION = 0x20120405
 
 class MOT(object):
-	pass
+	"""parsed .mot file, motion is the evaluated MotionData of its tracks"""
+	def __init__(self, mot_file):
+		super(MOT, self).__init__()
+		with open_reader(mot_file, "<") as motReader:
+			assert motReader.get("4s") == SIGN
+
+			version = motReader.get("I")
+			assert version == VERSION
+
+			self.unk0 = motReader.get("H")
+			self.frame_count = motReader.get("H")
+			track_offset = motReader.get("I")
+			track_count = motReader.get("I")
+			self.unk1 = motReader.get("I")
+			self.name = motReader.get("20s").decode('utf8').rstrip("\x00")
+
+			log.debug("MOT header: 0x%x, %d, name=%s, frame=%d",
+				self.unk0, self.unk1, self.name, self.frame_count)
+
+			self.tracks = read_track(motReader, track_offset, track_count)
+		self.motion = read_motionData(self.frame_count, self.tracks)
+
 
 class HermitKeyframe(object):
 
@@ -20,32 +49,63 @@ class HermitKeyframe(object):
 
 
 class HermitSpline(object):
+	"""columnar hermite keys: frame indices, values p, incoming tangents a, outgoing tangents d"""
+
+	def __init__(self, frames, p, a, d):
+		self.frames = frames
+		self.p = p
+		self.a = a
+		self.d = d
 
-	def __init__(self, keyframes):
-		self.keyframes = keyframes
+	@property
+	def keyframes(self):
+		return [HermitKeyframe(int(self.frames[i]), (self.p[i], self.a[i], self.d[i]))
+			for i in range(len(self.frames))]
 
 	def eval(self, frameIndex):
-		if frameIndex <= self.keyframes[0].frameIndex:
-			return self.keyframes[0].p
-		if frameIndex >= self.keyframes[-1].frameIndex:
-			return self.keyframes[-1].p
-		i_ = 0
-		for i, k in enumerate(self.keyframes):
-			if frameIndex < k.frameIndex:
-				i_ = i - 1
-				break
-			if frameIndex == k.frameIndex:
-				return k.p
-		k1 = self.keyframes[i_]
-		k2 = self.keyframes[i_ + 1]
-
-		t = 1.0 * (frameIndex - k1.frameIndex) / (k2.frameIndex - k1.frameIndex)
+		frames = self.frames
+		if frameIndex <= frames[0]:
+			return self.p[0]
+		if frameIndex >= frames[-1]:
+			return self.p[-1]
+		i = int(numpy.searchsorted(frames, frameIndex, 'left'))
+		if frames[i] == frameIndex:
+			return self.p[i]
+		i_ = i - 1
+
+		t = 1.0 * (frameIndex - frames[i_]) / (frames[i] - frames[i_])
+		tt = t * t
+		ttt = tt * t
+		v = (2 * ttt - 3 * tt + 1) * self.p[i_] + (ttt - 2 * tt + t) * \
+                    self.d[i_] + (-2 * ttt + 3 * tt) * self.p[i] + (ttt - tt) * self.a[i]
+		return v
+
+	def eval_many(self, frameIndices):
+		"""same as eval for every frame of frameIndices, as a float64 array"""
+		f = numpy.asarray(frameIndices, dtype=numpy.float64)
+		frames = self.frames
+		if len(frames) == 1:
+			return numpy.full(f.shape, self.p[0], dtype=numpy.float64)
+		# first key at or after each frame, the segment is [i - 1, i]
+		i = numpy.clip(numpy.searchsorted(frames, f, 'left'), 1, len(frames) - 1)
+		i_ = i - 1
+		k1 = frames[i_]
+		k2 = frames[i]
+
+		with numpy.errstate(divide='ignore', invalid='ignore'):
+			t = (f - k1) / (k2 - k1)
 		tt = t * t
 		ttt = tt * t
-		v = (2 * ttt - 3 * t + 1) * k1.p + (ttt - 2 * tt + t) * \
-                    k1.d + (-2 * ttt + 3 * tt) * k2.p + (ttt - tt) * k2.a
+		v = (2 * ttt - 3 * tt + 1) * self.p[i_] + (ttt - 2 * tt + t) * \
+                    self.d[i_] + (-2 * ttt + 3 * tt) * self.p[i] + (ttt - tt) * self.a[i]
+		v = numpy.where(k2 == f, self.p[i], v)
+		v = numpy.where(f <= frames[0], self.p[0], v)
+		v = numpy.where(f >= frames[-1], self.p[-1], v)
 		return v
 
+	def eval_all(self, frame_count):
+		return self.eval_many(numpy.arange(frame_count))
+
 
 class PlainKeyframe(object):
 
@@ -58,16 +118,50 @@ class PlainKeyframe(object):
 
 
 class PlainSpline(object):
+	"""one value per frame"""
 
-	def __init__(self, keyframes):
-		self.keyframes = keyframes
+	def __init__(self, values):
+		self.values = values
+
+	@property
+	def keyframes(self):
+		return [PlainKeyframe(i, self.values[i]) for i in range(len(self.values))]
 
 	def eval(self, frameIndex):
-		if frameIndex <= self.keyframes[0].frameIndex:
-			return self.keyframes[0].value
-		if frameIndex >= self.keyframes[-1].frameIndex:
-			return self.keyframes[-1].value
-		return self.keyframes[frameIndex].value
+		if frameIndex <= 0:
+			return self.values[0]
+		if frameIndex >= len(self.values) - 1:
+			return self.values[-1]
+		return self.values[frameIndex]
+
+	def eval_many(self, frameIndices):
+		indices = numpy.clip(numpy.asarray(frameIndices, dtype=numpy.int64), 0, len(self.values) - 1)
+		return numpy.asarray(self.values, dtype=numpy.float64)[indices]
+
+	def eval_all(self, frame_count):
+		return self.eval_many(numpy.arange(frame_count))
+
+
+# keyframe record of every compress type, the header before the records is read separately
+KEYFRAME_FIELDS = {
+	1: [('p', 'f4')],
+	2: [('p', 'u2')],
+	3: [('p', 'u1')],
+	4: [('frame', 'u2'), ('pad', 'u2'), ('p', 'f4'), ('a', 'f4'), ('d', 'f4')],
+	5: [('frame', 'u2'), ('p', 'u2'), ('a', 'u2'), ('d', 'u2')],
+	6: [('frame', 'u1'), ('p', 'u1'), ('a', 'u1'), ('d', 'u1')],
+	7: [('frame', 'u1'), ('p', 'u1'), ('a', 'u1'), ('d', 'u1')],  # frame is a delta
+	8: [('frame', 'u2'), ('p', 'u1'), ('a', 'u1'), ('d', 'u1')],
+}
+_keyframe_dtypes = {}
+
+def get_keyframe_dtype(comtype, endian):
+	key = (comtype, endian)
+	dtype = _keyframe_dtypes.get(key)
+	if dtype is None:
+		dtype = numpy.dtype([(name, endian + fmt) for name, fmt in KEYFRAME_FIELDS[comtype]])
+		_keyframe_dtypes[key] = dtype
+	return dtype
 
 
 class Track(object):
@@ -93,161 +187,60 @@ class Track(object):
 		if self.offset > 0:
 			self.offset += offset
 
+	def read_keyframe_header(self, mot):
+		"""[base1, extent1, base2, extent2, ...] of the quantized types, None for raw types"""
+		if self.comtype in (2, 5):
+			return list(mot.get("2f" if self.comtype == 2 else "6f", force_tuple=True))
+		if self.comtype in (3, 6, 7, 8):
+			raw = mot.get("2H" if self.comtype == 3 else "6H", force_tuple=True)
+			return decompress_array(raw).astype(numpy.float64).tolist()
+		return None
+
 	def parse_keyframes(self, mot):
 		if self.offset <= 0:
 			return
-		C = FloatDecompressor(6, 9, 47)
+		assert self.comtype in KEYFRAME_FIELDS, ("unknown compress type %d" % self.comtype)
 
 		mot.seek(self.offset)
-		if self.comtype == 1:
-			keyframe_data = []
-			for i in range(self.keycount):
-				value = mot.get("f")
-				keyframe = PlainKeyframe(i, value)
-				keyframe_data.append(keyframe)
-				print (str(keyframe))
-
-			self.spline = PlainSpline(keyframe_data)
-
-		elif self.comtype == 2:  # 2 float + 1 unsigned short
-			values = mot.get("2f")
-			keyframe_data = []
-			for i in range(self.keycount):
-				value = values[0] + values[1] * mot.get("H")
-				keyframe = PlainKeyframe(i, value)
-				keyframe_data.append(keyframe)
-				print (str(keyframe))
-			self.spline = PlainSpline(keyframe_data)
-
-		elif self.comtype == 3:
-			values = []
-			for v in mot.get("2H"):
-				values.append(C.decompress(v))
-			keyframe_data = []
-			for i in range(self.keycount):
-				value = values[0] + values[1] * mot.get("B")
-				keyframe = PlainKeyframe(i, value)
-				keyframe_data.append(keyframe)
-				print (str(keyframe))
-
-			self.spline = PlainSpline(keyframe_data)
-
-		elif self.comtype == 4:
-			keyframe_data = []
-			for i in range(self.keycount):
-				values = mot.get("HHfff")
-				frameIndex = values[0]
-				assert values[1] == 0, "this is padding"
-				keyframe = HermitKeyframe(frameIndex, values[2:])
-				keyframe_data.append(keyframe)
-				print (str(keyframe))
-
-			self.spline = HermitSpline(keyframe_data)
-
-		elif self.comtype == 5:
-			values = list(mot.get("6f"))
-			keyframe_data = []
-
-			for i in range(self.keycount):
-				params = mot.get("4H")
-				frameIndex = params[0]
-				coeffs = [values[0] + params[1] * values[1],
-                                    values[2] + params[2] * values[3],
-                                    values[4] + params[3] * values[5]]
-				keyframe = HermitKeyframe(frameIndex, coeffs)
-				keyframe_data.append(keyframe)
-				print (str(keyframe))
-
-			self.spline = HermitSpline(keyframe_data)
-
-		elif self.comtype == 6:
-			# values as [base1, extent1],[base2, extent2],[base3, extent3]
-			raw = mot.get_raw(0xc)
-			print ("raw = ", map(hex, struct.unpack("HHHHHH", raw)))
-
-			values = []
-			for v in struct.unpack("6H", raw):
-				values.append(C.decompress(v))
-			print ("values =", values)
-			# print ("floatDecompressor", values)
-            #
-            #
-			# values = numpy.frombuffer(raw, dtype=numpy.dtype("<f2"))
-			keyframe_data = []
-			for i in range(self.keycount):
-				params = mot.get("4B")
-
-				frameIndex = params[0]
-				coeffs = [values[0] + params[1] * values[1],
-                                    values[2] + params[2] * values[3],
-                                    values[4] + params[3] * values[5]]
-				keyframe = HermitKeyframe(frameIndex, coeffs)
-				keyframe_data.append(keyframe)
-				print (str(keyframe))
-
-			self.spline = HermitSpline(keyframe_data)
-		elif self.comtype == 7:
-			# values as [base1, extent1],[base2, extent2],[base3, extent3]
-			raw = mot.get_raw(0xc)
-			print ("raw = ", map(hex, struct.unpack("HHHHHH", raw)))
-
-			values = []
-			for v in struct.unpack("6H", raw):
-				values.append(C.decompress(v))
-			print ("values =", values)
-			# print ("floatDecompressor", values)
-            #
-            #
-			# values = numpy.frombuffer(raw, dtype=numpy.dtype("<f2"))
-			keyframe_data = []
-			frameIndex = 0
-			for i in range(self.keycount):
-				params = mot.get("4B")
-
-				frameCount = params[0]
-				frameIndex += frameCount
-				coeffs = [values[0] + params[1] * values[1],
-                                    values[2] + params[2] * values[3],
-                                    values[4] + params[3] * values[5]]
-				keyframe = HermitKeyframe(frameIndex, coeffs)
-				keyframe_data.append(keyframe)
-				print (str(keyframe))
-
-			self.spline = HermitSpline(keyframe_data)
-		elif self.comtype == 8:
-			# values as [base1, extent1],[base2, extent2],[base3, extent3]
-			raw = mot.get_raw(0xc)
-			print ("raw = ", map(hex, struct.unpack("HHHHHH", raw)))
-
-			values = []
-			for v in struct.unpack("6H", raw):
-				values.append(C.decompress(v))
-			print ("values =", values)
-			# print ("floatDecompressor", values)
-            #
-            #
-			# values = numpy.frombuffer(raw, dtype=numpy.dtype("<f2"))
-			keyframe_data = []
-			for i in range(self.keycount):
-				params = mot.get("H3B")
-
-				frameIndex = params[0]
-				coeffs = [values[0] + params[1] * values[1],
-                                    values[2] + params[2] * values[3],
-                                    values[4] + params[3] * values[5]]
-				keyframe = HermitKeyframe(frameIndex, coeffs)
-				keyframe_data.append(keyframe)
-				print (str(keyframe))
-
-			self.spline = HermitSpline(keyframe_data)
-		else:
-			assert False, ("unknown compress type %d" % self.comtype)
+		values = self.read_keyframe_header(mot)
+		dtype = get_keyframe_dtype(self.comtype, mot.endian)
+		keys = numpy.frombuffer(mot.get_raw(self.keycount * dtype.itemsize), dtype, self.keycount)
+
+		if self.comtype <= 3:
+			p = keys['p'].astype(numpy.float64)
+			if values is not None:
+				p = values[0] + values[1] * p
+			self.spline = PlainSpline(p)
+			return
+
+		if self.comtype == 4:
+			assert not keys['pad'].any(), "this is padding"
+		frames = keys['frame'].astype(numpy.int64)
+		if self.comtype == 7:
+			frames = numpy.cumsum(frames)
+		coeffs = []
+		for i, name in enumerate(('p', 'a', 'd')):
+			coeff = keys[name].astype(numpy.float64)
+			if values is not None:
+				# values as [base1, extent1],[base2, extent2],[base3, extent3]
+				coeff = values[i * 2] + values[i * 2 + 1] * coeff
+			coeffs.append(coeff)
+		self.spline = HermitSpline(frames, coeffs[0], coeffs[1], coeffs[2])
 
 	def eval(self, frameIndex):
 		if self.is_const:
 			return self.const
 		return self.spline.eval(frameIndex)
 
+	def eval_many(self, frameIndices):
+		if self.is_const:
+			return numpy.full(len(frameIndices), self.const, dtype=numpy.float64)
+		return self.spline.eval_many(frameIndices)
+
+	def eval_all(self, frame_count):
+		"""value of every frame in [0, frame_count)"""
+		return self.eval_many(numpy.arange(frame_count))
+
 	def __str__(self):
 		ret = "Bone:%d, type=%d, compress=%d, keynum=%d, " % (
 			self.bone_id, self.type, self.comtype, self.keycount)
@@ -257,6 +250,335 @@ class Track(object):
 			ret += "offset = 0x%x" % self.offset
 		return ret
 
+def read_track(motReader, offset, count):
+	# read tracks
+	tracks = []
+	data_offsets = []
+	for trk_idx in range(count):
+		motReader.seek(offset + trk_idx * 0xc)
+		track = Track()
+		track.read(motReader)
+		track.adjust_offset(offset + trk_idx * 0xc)
+		tracks.append(track)
+		if track.offset > 0:
+			data_offsets.append(track.offset)
+	dummy_track = Track()
+	dummy_track.read(motReader)
+	dummy_track.adjust_offset(offset + count * 0xc)
+
+	# calculate track chunk data
+	data_offsets.append(motReader.size)
+	data_offsets.sort()
+	offset_size = {}
+	for i in range(len(data_offsets) - 1):
+		data_size = data_offsets[i + 1] - data_offsets[i]
+		offset_size[data_offsets[i]] = data_size
+
+	# if compress type == 0, then it is a constant value
+	for trk_idx in range(count):
+		track = tracks[trk_idx]
+		if track.offset > 0:
+			size = offset_size[track.offset]
+			if track.comtype in (6, 7):
+				assert size == align4(0xc + track.keycount * 0x4)
+			elif track.comtype == 5:
+				assert size == align4(0x18 + track.keycount * 0x8)
+			elif track.comtype == 3:
+				assert size == align4(0x4 + track.keycount * 0x1)
+			elif track.comtype == 2:
+				assert size == align4(0x8 + track.keycount * 0x2)
+			elif track.comtype == 8:
+				# 6 unsigned short + (unsigned short frameIndex + 3 byte coeffs)
+				assert size == align4(0xc + track.keycount * 0x5)
+			elif track.comtype == 4:
+				# no header + 0x10
+				assert size == align4(0x0 + track.keycount * 0x10)
+			elif track.comtype == 1:
+				# floats
+				assert size == align4(0x0 + track.keycount * 0x4)
+			else:
+				assert False, "unknown compression type %d" % (track.comtype)
+
+	hdr_offset = offset
+	for trk_idx in range(count):
+		track = tracks[trk_idx]
+		if track.comtype != 0:
+			size = offset_size[track.offset]
+		else:
+			size = 0
+
+		# print ("Track %d hdr@0x%x, size=0x%x" % (trk_idx, hdr_offset, size),)
+		# print (track)
+
+		if track.offset:
+			track.parse_keyframes(motReader)
+		hdr_offset += 0xc
+
+	# print ("Dummy Track @ 0x%x" % hdr_offset,)
+	# print (dummy_track)
+
+	return tracks
+
+def read_motionData(frame_count, tracks):
+	"""read motion data from tracks, returns a MotionData"""
+	return MotionData.from_tracks(frame_count, tracks)
+
+def align4(size):
+	"""align to 4 bytes"""
+	rem = size % 4
+	if rem:
+		size += 4 - rem
+	return size
+
+def load_motion(mot_file):
+	"""(mot_file, MOT, error) of one file, used by the worker processes of load_motions"""
+	try:
+		return mot_file, MOT(mot_file), None
+	except (AssertionError, IOError, OSError, ValueError, KeyError, struct.error) as e:
+		return mot_file, None, '%s: %s' % (type(e).__name__, e)
+
+def load_motions(mot_files, processes=None, executable=None):
+	"""parse and evaluate mot_files in a process pool, yields load_motion results in order
+
+	executable is the python of the workers, needed inside blender where
+	sys.executable may be the blender binary
+	"""
+	if not processes or processes <= 0:
+		processes = multiprocessing.cpu_count()
+	processes = min(processes, len(mot_files))
+	if processes <= 1:
+		for mot_file in mot_files:
+			yield load_motion(mot_file)
+		return
+	context = multiprocessing.get_context('spawn')
+	if executable:
+		context.set_executable(executable)
+	pool = context.Pool(processes)
+	try:
+		for result in pool.imap(load_motion, mot_files):
+			yield result
+	finally:
+		pool.terminate()
+		pool.join()
+
+# track types: 0-POSX 1-POSY 2-POSZ 3-ROTX 4-ROTY 5-ROTZ 6-unused 7-SCALEX 8-SCALEY 9-SCALEZ
+CHANNEL_COUNT = 10
+LOCATION_CHANNELS = (0, 1, 2)
+ROTATION_CHANNELS = (3, 4, 5)
+SCALE_CHANNELS = (7, 8, 9)
+CHANNEL_DEFAULTS = numpy.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0], dtype=numpy.float32)
+
+class MotionData(object):
+	"""evaluated motion as a (bones x 10 x frames) float32 tensor
+
+	constant channels are only stored once in const, animated channels are rows of
+	curves and curve_index[bone, channel] points at them (-1 for constant channels).
+	bone_ids keeps the order in which bones first appear in the tracks.
+	"""
+
+	def __init__(self, frame_count, bone_ids):
+		self.frame_count = frame_count
+		self.bone_ids = numpy.array(bone_ids, dtype=numpy.int32)
+		self.bone_index = dict((int(bone_id), row) for row, bone_id in enumerate(self.bone_ids))
+		self.const = numpy.tile(CHANNEL_DEFAULTS, (len(self.bone_ids), 1))
+		self.curve_index = numpy.full((len(self.bone_ids), CHANNEL_COUNT), -1, dtype=numpy.int32)
+		self.curves = numpy.zeros((0, frame_count), dtype=numpy.float32)
+		# (row, channel) -> source spline of the animated channels, for sparse key import
+		self.splines = {}
+
+	@classmethod
+	def from_tracks(cls, frame_count, tracks):
+		bone_ids = []
+		for track in tracks:
+			if not track.bone_id in bone_ids:
+				bone_ids.append(track.bone_id)
+		motion = cls(frame_count, bone_ids)
+		curves = []
+		unknown_tracks = Tally(log)
+		for track in tracks:
+			# Some mot file have unknown track type: 14,15
+			if not (0 <= track.type < CHANNEL_COUNT) or track.type == 6:
+				unknown_tracks.add(track.type)
+				continue
+			row = motion.bone_index[track.bone_id]
+			if track.is_const:
+				motion.const[row, track.type] = track.const
+				motion.curve_index[row, track.type] = -1
+				motion.splines.pop((row, track.type), None)
+				continue
+			values = track.eval_all(frame_count).astype(numpy.float32)
+			if frame_count == 0 or (values == values[0]).all():
+				motion.const[row, track.type] = values[0] if frame_count else track.const
+				motion.curve_index[row, track.type] = -1
+				motion.splines.pop((row, track.type), None)
+			else:
+				motion.curve_index[row, track.type] = len(curves)
+				motion.splines[(row, track.type)] = track.spline
+				curves.append(values)
+		if curves:
+			motion.curves = numpy.vstack(curves)
+		unknown_tracks.report('Unknown TrackType skipped')
+		return motion
+
+	@property
+	def bone_count(self):
+		return len(self.bone_ids)
+
+	@property
+	def nbytes(self):
+		return self.bone_ids.nbytes + self.const.nbytes + self.curve_index.nbytes + self.curves.nbytes
+
+	def is_constant(self, row, channel):
+		return self.curve_index[row, channel] < 0
+
+	def hermit_spline(self, row, channel):
+		"""source hermite spline of an animated channel, None if it has to be baked"""
+		spline = self.splines.get((row, channel))
+		if isinstance(spline, HermitSpline):
+			return spline
+		return None
+
+	def channel(self, row, channel):
+		"""values of one channel for every frame, a read-only broadcast view for constant channels"""
+		curve = self.curve_index[row, channel]
+		if curve < 0:
+			return numpy.broadcast_to(self.const[row, channel], (self.frame_count,))
+		return self.curves[curve]
+
+	def channels(self, row, channels):
+		"""(len(channels) x frames) values of one bone"""
+		result = numpy.empty((len(channels), self.frame_count), dtype=numpy.float32)
+		for i, channel in enumerate(channels):
+			result[i] = self.channel(row, channel)
+		return result
+
+	def dense(self):
+		"""the full (bones x 10 x frames) tensor"""
+		result = numpy.repeat(self.const[:, :, numpy.newaxis], self.frame_count, axis=2)
+		rows, channels = numpy.nonzero(self.curve_index >= 0)
+		result[rows, channels] = self.curves[self.curve_index[rows, channels]]
+		return result
+
+# quaternion arrays are (..., 4) in blender order w, x, y, z
+def euler_to_quaternion_array(euler):
+	"""(frames x 3) roll, pitch, yaw -> (frames x 4) quaternions, same as euler_angle_to_quaternion"""
+	euler = numpy.asarray(euler, dtype=numpy.float64)
+	half = euler * 0.5
+	cr, cp, cy = numpy.cos(half[..., 0]), numpy.cos(half[..., 1]), numpy.cos(half[..., 2])
+	sr, sp, sy = numpy.sin(half[..., 0]), numpy.sin(half[..., 1]), numpy.sin(half[..., 2])
+	q = numpy.empty(euler.shape[:-1] + (4,), dtype=numpy.float64)
+	q[..., 0] = cy * cr * cp + sy * sr * sp
+	q[..., 1] = cy * sr * cp - sy * cr * sp
+	q[..., 2] = cy * cr * sp + sy * sr * cp
+	q[..., 3] = sy * cr * cp - cy * sr * sp
+	return q
+
+def quaternion_multiply_array(q1, q2):
+	"""hamilton product q1 * q2, both sides broadcast"""
+	q1 = numpy.asarray(q1, dtype=numpy.float64)
+	q2 = numpy.asarray(q2, dtype=numpy.float64)
+	w1, x1, y1, z1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+	w2, x2, y2, z2 = q2[..., 0], q2[..., 1], q2[..., 2], q2[..., 3]
+	return numpy.stack([
+		w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+		w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+		w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+		w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+	], axis=-1)
+
+def quaternion_inverse_array(q):
+	q = numpy.asarray(q, dtype=numpy.float64)
+	conjugate = q * numpy.array([1.0, -1.0, -1.0, -1.0])
+	return conjugate / numpy.sum(q * q, axis=-1, keepdims=True)
+
+def make_quaternions_continuous(q):
+	"""flip quaternions so that every frame is in the hemisphere of the previous one"""
+	q = numpy.array(q, dtype=numpy.float64)
+	if len(q) < 2:
+		return q
+	dots = numpy.sum(q[1:] * q[:-1], axis=-1)
+	signs = numpy.cumprod(numpy.where(dots < 0, -1.0, 1.0))
+	q[1:] *= signs[:, numpy.newaxis]
+	return q
+
+def slerp_array(q0, q1, t):
+	"""shortest path slerp of quaternion arrays, t broadcasts against the quaternion rows"""
+	q0 = numpy.asarray(q0, dtype=numpy.float64)
+	q1 = numpy.asarray(q1, dtype=numpy.float64)
+	t = numpy.asarray(t, dtype=numpy.float64)[..., numpy.newaxis]
+	dot = numpy.sum(q0 * q1, axis=-1, keepdims=True)
+	q1 = numpy.where(dot < 0, -q1, q1)
+	dot = numpy.clip(numpy.abs(dot), 0.0, 1.0)
+	theta = numpy.arccos(dot)
+	sin_theta = numpy.sin(theta)
+	small = sin_theta < 1e-6
+	safe_sin = numpy.where(small, 1.0, sin_theta)
+	w0 = numpy.where(small, 1.0 - t, numpy.sin((1.0 - t) * theta) / safe_sin)
+	w1 = numpy.where(small, t, numpy.sin(t * theta) / safe_sin)
+	q = w0 * q0 + w1 * q1
+	return q / numpy.linalg.norm(q, axis=-1, keepdims=True)
+
+def resample_quaternions(key_frames, q, frames):
+	"""slerp (keys x 4) quaternions at key_frames to every frame of frames"""
+	key_frames = numpy.asarray(key_frames, dtype=numpy.float64)
+	frames = numpy.asarray(frames, dtype=numpy.float64)
+	q = numpy.asarray(q, dtype=numpy.float64)
+	if len(key_frames) == 1:
+		return numpy.repeat(q, len(frames), axis=0)
+	i = numpy.clip(numpy.searchsorted(key_frames, frames, 'right') - 1, 0, len(key_frames) - 2)
+	t = numpy.clip((frames - key_frames[i]) / (key_frames[i + 1] - key_frames[i]), 0.0, 1.0)
+	return slerp_array(q[i], q[i + 1], t)
+
+def hermit_to_bezier(frames, p, a, d):
+	"""bezier handles of hermite keys, returns (handle_left, handle_right) as (keys x 2) frame, value
+
+	a is the incoming tangent of the segment ending at a key and d the outgoing
+	tangent of the segment starting at it, both per segment like in HermitSpline.eval
+	"""
+	frames = numpy.asarray(frames, dtype=numpy.float64)
+	spans = numpy.diff(frames)
+	if len(spans) == 0:
+		spans = numpy.ones(1)
+	left_span = numpy.concatenate([spans[:1], spans])
+	right_span = numpy.concatenate([spans, spans[-1:]])
+	handle_left = numpy.stack([frames - left_span / 3.0, p - a / 3.0], axis=-1)
+	handle_right = numpy.stack([frames + right_span / 3.0, p + d / 3.0], axis=-1)
+	return handle_left, handle_right
+
+def simplify_keys(frames, values, tolerance):
+	"""indices of the keys to keep so that linear interpolation stays within tolerance
+
+	values is (frames) or (frames x channels), channels are simplified together
+	(Ramer-Douglas-Peucker on the value axis)
+	"""
+	frames = numpy.asarray(frames, dtype=numpy.float64)
+	values = numpy.asarray(values, dtype=numpy.float64)
+	if values.ndim == 1:
+		values = values[:, numpy.newaxis]
+	count = len(frames)
+	if count <= 2:
+		return numpy.arange(count)
+	keep = numpy.zeros(count, dtype=bool)
+	keep[0] = keep[-1] = True
+	stack = [(0, count - 1)]
+	while stack:
+		i, j = stack.pop()
+		if j - i < 2:
+			continue
+		t = (frames[i + 1:j] - frames[i]) / (frames[j] - frames[i])
+		interpolated = values[i] + t[:, numpy.newaxis] * (values[j] - values[i])
+		error = numpy.abs(values[i + 1:j] - interpolated).max(axis=1)
+		k = int(numpy.argmax(error))
+		if error[k] > tolerance:
+			m = i + 1 + k
+			keep[m] = True
+			stack.append((i, m))
+			stack.append((m, j))
+	return numpy.nonzero(keep)[0]
+
+# (exponent bits, significand bits, bias) -> 65536 entry float32 table
+_float_tables = {}
+
 #thanks Phernost (stackoverflow)
 class FloatDecompressor(object):
 	significandFBits = 23
@@ -279,7 +601,47 @@ class FloatDecompressor(object):
 			self.significandHBits - self.exponentHBits
 		self.shiftBits = self.significandFBits - self.significandHBits
 
+	@property
+	def table(self):
+		"""float32 value of every 16 bit input, built on first use and shared by equal decompressors"""
+		key = (self.exponentHBits, self.significandHBits, self.biasH)
+		table = _float_tables.get(key)
+		if table is None:
+			table = _float_tables[key] = self.decompress_bits(numpy.arange(0x10000, dtype=numpy.uint32))
+		return table
+
 	def decompress(self, value):
+		return float(self.table[value & 0xffff])
+
+	def decompress_array(self, values):
+		return self.table[numpy.asarray(values, dtype=numpy.uint32) & 0xffff]
+
+	def decompress_bits(self, values):
+		"""vectorized version of decompress_scalar for an uint32 array"""
+		ui = values.astype(numpy.uint32)
+		sign = ui & self.signH
+		ui ^= sign
+
+		sign <<= self.shiftSign
+		exponent = ui & self.exponentH
+		significand = ui ^ exponent
+		significand <<= self.shiftBits
+
+		si = sign | significand
+		is_inf = exponent == self.exponentH
+		is_normal = (exponent != 0) & ~is_inf
+		is_subnormal = (exponent == 0) & (significand != 0)
+		normal_exponent = ((exponent >> self.significandHBits) + (self.biasF - self.biasH)) << self.significandFBits
+		si = numpy.where(is_inf, si | self.exponentF, si)
+		si = numpy.where(is_normal, si | normal_exponent, si).astype(numpy.uint32)
+
+		f = si.view(numpy.float32)
+		magic = numpy.array([(2 * self.biasF - self.biasH) << self.significandFBits], dtype=numpy.uint32).view(numpy.float32)[0]
+		with numpy.errstate(invalid='ignore'):
+			# inf and nan inputs are kept as they are
+			return numpy.where(is_subnormal, f * magic, f).astype(numpy.float32)
+
+	def decompress_scalar(self, value):
 		ui = value
 		sign = ui & self.signH
 		ui ^= sign
@@ -305,84 +667,20 @@ class FloatDecompressor(object):
 		f *= magic
 		return f
 
+# header values of the compressed tracks, its table is shared by every track
+MOT_FLOAT_DECOMPRESSOR = FloatDecompressor(6, 9, 47)
+
+def decompress_array(values):
+	return MOT_FLOAT_DECOMPRESSOR.decompress_array(values)
+
 # makes parsing data a lot easier
 def get_getter(data, endian):
-	return getter(data, endian)
-
-class getter(object):
-
-	def __init__(self, data, endian):
-		self.data = data
-		self.endian = endian
-		self.is_file = isinstance(self.data, IOBase)
-		if self.is_file:
-			self.offset = self.data.tell()
-			self.data.seek(0, 2)
-			self.size = self.data.tell()
-			self.data.seek(0, self.offset)
-		else:
-			self.offset = 0
-			self.size = len(data)
-
-	def seek(self, offset, whence=0):
-		assert whence in (0, 1, 2)
-		if self.is_file:
-			self.data.seek(offset, whence)
-			self.offset = self.data.tell()
-		else:
-			if whence == 0:
-				self.offset = offset
-			elif whence == 1:
-				self.offset += offset
-			elif whence == 2:
-				self.offset = len(self.data) - offset
-
-	def skip(self, size):
-		self.seek(size, 1)
-
-	def pad(self, size, pad_pattern="\x00"):
-		pad_data = self.get_raw(size)
-		pattern_size = len(pad_pattern)
-		for i in range(size / pattern_size):
-			assert pad_pattern.startswith(
-				pad_data[i * pattern_size: (i + 1) * pattern_size])
-
-	def align(self, size):
-		rem = self.offset % size
-		if rem:
-			self.pad(size - rem)
-
-	def get_raw(self, size):
-		if self.is_file:
-			data_seg = self.data.read(size)
-		else:
-			data_seg = self.data[self.offset: self.offset + size]
-		self.offset += size
-		return data_seg
-
-	def get(self, fmt, offset=None, force_tuple=False):
-		if offset is not None:
-			self.seek(offset)
-		size = struct.calcsize(fmt)
-		data_seg = self.get_raw(size)
-		res = struct.unpack(self.endian + fmt, data_seg)
-		if not force_tuple and len(res) == 1:
-			return res[0]
-		return res
-
-	def get_cstring(self):
-		s = ""
-		ch = ""
-		while ch != "\x00":
-			ch = self.get_raw(1)
-			s += ch
-		return s.rstrip("\x00")
-
-	def block(self, size, endian=None):
-		data = self.get_raw(size)
-		if endian is None:
-			endian = self.endian
-		return getter(data, endian)
-
-	def assert_end(self):
-		assert self.offset == self.size
+	"""BufferReader over bytes, or over the whole content of an open file"""
+	if isinstance(data, IOBase):
+		offset = data.tell()
+		data.seek(0)
+		return BufferReader(data.read(), endian, offset)
+	return BufferReader(data, endian)
+
+# the struct reader now lives in util, shared with the wmb/wta/dat parsers
+getter = BufferReader
@@ -3,145 +3,21 @@ import os
 import numpy
 import math
 import nier2blender.mot as MOT
+from nier2blender.mot import SIGN, read_track, read_motionData, align4
 import bmesh
 import bpy
 import mathutils
+from nier2blender.log import get_logger, DEBUG, WARNING, Tally
 
-SIGN = b"mot\x00"
-
-def read_track(motReader, offset, count):
-    # read tracks
-    tracks = []
-    data_offsets = []
-    for trk_idx in range(count):
-        motReader.seek(offset + trk_idx * 0xc)
-        track = MOT.Track()
-        track.read(motReader)
-        track.adjust_offset(offset + trk_idx * 0xc)
-        tracks.append(track)
-        if track.offset > 0:
-            data_offsets.append(track.offset)
-    dummy_track = MOT.Track()
-    dummy_track.read(motReader)
-    dummy_track.adjust_offset(offset + count * 0xc)
-    
-    # calculate track chunk data
-    data_offsets.append(motReader.size)
-    data_offsets.sort()
-    offset_size = {}
-    for i in range(len(data_offsets) - 1):
-        data_size = data_offsets[i + 1] - data_offsets[i]
-        offset_size[data_offsets[i]] = data_size
-
-    # if compress type == 0, then it is a constant value
-    for trk_idx in range(count):
-        track = tracks[trk_idx]
-        if track.offset > 0:
-            size = offset_size[track.offset]
-            if track.comtype in (6, 7):
-                 assert size == align4(0xc + track.keycount * 0x4)
-            elif track.comtype == 5:
-                assert size == align4(0x18 + track.keycount * 0x8)
-            elif track.comtype == 3:
-                assert size == align4(0x4 + track.keycount * 0x1)
-            elif track.comtype == 2:
-                assert size == align4(0x8 + track.keycount * 0x2)
-            elif track.comtype == 8:
-                # 6 unsigned short + (unsigned short frameIndex + 3 byte coeffs)
-                assert size == align4(0xc + track.keycount * 0x5)
-            elif track.comtype == 4:
-                # no header + 0x10
-                assert size == align4(0x0 + track.keycount * 0x10)
-            elif track.comtype == 1:
-                # floats
-                assert size == align4(0x0 + track.keycount * 0x4)
-            else:
-                 assert False, "unknown compression type %d" % (track.comtype)
-
-    hdr_offset = offset
-    for trk_idx in range(count):
-        track = tracks[trk_idx]
-        if track.comtype != 0:
-            size = offset_size[track.offset]
-        else:
-            size = 0
-            
-        # print ("Track %d hdr@0x%x, size=0x%x" % (trk_idx, hdr_offset, size),)
-        # print (track)
-        
-        if track.offset:
-            track.parse_keyframes(motReader)
-        hdr_offset += 0xc
-        
-    # print ("Dummy Track @ 0x%x" % hdr_offset,)
-    # print (dummy_track)
-    
-    return tracks
-
-def read_motionData(frame_count, tracks):
-    """read motion data from tracks"""
-    # {bone_id: [POSX, POSY, POSZ, ROTX, ROTY, ROTZ, SCALEX, SCALEY, SCALEZ]}
-    evaluated_tracks = {}
-
-    # evaluate all tracks for all bones
-    for track in tracks:
-        bone_tracks = evaluated_tracks.setdefault(track.bone_id, [None] * 9)
-        # print('bone_id:%d' % (track.bone_id))
-        # Some mot file have unknown track type: 14,15
-        if 0 <= track.type <= 5:    # 0-5 index no change
-            # print('[Info] 0-5 TrackType:%d' % (track.type))
-            frames = []
-            for i in range(frame_count):
-                frames.append(track.eval(i))
-            bone_tracks[track.type] = frames
-        elif 7 <= track.type <= 9:      # 7-9 index need to (-1), because TrackType:6 skipped.
-            # print('[Info] 7-9 TrackType:%d' % (track.type))
-            frames = []
-            for i in range(frame_count):
-                frames.append(track.eval(i))
-            bone_tracks[track.type - 1] = frames
-        else:
-            print('[Error] Unknown TrackType:%d' % (track.type))
-
-    # fill in missing tracks
-    default_value = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0]
-    for bone_id, bone_tracks in evaluated_tracks.items():
-        for i in range(len(bone_tracks)):
-            if bone_tracks[i] is None:
-                bone_tracks[i] = [default_value[i]] * frame_count
-
-    # combine separated tracks
-    motion_data = {}
-    for bone_id, bone_tracks in evaluated_tracks.items():
-        pos_frames = []
-        rot_frames = []
-        scale_frames = []
-
-        for i in range(frame_count):
-            pos_frames.append(
-                (i, bone_tracks[0][i], bone_tracks[1][i], bone_tracks[2][i]))
-            rotx = bone_tracks[3][i]
-            roty = bone_tracks[4][i]
-            rotz = bone_tracks[5][i]
-            # TODO: need to convert euler angles to quaternion
-            x, y, z, w = euler_angle_to_quaternion(rotx, roty, rotz)
-            rot_frames.append((i, x, y, z, w))
-            # print(rot_frames)
-            scale_frames.append(
-                (i, bone_tracks[6][i], bone_tracks[7][i], bone_tracks[8][i]))
-
-        # print(rot_frames)
-
-        motion_data[bone_id] = [
-            pos_frames,
-            rot_frames,
-            scale_frames,
-        ]
-
-    return motion_data
-
-def import_action(motion, armature, motion_name, bind_pose, rotation_resample=False):
-    """apply motion data to armature"""
+log = get_logger('motion')
+
+def import_action(motion, armature, motion_name, bind_pose, rotation_resample=False, keyframe_mode='BAKE', simplify_tolerance=0.0):
+    """apply motion data to armature
+
+    keyframe_mode 'BAKE' keys every frame, 'SPARSE' keeps the hermite keys of the
+    location and scale tracks as bezier keys and only bakes the other tracks.
+    baked keys are simplified within simplify_tolerance when it is > 0.
+    """
     action = bpy.data.actions.new(name=motion_name)
     # force Blender to save even if it has no users
     action.use_fake_user = True
@@ -171,8 +47,8 @@ def import_action(motion, armature, motion_name, bind_pose, rotation_resample=Fa
     pose_bones = armature.pose.bones
     # pose_bones = armature.data.bones
 
-    print('[Info] armature.name: %s' % (armature.name))
-    print('[Info] armature.data.name: %s' % (armature.data.name))
+    log.debug('armature.name: %s, armature.data.name: %s', armature.name, armature.data.name)
+    missing_bones = Tally(log, WARNING)
 
     # print('[Info]write motion to %s' % (str(type(pose_bones))))
 
@@ -182,92 +58,124 @@ def import_action(motion, armature, motion_name, bind_pose, rotation_resample=Fa
 
     used_bones = []
 
-    for bone_number, v in motion.items():
-        loc, rot, scale = v
+    for row in range(motion.bone_count):
+        bone_number = int(motion.bone_ids[row])
         bone_name = bone_mapping.get(str(bone_number))
 
         if bone_name is None:
-            print('[Error] bone_number = %d not found in bone_mapping.' % (bone_number))
+            missing_bones.add('not in bone_mapping', bone_number)
             continue
         # pose_bone = pose_bones[bone_name]
         pose_bone = pose_bones.get(bone_name)
         if pose_bone is None:
-            print('[Error] %s not found in armature.pose.bones.' % (bone_name))
+            missing_bones.add('not in armature.pose.bones', bone_name)
             continue
 
         # Debug
         if bone_name not in used_bones:
             used_bones.append(bone_name);
 
+        frames = numpy.arange(1, motion.frame_count + 1)
         # location keyframes
-        if loc is not None:
-            for loc_k in loc:
-                f = loc_k[0] + 1
-                pose_bone.location = mathutils.Vector(loc_k[1:4])
-                pose_bone.location -= bind_pose[bone_name][0]
-                pose_bone.keyframe_insert("location", index=-1, frame=f)
-        else:
-            pose_bone.location = mathutils.Vector([0, 0, 0])
-            pose_bone.keyframe_insert("location", index=-1, frame=1)
-        # rotation keyframes
-        if rot is not None:
-            prev_f = 1
-            for rot_k in rot:
-                f = rot_k[0] + 1
-                # In blender, quaternion is stored in order of w, x, y, z
-                q = mathutils.Quaternion(
-                    [rot_k[4], rot_k[1], rot_k[2], rot_k[3]]
-                )
-                q = bind_pose[bone_name][1].inverted() * q
-                if f - prev_f > 1 and rotation_resample:
-                    prev_q = mathutils.Quaternion(pose_bone.rotation_quaternion)
-                    step = 1.0 / (f - prev_f)
-                    fraction = 0.0
-                    for i in range(f - prev_f):
-                        fraction += step
-                        _q = prev_q.slerp(q, fraction)
-                        pose_bone.rotation_quaternion = _q
-                        pose_bone.keyframe_insert(
-                            "rotation_quaternion", index=-1, frame=prev_f + i + 1)
-                else:
-                    pose_bone.rotation_quaternion = q
-                    pose_bone.keyframe_insert("rotation_quaternion", index=-1, frame=f)
-                prev_f = f
-        else:
-            pose_bone.rotation_quaternion = mathutils.Quaternion([1, 0, 0, 0])
-            pose_bone.keyframe_insert("rotation_quaternion", index=-1, frame=1)
+        write_channel_fcurves(action, pose_bone.path_from_id("location"), bone_name, motion, row,
+            MOT.LOCATION_CHANNELS, frames, numpy.array(bind_pose[bone_name][0]), numpy.ones(3),
+            keyframe_mode, simplify_tolerance)
+        # rotation keyframes, euler angles always have to be baked to quaternions
+        rot = motion.channels(row, MOT.ROTATION_CHANNELS).T
+        rot_frames = frames
+        quats = bone_rotation_quaternions(rot, bind_pose[bone_name][1])
+        if rotation_resample and len(frames) > 0:
+            rot_frames = numpy.arange(frames[0], frames[-1] + 1)
+            quats = MOT.resample_quaternions(frames, quats, rot_frames)
+        # In blender, quaternion is stored in order of w, x, y, z
+        write_fcurves(action, pose_bone.path_from_id("rotation_quaternion"), bone_name, rot_frames, quats, simplify_tolerance)
         # scale keyframes
-        if scale is not None:
-            for scale_k in scale:
-                f = scale_k[0] + 1
-                pose_bone.scale = mathutils.Vector(scale_k[1:4])
-                pose_bone.scale.x /= bind_pose[bone_name][2].x
-                pose_bone.scale.y /= bind_pose[bone_name][2].y
-                pose_bone.scale.z /= bind_pose[bone_name][2].z
-                pose_bone.keyframe_insert("scale", index=-1, frame=f)
-        else:
-            pose_bone.scale = mathutils.Vector([1, 1, 1])
-            pose_bone.keyframe_insert("scale", index=-1, frame=1)
-
-    print('[Info] motion used bones:')
-    debuginfo = ''
-    for boneN in used_bones:
-        debuginfo += boneN + ', '
-    print(debuginfo)
+        write_channel_fcurves(action, pose_bone.path_from_id("scale"), bone_name, motion, row,
+            MOT.SCALE_CHANNELS, frames, numpy.zeros(3), numpy.array(bind_pose[bone_name][2]),
+            keyframe_mode, simplify_tolerance)
 
-    # force linear interpolation now
-    for fcurve in action.fcurves:
-        for keyframe_point in fcurve.keyframe_points:
-            keyframe_point.interpolation = 'LINEAR'
+    missing_bones.report('motion %s, bones skipped' % motion_name)
+    log.info('motion %s used %d bones', motion_name, len(used_bones))
+    if log.isEnabledFor(DEBUG):
+        log.debug('motion used bones: %s', ', '.join(used_bones))
 
     bpy.ops.object.mode_set(mode='OBJECT')
 
-def align4(size):
-    """align to 4 bytes"""
-    rem = size % 4
-    if rem:
-        size += 4 - rem
-    return size
+# raw values of the keyframe enums, as used by foreach_set
+INTERPOLATION_LINEAR = 1
+INTERPOLATION_BEZIER = 2
+HANDLE_FREE = 0
+
+def write_fcurve(action, data_path, index, group_name, frames, values):
+    """create a linear fcurve from the keys (frames, values) and fill it in bulk"""
+    if len(frames) == 0:
+        return
+    # a constant channel only needs its first key
+    count = 1 if (values == values[0]).all() else len(frames)
+    co = numpy.empty((count, 2), dtype=numpy.float32)
+    co[:, 0] = frames[:count]
+    co[:, 1] = values[:count]
+    fcurve = action.fcurves.new(data_path, index=index, action_group=group_name)
+    fcurve.keyframe_points.add(count)
+    fcurve.keyframe_points.foreach_set("co", co.ravel())
+    fcurve.keyframe_points.foreach_set("interpolation", numpy.full(count, INTERPOLATION_LINEAR, dtype=numpy.int32))
+    fcurve.update()
+
+def write_fcurves(action, data_path, group_name, frames, values, simplify_tolerance=0.0):
+    """one fcurve per column of (frames x channels) values, simplified together when tolerance > 0"""
+    frames = numpy.asarray(frames, dtype=numpy.float32)
+    values = numpy.asarray(values, dtype=numpy.float32)
+    if simplify_tolerance > 0:
+        keep = MOT.simplify_keys(frames, values, simplify_tolerance)
+        frames = frames[keep]
+        values = values[keep]
+    for index in range(values.shape[1]):
+        write_fcurve(action, data_path, index, group_name, frames, values[:, index])
+
+def write_hermit_fcurve(action, data_path, index, group_name, spline, offset=0.0, divisor=1.0):
+    """bezier fcurve with the source keys of a hermite spline, values are (spline - offset) / divisor"""
+    count = len(spline.frames)
+    # mot frames start at 0, blender frames at 1
+    frames = spline.frames + 1.0
+    p = (spline.p - offset) / divisor
+    handle_left, handle_right = MOT.hermit_to_bezier(frames, p, spline.a / divisor, spline.d / divisor)
+    co = numpy.stack([frames, p], axis=-1).astype(numpy.float32)
+    fcurve = action.fcurves.new(data_path, index=index, action_group=group_name)
+    keyframe_points = fcurve.keyframe_points
+    keyframe_points.add(count)
+    keyframe_points.foreach_set("co", co.ravel())
+    keyframe_points.foreach_set("interpolation", numpy.full(count, INTERPOLATION_BEZIER, dtype=numpy.int32))
+    keyframe_points.foreach_set("handle_left_type", numpy.full(count, HANDLE_FREE, dtype=numpy.int32))
+    keyframe_points.foreach_set("handle_right_type", numpy.full(count, HANDLE_FREE, dtype=numpy.int32))
+    keyframe_points.foreach_set("handle_left", handle_left.astype(numpy.float32).ravel())
+    keyframe_points.foreach_set("handle_right", handle_right.astype(numpy.float32).ravel())
+    fcurve.update()
+
+def write_channel_fcurves(action, data_path, group_name, motion, row, channels, frames, offset, divisor, keyframe_mode, simplify_tolerance):
+    """fcurves of location or scale channels, values are (motion - offset) / divisor"""
+    values = (motion.channels(row, channels).T - offset) / divisor
+    if keyframe_mode != 'SPARSE':
+        write_fcurves(action, data_path, group_name, frames, values, simplify_tolerance)
+        return
+    for index, channel in enumerate(channels):
+        spline = motion.hermit_spline(row, channel)
+        if spline is not None:
+            write_hermit_fcurve(action, data_path, index, group_name, spline, offset[index], divisor[index])
+            continue
+        column_frames = numpy.asarray(frames, dtype=numpy.float32)
+        column = values[:, index].astype(numpy.float32)
+        if simplify_tolerance > 0 and not motion.is_constant(row, channel):
+            keep = MOT.simplify_keys(column_frames, column, simplify_tolerance)
+            column_frames = column_frames[keep]
+            column = column[keep]
+        write_fcurve(action, data_path, index, group_name, column_frames, column)
+
+def bone_rotation_quaternions(euler, bind_rotation):
+    """(frames x 3) euler angles -> (frames x 4) w, x, y, z pose rotations relative to the bind pose"""
+    quats = MOT.euler_to_quaternion_array(euler)
+    bind_inverse = MOT.quaternion_inverse_array(tuple(bind_rotation))
+    quats = MOT.quaternion_multiply_array(bind_inverse, quats)
+    return MOT.make_quaternions_continuous(quats)
 
 def euler_angle_to_quaternion(roll, pitch, yaw):
     cy  =  math.cos(yaw * 0.5)
@@ -321,36 +229,38 @@ def calc_bind_pose_transforma(armature):
         bind_pose[bone.name] = (loc, rot, scale)
     return bind_pose
 
-def main(mot_file, armature):
-    fp = open(mot_file, "rb")
-    motReader = MOT.get_getter(fp, "<")
-    
-    assert motReader.get("4s") == SIGN
+def python_executable():
+    """python used by the worker processes, sys.executable is blender itself in older versions"""
+    return getattr(bpy.app, 'binary_path_python', None) or sys.executable
 
-    version = motReader.get("I")
-    assert version == 0x20120405
+def main(mot_file, armature, keyframe_mode='BAKE', simplify_tolerance=0.0):
+    mot = MOT.MOT(mot_file)
 
-    unk0 = motReader.get("H")
-    frame_count = motReader.get("H")
-    track_offset = motReader.get("I")
-    track_count = motReader.get("I")
-    unk1 = motReader.get("I")
-    name = motReader.get("20s").decode('utf8').rstrip("\x00")
-    
-    print ("MOT header: 0x%x, %d, name=%s, frame=%d" %
-           (unk0, unk1, name, frame_count))
+    bpy.ops.object.mode_set(mode='EDIT')
+    bind_pose = calc_bind_pose_transforma(armature)
+    bpy.ops.object.mode_set()
 
-    tracks = read_track(motReader, track_offset, track_count)
-    motion_data = read_motionData(frame_count, tracks)
+    import_action(mot.motion, armature, mot.name, bind_pose,
+        keyframe_mode=keyframe_mode, simplify_tolerance=simplify_tolerance)
+    return {'FINISHED'}
 
+def main_batch(mot_files, armature, keyframe_mode='BAKE', simplify_tolerance=0.0, processes=None):
+    """import a motion library, mot files are parsed and evaluated in a process pool
+    while the actions are created here, returns the list of (mot_file, error) that failed"""
     bpy.ops.object.mode_set(mode='EDIT')
     bind_pose = calc_bind_pose_transforma(armature)
     bpy.ops.object.mode_set()
 
-    import_action(motion_data, armature, name, bind_pose)
-
-    fp.close()
-    return {'FINISHED'}
+    failed = []
+    for mot_file, mot, error in MOT.load_motions(mot_files, processes, python_executable()):
+        if error is not None:
+            log.error('failed to load %s: %s', mot_file, error)
+            failed.append((mot_file, error))
+            continue
+        import_action(mot.motion, armature, mot.name, bind_pose,
+            keyframe_mode=keyframe_mode, simplify_tolerance=simplify_tolerance)
+    log.info('imported %d of %d motions', len(mot_files) - len(failed), len(mot_files))
+    return failed
 
 if __name__ == '__main__':
     main('', None)
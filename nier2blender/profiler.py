@@ -0,0 +1,296 @@
+#encoding = utf-8
+"""per-phase timers and counters, optionally with tracemalloc memory tracking
+
+with memory enabled every phase records the peak traced memory while it ran, how
+far above its starting point that peak went (largest of its calls) and the memory
+it left allocated (sum of its calls).
+snapshot(name) compares the allocations to the previous snapshot and keeps the
+top allocation sites. python < 3.9 can't reset the tracemalloc peak, there the
+peak of a phase is the peak since profiling started. the previous snapshot is held
+for the comparison and counts to the traced memory of the later phases.
+
+headless, parse and submesh extraction only:
+    python profiler.py your_wmb_file --memory --out report.json
+"""
+import os
+import sys
+import json
+import time
+import tracemalloc
+from collections import OrderedDict
+
+# allocations of tracemalloc itself are left out of the snapshots
+SNAPSHOT_FILTERS = (
+	tracemalloc.Filter(False, tracemalloc.__file__),
+	tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+	tracemalloc.Filter(False, '<unknown>'),
+)
+CAN_RESET_PEAK = hasattr(tracemalloc, 'reset_peak')
+
+class NullPhase(object):
+	"""phase used while profiling is disabled, does nothing"""
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+NULL_PHASE = NullPhase()
+
+class Phase(object):
+	"""time a block of code, repeated phases with the same name accumulate"""
+	__slots__ = ('profiler', 'name', 'start')
+
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+		self.start = 0.0
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		stats = self.profiler.phases.get(self.name)
+		if stats is None:
+			stats = self.profiler.phases[self.name] = [0.0, 0]
+		stats[0] += time.perf_counter() - self.start
+		stats[1] += 1
+		return False
+
+class MemoryPhase(Phase):
+	"""phase also tracking the traced memory, only used while memory profiling"""
+	__slots__ = ('memory_start', 'peak')
+
+	def __enter__(self):
+		self.memory_start = self.peak = self.profiler.update_memory_peaks()
+		self.profiler.open_phases.append(self)
+		return Phase.__enter__(self)
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		Phase.__exit__(self, exc_type, exc_value, traceback)
+		current = self.profiler.update_memory_peaks()
+		self.profiler.open_phases.remove(self)
+		stats = self.profiler.memory_phases.get(self.name)
+		if stats is None:
+			stats = self.profiler.memory_phases[self.name] = [0, 0, 0]
+		stats[0] = max(stats[0], self.peak)
+		stats[1] = max(stats[1], self.peak - self.memory_start)
+		stats[2] += current - self.memory_start
+		return False
+
+class CountingReader(object):
+	"""file wrapper counting the bytes read through it"""
+	def __init__(self, fp, profiler, counter):
+		self.fp = fp
+		self.profiler = profiler
+		self.counter = counter
+
+	def read(self, size=-1):
+		data = self.fp.read(size)
+		self.profiler.count(self.counter, len(data))
+		return data
+
+	def seek(self, offset, whence=0):
+		return self.fp.seek(offset, whence)
+
+	def tell(self):
+		return self.fp.tell()
+
+	def close(self):
+		return self.fp.close()
+
+class Profiler(object):
+	"""per-phase timers and counters, every call is a no-op while disabled"""
+	def __init__(self):
+		self.enabled = False
+		self.phases = OrderedDict()
+		self.counters = OrderedDict()
+		self.last_report = None
+		self.memory = False
+		self.reset_memory()
+
+	def reset_memory(self):
+		self.memory_phases = OrderedDict()
+		self.memory_peak = 0
+		self.snapshots = []
+		self.open_phases = []
+		self.last_snapshot = None
+		self.stop_tracing = False
+
+	def enable(self, memory=False, memory_top=10, memory_frames=1):
+		"""memory turns on tracemalloc, memory_top allocation sites are kept per snapshot"""
+		self.phases = OrderedDict()
+		self.counters = OrderedDict()
+		self.reset_memory()
+		self.memory = memory
+		self.memory_top = memory_top
+		if memory:
+			# a tracemalloc started by someone else is left running
+			self.stop_tracing = not tracemalloc.is_tracing()
+			if self.stop_tracing:
+				tracemalloc.start(memory_frames)
+			self.last_snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+		self.enabled = True
+
+	def phase(self, name):
+		if not self.enabled:
+			return NULL_PHASE
+		if self.memory:
+			return MemoryPhase(self, name)
+		return Phase(self, name)
+
+	def update_memory_peaks(self):
+		"""hand the peak since the last call to the open phases, returns the current traced memory"""
+		current, peak = tracemalloc.get_traced_memory()
+		self.memory_peak = max(self.memory_peak, peak)
+		for phase in self.open_phases:
+			phase.peak = max(phase.peak, peak)
+		if CAN_RESET_PEAK:
+			tracemalloc.reset_peak()
+		return current
+
+	def snapshot(self, name):
+		"""record the top allocation sites, now and grown since the previous snapshot"""
+		if not self.enabled or not self.memory:
+			return
+		current = self.update_memory_peaks()
+		snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+		self.snapshots.append(OrderedDict([
+			('name', name),
+			('current_bytes', current),
+			('top_retained', [format_stat(stat) for stat in snapshot.statistics('lineno')[:self.memory_top]]),
+			('top_growth', [format_stat(stat) for stat in snapshot.compare_to(self.last_snapshot, 'lineno')[:self.memory_top]]),
+		]))
+		self.last_snapshot = snapshot
+		if CAN_RESET_PEAK:
+			# the snapshot itself doesn't count to the peaks
+			tracemalloc.reset_peak()
+
+	def count(self, name, value=1):
+		if self.enabled:
+			self.counters[name] = self.counters.get(name, 0) + value
+
+	def wrap_reader(self, fp, counter='bytes_read'):
+		if not self.enabled or not fp:
+			return fp
+		return CountingReader(fp, self, counter)
+
+	def report(self):
+		report = {
+			'phases': OrderedDict([(name, {'seconds': stats[0], 'calls': stats[1]}) for name, stats in self.phases.items()]),
+			'counters': OrderedDict(self.counters),
+		}
+		if self.memory:
+			report['memory'] = {
+				'peak_bytes': self.memory_peak,
+				'phases': OrderedDict([(name, {'peak_bytes': stats[0], 'peak_growth_bytes': stats[1], 'retained_bytes': stats[2]})
+					for name, stats in self.memory_phases.items()]),
+				'snapshots': self.snapshots,
+			}
+		return report
+
+	def finish(self, report_file=None):
+		"""disable profiling, returns the report and optionally dumps it as json"""
+		if self.memory:
+			self.update_memory_peaks()
+		report = self.report()
+		self.enabled = False
+		if self.stop_tracing:
+			tracemalloc.stop()
+		self.reset_memory()
+		self.memory = False
+		self.last_report = report
+		if report_file:
+			with open(report_file, 'w') as report_fp:
+				json.dump(report, report_fp, indent=2)
+		return report
+
+def format_stat(stat):
+	frame = stat.traceback[0]
+	return OrderedDict([
+		('site', '%s:%d' % (frame.filename, frame.lineno)),
+		('size', stat.size),
+		('count', stat.count),
+		('size_diff', getattr(stat, 'size_diff', 0)),
+		('count_diff', getattr(stat, 'count_diff', 0)),
+	])
+
+def format_report(report, limit=6):
+	"""one line summary for the console and the operator info report"""
+	phases = sorted(report['phases'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+	text = ', '.join(['%s %.3fs' % (name, stats['seconds']) for name, stats in phases[:limit]])
+	counters = ', '.join(['%s %d' % (name, value) for name, value in report['counters'].items()])
+	if not 'memory' in report:
+		return '%s | %s' % (text, counters)
+	memory = report['memory']
+	phases = sorted(memory['phases'].items(), key=lambda item: item[1]['peak_growth_bytes'], reverse=True)
+	growth = ', '.join(['%s +%.1fMB' % (name, stats['peak_growth_bytes'] / 1048576.0) for name, stats in phases[:limit]])
+	return '%s | %s | peak %.1fMB: %s' % (text, counters, memory['peak_bytes'] / 1048576.0, growth)
+
+def format_memory_report(report, limit=5):
+	"""multi line memory summary: phases and the top sites of every snapshot"""
+	if not 'memory' in report:
+		return ''
+	memory = report['memory']
+	lines = ['peak %.1fMB' % (memory['peak_bytes'] / 1048576.0)]
+	for name, stats in memory['phases'].items():
+		lines.append('  %-32s peak %8.1fMB  growth %8.1fMB  retained %8.1fMB' % (name, stats['peak_bytes'] / 1048576.0,
+			stats['peak_growth_bytes'] / 1048576.0, stats['retained_bytes'] / 1048576.0))
+	for snapshot in memory['snapshots']:
+		lines.append('after %s: %.1fMB' % (snapshot['name'], snapshot['current_bytes'] / 1048576.0))
+		for stat in snapshot['top_growth'][:limit]:
+			lines.append('  %+10.1fKB %+8d blocks  %s' % (stat['size_diff'] / 1024.0, stat['count_diff'], stat['site']))
+	return '\n'.join(lines)
+
+# shared by the parsers and the importers
+profiler = Profiler()
+
+def profile_wmb(wmb_file, lods=(0,), memory=True, report_file=None):
+	"""the bpy-free part of an import: parse, submesh extraction and uv lists of the lods"""
+	from nier2blender.wmb import WMB3, get_obj_meshes
+	profiler.enable(memory)
+	try:
+		with profiler.phase('parse'):
+			wmb = WMB3(wmb_file)
+		profiler.snapshot('parse')
+		uvs = {}
+		submeshes = []
+		with profiler.phase('geometry'):
+			for (lodIndex, meshGroupIndex, vertexGroupIndex), meshes in get_obj_meshes(wmb, lods):
+				if not vertexGroupIndex in uvs:
+					with profiler.phase('geometry.uvs'):
+						uvs[vertexGroupIndex] = [(vertex.textureU, 1 - vertex.textureV) for vertex in wmb.vertexGroupArray[vertexGroupIndex].vertexArray]
+				for meshArrayIndex, materialIndex in meshes:
+					with profiler.phase('geometry.clear_unused_vertex'):
+						submeshes.append(wmb.clear_unused_vertex(meshArrayIndex, vertexGroupIndex))
+					profiler.count('meshes')
+		profiler.snapshot('geometry')
+	finally:
+		report = profiler.finish(report_file)
+	return report
+
+if __name__ == '__main__':
+	import argparse
+	ADDON_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+	if not ADDON_PATH in sys.path:
+		sys.path.append(ADDON_PATH)
+	# the parsers report to the package module, not to this __main__ copy
+	from nier2blender.profiler import profile_wmb, format_report, format_memory_report
+	parser = argparse.ArgumentParser(description='profile parsing .wmb files without blender')
+	parser.add_argument('wmb_files', nargs='+')
+	parser.add_argument('--lod', type=int, default=0, help='LOD level to extract')
+	parser.add_argument('--all-lods', action='store_true', help='extract every LOD level')
+	parser.add_argument('--memory', action='store_true', help='track memory with tracemalloc')
+	parser.add_argument('--out', default=None, help='json report file, one per wmb file gets a numbered suffix')
+	args = parser.parse_args()
+	for index, wmb_file in enumerate(args.wmb_files):
+		report_file = args.out
+		if report_file and len(args.wmb_files) > 1:
+			report_file = '%s_%d%s' % (os.path.splitext(report_file)[0], index, os.path.splitext(report_file)[1])
+		report = profile_wmb(wmb_file, None if args.all_lods else (args.lod,), args.memory, report_file)
+		print('[Info] %s: %s' % (wmb_file, format_report(report)))
+		if args.memory:
+			print(format_memory_report(report))
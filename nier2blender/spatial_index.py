@@ -0,0 +1,288 @@
+#encoding = utf-8
+"""spatial index of the models and mesh groups of an extracted tree
+
+    python spatial_index.py build extracted_folder --out index.npz
+    python spatial_index.py query index.npz --box x0 y0 z0 x1 y1 z1
+    python spatial_index.py query index.npz --point x y z --radius r
+
+only the wmb headers and mesh group tables are read, no geometry. the boxes of
+every mesh group (models without mesh groups use the model box, group -1) go to
+a BVH stored as flat arrays in one .npz. a rebuild reuses the boxes of the files
+whose size and mtime did not change. boxes are (min xyz, max xyz) in wmb
+coordinates, the same regions the importer takes.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+ADDON_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if not ADDON_PATH in sys.path:
+	sys.path.append(ADDON_PATH)
+
+import numpy as np
+from nier2blender.wmb import read_bounding_boxes, make_region
+from nier2blender.log import get_logger
+
+log = get_logger('index')
+
+INDEX_VERSION = 1
+LEAF_SIZE = 8
+
+def find_wmb_files(root):
+	"""paths of every .wmb under root, relative to root"""
+	wmb_files = []
+	for dirpath, dirnames, filenames in os.walk(root):
+		for filename in filenames:
+			if filename.lower().endswith('.wmb'):
+				wmb_files.append(os.path.relpath(os.path.join(dirpath, filename), root))
+	return sorted(wmb_files)
+
+def box_row(box):
+	return list(box[0]) + list(box[1])
+
+def collect_boxes(root, previous=None):
+	"""per file and per mesh group boxes of the tree, unchanged files are taken from previous"""
+	reusable = {}
+	if previous is not None:
+		order = np.argsort(previous.file_index, kind='mergesort')
+		bounds = np.searchsorted(previous.file_index[order], np.arange(len(previous.files) + 1))
+		for fileIndex, wmb_file in enumerate(previous.files):
+			reusable[wmb_file] = (fileIndex, order[bounds[fileIndex]:bounds[fileIndex + 1]])
+	files, sizes, mtimes, model_boxes = [], [], [], []
+	boxes, file_index, group_index, group_names = [], [], [], []
+	reused = 0
+	for wmb_file in find_wmb_files(root):
+		stat = os.stat(os.path.join(root, wmb_file))
+		entry = reusable.get(wmb_file)
+		if entry is not None and previous.file_sizes[entry[0]] == stat.st_size and previous.file_mtimes[entry[0]] == stat.st_mtime:
+			previousIndex, rows = entry
+			model_box = previous.model_boxes[previousIndex].tolist()
+			groups = [(previous.group_names[row], previous.group_index[row], previous.boxes[row].tolist()) for row in rows]
+			reused += 1
+		else:
+			try:
+				model_box, meshGroups = read_bounding_boxes(os.path.join(root, wmb_file))
+			except Exception as e:
+				log.warning('%s: %s', wmb_file, e)
+				continue
+			if model_box is None:
+				log.debug('%s: not a WMB3 file', wmb_file)
+				continue
+			model_box = box_row(model_box)
+			groups = [(name, meshGroupIndex, box_row(box)) for meshGroupIndex, (name, box) in enumerate(meshGroups)]
+			if not groups:
+				groups = [('', -1, model_box)]
+		fileIndex = len(files)
+		files.append(wmb_file)
+		sizes.append(stat.st_size)
+		mtimes.append(stat.st_mtime)
+		model_boxes.append(model_box)
+		for name, meshGroupIndex, box in groups:
+			boxes.append(box)
+			file_index.append(fileIndex)
+			group_index.append(meshGroupIndex)
+			group_names.append(name)
+	log.info('%d models (%d unchanged), %d mesh groups', len(files), reused, len(boxes))
+	return {
+		'files': np.array(files, dtype=str),
+		'file_sizes': np.array(sizes, np.int64),
+		'file_mtimes': np.array(mtimes, np.float64),
+		'model_boxes': np.array(model_boxes, np.float32).reshape(-1, 6),
+		'boxes': np.array(boxes, np.float32).reshape(-1, 6),
+		'file_index': np.array(file_index, np.int32),
+		'group_index': np.array(group_index, np.int32),
+		'group_names': np.array(group_names, dtype=str),
+	}
+
+def build_bvh(boxes, leaf_size=LEAF_SIZE):
+	"""flat BVH over boxes (n, 6), median split on the longest axis of the box centers
+
+	returns node_boxes (k, 6), node_children (k, 2) with -1 for leaves, node_ranges
+	(k, 2) start and count in order, and order, the primitives sorted by leaf
+	"""
+	count = len(boxes)
+	centers = (boxes[:, :3] + boxes[:, 3:]) / 2
+	order = np.arange(count, dtype=np.int32)
+	node_boxes, node_children, node_ranges = [], [], []
+
+	def add_node(start, end):
+		primitives = order[start:end]
+		node_boxes.append(np.concatenate([boxes[primitives, :3].min(0), boxes[primitives, 3:].max(0)]))
+		node_children.append([-1, -1])
+		node_ranges.append([start, end - start])
+		return len(node_boxes) - 1
+
+	stack = [add_node(0, count)] if count else []
+	while stack:
+		node = stack.pop()
+		start, size = node_ranges[node]
+		if size <= leaf_size:
+			continue
+		primitives = order[start:start + size]
+		primitiveCenters = centers[primitives]
+		axis = int(np.argmax(primitiveCenters.max(0) - primitiveCenters.min(0)))
+		half = size // 2
+		order[start:start + size] = primitives[np.argpartition(primitiveCenters[:, axis], half)]
+		node_children[node] = [add_node(start, start + half), add_node(start + half, start + size)]
+		stack += node_children[node]
+	return (np.array(node_boxes, np.float32).reshape(-1, 6), np.array(node_children, np.int32).reshape(-1, 2),
+		np.array(node_ranges, np.int32).reshape(-1, 2), order)
+
+def boxes_intersect(boxes, region):
+	"""bool per row of boxes (n, 6) touching region (min xyz, max xyz)"""
+	low = np.asarray(region[0], np.float32)
+	high = np.asarray(region[1], np.float32)
+	return np.all(boxes[:, :3] <= high, axis=1) & np.all(boxes[:, 3:] >= low, axis=1)
+
+def boxes_within(boxes, center, radius):
+	"""bool per row of boxes (n, 6) whose closest point is at most radius from center"""
+	center = np.asarray(center, np.float32)
+	distance = np.maximum(np.maximum(boxes[:, :3] - center, center - boxes[:, 3:]), 0)
+	return (distance * distance).sum(axis=1) <= radius * radius
+
+class SpatialIndex(object):
+	"""BVH over the mesh group boxes of every model of a tree"""
+	def __init__(self, root, arrays):
+		self.root = root
+		for name, array in arrays.items():
+			setattr(self, name, array)
+		# python lists walk faster than numpy rows for the few nodes a query visits
+		self.node_box_list = self.node_boxes.tolist()
+		self.node_children_list = self.node_children.tolist()
+		self.node_range_list = self.node_ranges.tolist()
+
+	@classmethod
+	def build(cls, root, previous=None, leaf_size=LEAF_SIZE):
+		root = os.path.abspath(root)
+		arrays = collect_boxes(root, previous)
+		arrays['node_boxes'], arrays['node_children'], arrays['node_ranges'], arrays['order'] = build_bvh(arrays['boxes'], leaf_size)
+		return cls(root, arrays)
+
+	@classmethod
+	def load(cls, index_file, root=None):
+		"""root overrides the tree the index was built from, e.g. after moving it"""
+		with np.load(index_file, allow_pickle=False) as data:
+			if int(data['version']) != INDEX_VERSION:
+				raise ValueError('%s: index version %d, expected %d' % (index_file, int(data['version']), INDEX_VERSION))
+			arrays = dict([(name, data[name]) for name in data.files if not name in ('version', 'root')])
+			return cls(root or str(data['root']), arrays)
+
+	def save(self, index_file):
+		arrays = dict([(name, getattr(self, name)) for name in ('files', 'file_sizes', 'file_mtimes', 'model_boxes', 'boxes',
+			'file_index', 'group_index', 'group_names', 'node_boxes', 'node_children', 'node_ranges', 'order')])
+		with open(index_file, 'wb') as index_fp:
+			np.savez(index_fp, version=np.array(INDEX_VERSION), root=np.array(self.root), **arrays)
+		return index_file
+
+	def walk(self, node_test):
+		"""primitive rows in the leaves whose node box passes node_test(box list)"""
+		if not self.node_box_list:
+			return np.zeros(0, np.int32)
+		ranges = []
+		stack = [0]
+		while stack:
+			node = stack.pop()
+			if not node_test(self.node_box_list[node]):
+				continue
+			left, right = self.node_children_list[node]
+			if left < 0:
+				ranges.append(self.node_range_list[node])
+			else:
+				stack.append(right)
+				stack.append(left)
+		if not ranges:
+			return np.zeros(0, np.int32)
+		return np.concatenate([self.order[start:start + count] for start, count in ranges])
+
+	def query_box(self, region):
+		"""rows of the mesh groups intersecting region (min xyz, max xyz)"""
+		low, high = region
+		def node_test(box):
+			return box[0] <= high[0] and box[1] <= high[1] and box[2] <= high[2] and \
+				box[3] >= low[0] and box[4] >= low[1] and box[5] >= low[2]
+		rows = self.walk(node_test)
+		return np.sort(rows[boxes_intersect(self.boxes[rows], region)])
+
+	def query_sphere(self, center, radius):
+		"""rows of the mesh groups whose box lies within radius of center"""
+		limit = radius * radius
+		def node_test(box):
+			distance = 0.0
+			for axis in range(3):
+				gap = max(box[axis] - center[axis], center[axis] - box[axis + 3], 0.0)
+				distance += gap * gap
+			return distance <= limit
+		rows = self.walk(node_test)
+		return np.sort(rows[boxes_within(self.boxes[rows], center, radius)])
+
+	def get_file(self, fileIndex):
+		return os.path.join(self.root, str(self.files[fileIndex]))
+
+	def describe(self, rows):
+		"""[(wmb_file, meshGroupIndex, meshGroupname, (min xyz, max xyz))] of query rows"""
+		hits = []
+		for row in rows.tolist():
+			box = self.boxes[row].tolist()
+			hits.append((self.get_file(self.file_index[row]), int(self.group_index[row]), str(self.group_names[row]),
+				(tuple(box[:3]), tuple(box[3:]))))
+		return hits
+
+	def get_models(self, rows):
+		"""{wmb_file: [meshGroupIndex]} of query rows, -1 stands for a model without mesh groups"""
+		models = {}
+		for row in rows.tolist():
+			models.setdefault(self.get_file(self.file_index[row]), []).append(int(self.group_index[row]))
+		return models
+
+def build_index(root, index_file, rebuild=False, leaf_size=LEAF_SIZE):
+	"""build or update the index of root, returns the SpatialIndex"""
+	previous = None
+	if not rebuild and os.path.exists(index_file):
+		try:
+			previous = SpatialIndex.load(index_file, root)
+		except (ValueError, KeyError, IOError, OSError) as e:
+			log.warning('rebuilding %s: %s', index_file, e)
+	index = SpatialIndex.build(root, previous, leaf_size)
+	index.save(index_file)
+	return index
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description='spatial index of the .wmb models of an extracted tree')
+	commands = parser.add_subparsers(dest='command')
+	build = commands.add_parser('build', help='build or update an index')
+	build.add_argument('root', help='extracted folder')
+	build.add_argument('--out', required=True, help='index file (.npz)')
+	build.add_argument('--rebuild', action='store_true', help='read every file again instead of reusing unchanged ones')
+	query = commands.add_parser('query', help='models and mesh groups in a box or sphere')
+	query.add_argument('index', help='index file (.npz)')
+	query.add_argument('--root', default=None, help='tree the files are resolved against, default is the indexed one')
+	query.add_argument('--box', type=float, nargs=6, metavar='F', help='two corners x0 y0 z0 x1 y1 z1')
+	query.add_argument('--point', type=float, nargs=3, metavar='F', help='center of a sphere query')
+	query.add_argument('--radius', type=float, default=0.0, help='radius of the sphere query')
+	return parser.parse_args(argv)
+
+if __name__ == '__main__':
+	args = parse_args(sys.argv[1:])
+	if args.command == 'build':
+		start = time.time()
+		index = build_index(args.root, args.out, args.rebuild)
+		print('[Info] %d models, %d mesh groups, %d nodes in %.2fs' % (len(index.files), len(index.boxes),
+			len(index.node_boxes), time.time() - start))
+	elif args.command == 'query' and (args.box or args.point):
+		index = SpatialIndex.load(args.index, args.root)
+		start = time.perf_counter()
+		if args.box:
+			rows = index.query_box(make_region(args.box[:3], args.box[3:]))
+		else:
+			rows = index.query_sphere(args.point, args.radius)
+		seconds = time.perf_counter() - start
+		print(json.dumps({
+			'seconds': seconds,
+			'models': index.get_models(rows),
+			'mesh_groups': [{'file': f, 'group': g, 'name': n, 'box': b} for f, g, n, b in index.describe(rows)],
+		}, indent=2))
+	else:
+		print('[Error] use build, or query with --box or --point')
+		sys.exit(2)
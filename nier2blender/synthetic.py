@@ -0,0 +1,396 @@
+#encoding = utf-8
+"""writers of synthetic but valid game files, for benchmarking and fuzzing the parsers
+
+    make_model(out_dir, 'pl0000', vertices=10000)     out_dir/pl0000.dtt/pl0000.wmb, .wtp
+                                                      out_dir/pl0000.dat/pl0000.wta
+    write_mot(mot_file, bones=20, frames=300)         every compress type 0-8
+    write_dat(archive_file, [(name, data), ...])      DAT/DTT archive
+
+the layouts are the ones wmb.py, wta.py, mot.py and dat_unpacker.py read,
+everything is generated from a seed so the same arguments give the same bytes.
+"""
+import os
+import struct
+import numpy as np
+from nier2blender.util import create_dir
+from nier2blender.mot import SIGN as MOT_SIGN, VERSION as MOT_VERSION, KEYFRAME_FIELDS, MOT_FLOAT_DECOMPRESSOR, align4
+
+WMB3_HEADER_SIZE = 0x8c
+WMB3_MESH_SIZE = 0x1c
+BONE_WEIGHT_STRIDE = 0x8
+NO_BONE_SET = 0xffffffff
+
+class BlobWriter(object):
+	"""append-only byte buffer whose sections are placed at aligned offsets"""
+	def __init__(self, size=0):
+		self.data = bytearray(size)
+
+	def add(self, data, alignment=4):
+		self.data += b'\x00' * ((-len(self.data)) % alignment)
+		offset = len(self.data)
+		self.data += data
+		return offset
+
+	def add_string(self, text):
+		return self.add(text.encode('utf8') + b'\x00', 1)
+
+	def patch(self, offset, fmt, *values):
+		struct.pack_into(fmt, self.data, offset, *values)
+
+def make_skeleton(bones, rng):
+	"""binary tree of bones, returns (parents, world positions)"""
+	parents = [0xffff] + [(i - 1) // 2 for i in range(1, bones)]
+	positions = np.zeros((bones, 3), np.float32)
+	for i in range(1, bones):
+		positions[i] = positions[parents[i]] + rng.uniform(-0.2, 0.2, 3) + (0, 0.1, 0)
+	return parents, positions
+
+def make_vertex_buffer(vertex_count, stride, bone_set_size, rng, origin=(0, 0, 0)):
+	"""vertices of one vertex group in the stride dependent layout of wmb3_vertex"""
+	from nier2blender.wmb import get_vertex_dtype
+	vertices = np.zeros(vertex_count, get_vertex_dtype(stride))
+	vertices['position'] = rng.uniform(-1, 1, (vertex_count, 3)) + np.asarray(origin, np.float32)
+	normals = rng.normal(size=(vertex_count, 3))
+	normals /= np.maximum(np.linalg.norm(normals, axis=1), 1e-6)[:, None]
+	vertices['normal'][:, :3] = np.round(normals * 127).astype(np.int8).view(np.uint8)
+	vertices['uv'] = rng.uniform(0, 1, (vertex_count, 2))
+	if stride > 0x14:
+		vertices['boneIndices'] = rng.integers(0, max(bone_set_size, 1), (vertex_count, 4))
+	if stride > 0x18:
+		# four weights summing to exactly 255
+		cuts = np.sort(rng.integers(0, 256, (vertex_count, 3)), axis=1)
+		bounds = np.concatenate([np.zeros((vertex_count, 1), np.int64), cuts, np.full((vertex_count, 1), 255)], axis=1)
+		vertices['boneWeights'] = np.diff(bounds, axis=1)
+	return vertices.tobytes()
+
+def make_faces(mesh_ranges, faces_per_vertex, rng):
+	"""triangles of every mesh using only vertices of its range, returns (indices, [(faceStart, faceCount)])"""
+	indices = []
+	face_ranges = []
+	start = 0
+	for vertex_start, vertex_count in mesh_ranges:
+		count = max(1, int(vertex_count * faces_per_vertex)) * 3
+		# every vertex of the range is used at least once
+		mesh_indices = np.concatenate([np.arange(vertex_count), rng.integers(0, vertex_count, max(count - vertex_count, 0))])[:max(count, vertex_count)]
+		mesh_indices = mesh_indices[:len(mesh_indices) - len(mesh_indices) % 3]
+		indices.append(mesh_indices + vertex_start)
+		face_ranges.append((start, len(mesh_indices)))
+		start += len(mesh_indices)
+	return np.concatenate(indices), face_ranges
+
+def write_wmb3(wmb_file, bones=32, vertex_groups=2, vertices=1000, stride=0x1c, index_size=2,
+		meshes=4, mesh_groups=2, materials=4, lods=2, textures=None, faces_per_vertex=2.0, seed=0, origin=(0, 0, 0)):
+	"""write a synthetic WMB3 file, returns a summary dict
+
+	vertices is the vertex count of every vertex group, split in meshes ranges.
+	LOD n reuses the vertex groups with 1 / 2^n of the faces of every mesh.
+	skinning needs stride 0x1c, with a smaller stride the meshes get no bone set.
+	textures is a list of texture identifiers (ints) given to the materials.
+	the model fills the [-1, 1] cube around origin, the box of mesh group g is the
+	g-th of mesh_groups slabs of that cube along x.
+	"""
+	assert stride in (0x14, 0x18, 0x1c), "stride must be 0x14, 0x18 or 0x1c"
+	assert index_size in (2, 4), "index_size must be 2 or 4"
+	if index_size == 2:
+		assert vertices <= 0x10000, "16 bit indices address at most 0x10000 vertices"
+	rng = np.random.default_rng(seed)
+	textures = list(textures or [])
+	blob = BlobWriter(WMB3_HEADER_SIZE)
+	skinned = bones > 0 and stride > 0x18
+
+	# bones
+	parents, positions = make_skeleton(bones, rng)
+	bone_data = bytearray()
+	for i in range(bones):
+		parent_position = positions[parents[i]] if parents[i] != 0xffff else np.zeros(3, np.float32)
+		local = positions[i] - parent_position
+		bone_data += struct.pack('<HH21f', i * 10, parents[i],
+			local[0], local[1], local[2], 0, 0, 0, 1, 1, 1,
+			positions[i][0], positions[i][1], positions[i][2], 0, 0, 0, 1, 1, 1,
+			positions[i][0], positions[i][1], positions[i][2])
+	bone_offset = blob.add(bytes(bone_data)) if bones else 0
+	unknown1_offset = blob.add(b'\x00' * bones, 1) if bones else 0
+
+	# bone map and one bone set per vertex group
+	bone_map_offset = blob.add(struct.pack('<%dI' % bones, *range(bones))) if bones else 0
+	bone_set_size = min(bones, 64)
+	bone_sets = []
+	if skinned:
+		for i in range(vertex_groups):
+			bone_sets.append(np.sort(rng.choice(bones, bone_set_size, replace=False)).astype(np.uint16))
+	bone_set_offset = 0
+	if bone_sets:
+		bone_set_offsets = [blob.add(bone_set.tobytes()) for bone_set in bone_sets]
+		bone_set_offset = blob.add(b''.join([struct.pack('<II', offset, bone_set_size) for offset in bone_set_offsets]))
+
+	# vertex groups, LOD0 meshes split every group in ranges
+	meshes = max(1, min(meshes, vertices))
+	bounds = np.linspace(0, vertices, meshes + 1).astype(np.int64)
+	mesh_ranges = [(int(bounds[i]), int(bounds[i + 1] - bounds[i])) for i in range(meshes)]
+	group_headers = []
+	group_faces = []
+	for group_index in range(vertex_groups):
+		vertex_offset = blob.add(make_vertex_buffer(vertices, stride, bone_set_size, rng, origin), 0x10)
+		weight_offset = blob.add(b'\x00' * (vertices * BONE_WEIGHT_STRIDE), 0x10)
+		indices, face_ranges = make_faces(mesh_ranges, faces_per_vertex, rng)
+		face_offset = blob.add(indices.astype('<u2' if index_size == 2 else '<u4').tobytes(), 0x10)
+		group_headers.append(struct.pack('<12I', vertex_offset, weight_offset, 0, 0, stride, BONE_WEIGHT_STRIDE,
+			0, 0, vertices, 0, face_offset, len(indices)))
+		group_faces.append(face_ranges)
+	vertex_group_offset = blob.add(b''.join(group_headers))
+
+	# meshes of every LOD, LOD n keeps the first 1 / 2^n of the faces
+	mesh_data = bytearray()
+	lod_infos = []
+	for lod in range(lods):
+		mesh_start = len(mesh_data) // WMB3_MESH_SIZE
+		grouped = []
+		for group_index in range(vertex_groups):
+			for mesh_index, (vertex_start, vertex_count) in enumerate(mesh_ranges):
+				face_start, face_count = group_faces[group_index][mesh_index]
+				face_count = max(3, (face_count >> lod) // 3 * 3)
+				bone_set_index = group_index if skinned else NO_BONE_SET
+				mesh_data += struct.pack('<7I', group_index, bone_set_index, vertex_start, face_start, vertex_count, face_count, 0)
+				grouped.append((group_index, mesh_index % max(mesh_groups, 1), mesh_index % max(materials, 1)))
+		lod_infos.append((mesh_start, grouped))
+	mesh_offset = blob.add(bytes(mesh_data))
+
+	group_info_data = bytearray()
+	for lod, (mesh_start, grouped) in enumerate(lod_infos):
+		name_offset = blob.add_string('LOD%d' % lod)
+		grouped_offset = blob.add(b''.join([struct.pack('<6I', group_index, mesh_group, material, 0, 0, 0)
+			for group_index, mesh_group, material in grouped]))
+		group_info_data += struct.pack('<5I', name_offset, lod, mesh_start, grouped_offset, len(grouped))
+	mesh_group_info_offset = blob.add(bytes(group_info_data))
+
+	mesh_group_data = bytearray()
+	slab = 1.0 / max(mesh_groups, 1)
+	for mesh_group in range(mesh_groups):
+		name_offset = blob.add_string('group%d' % mesh_group)
+		material_indices = [m for m in range(materials) if m % max(mesh_groups, 1) == mesh_group] or [0]
+		material_index_offset = blob.add(struct.pack('<%dH' % len(material_indices), *material_indices))
+		bone_indices = list(range(min(bones, 8)))
+		bone_index_offset = blob.add(struct.pack('<%dH' % len(bone_indices), *bone_indices)) if bone_indices else 0
+		mesh_group_data += struct.pack('<I6f4I', name_offset,
+			origin[0] - 1 + (2 * mesh_group + 1) * slab, origin[1], origin[2], slab, 1, 1,
+			material_index_offset, len(material_indices), bone_index_offset, len(bone_indices))
+	mesh_group_offset = blob.add(bytes(mesh_group_data))
+
+	material_data = bytearray()
+	for material_index in range(materials):
+		name_offset = blob.add_string('material%d' % material_index)
+		effect_offset = blob.add_string('CNShader.fx')
+		technique_offset = blob.add_string('Default')
+		texture_entries = []
+		if textures:
+			for k, texture_name in enumerate(('g_AlbedoMap', 'g_NormalMap')):
+				texture_entries.append((blob.add_string(texture_name), textures[(material_index * 2 + k) % len(textures)]))
+		texture_offset = blob.add(b''.join([struct.pack('<II', offset, identifier) for offset, identifier in texture_entries]) or b'\x00' * 8)
+		uniform_offset = blob.add(struct.pack('<If', blob.add_string('g_Glossiness'), 0.5))
+		material_data += struct.pack('<4H10I', 0, 0, 0, 0, name_offset, effect_offset, technique_offset, 0,
+			texture_offset, len(texture_entries), 0, 0, uniform_offset, 1)
+	material_offset = blob.add(bytes(material_data))
+
+	# center and half size of the whole model
+	low = np.array([-1, -1, -1], np.float32) + np.asarray(origin, np.float32)
+	high = np.array([1, 1, 1], np.float32) + np.asarray(origin, np.float32)
+	blob.patch(0, '<4s3I6f22I3I', b'WMB3', 0x20160116, 0, index_size == 4 and 0x8 or 0,
+		*(list((low + high) / 2) + list((high - low) / 2) + [
+		bone_offset, bones,
+		unknown1_offset, bones,
+		vertex_group_offset, vertex_groups,
+		mesh_offset, len(mesh_data) // WMB3_MESH_SIZE,
+		mesh_group_info_offset, lods,
+		0, 0,
+		bone_map_offset, bones,
+		bone_set_offset, len(bone_sets),
+		material_offset, materials,
+		mesh_group_offset, mesh_groups,
+		0, 0,
+		0, 0, 0]))
+	with open(wmb_file, 'wb') as wmb_fp:
+		wmb_fp.write(blob.data)
+	return {
+		'file': wmb_file,
+		'bytes': len(blob.data),
+		'bones': bones,
+		'vertex_groups': vertex_groups,
+		'vertices': vertices * vertex_groups,
+		'indices': sum([face_count for ranges in group_faces for face_start, face_count in ranges]),
+		'meshes': len(mesh_data) // WMB3_MESH_SIZE,
+		'lods': lods,
+	}
+
+def make_dds(width, height, mipmaps=None, fourcc=b'DXT1'):
+	"""a block compressed DDS file with its mip chain, the texel data is a pattern"""
+	block_size = fourcc == b'DXT1' and 8 or 16
+	if mipmaps is None:
+		mipmaps = max(width, height).bit_length()
+	levels = []
+	w, h = width, height
+	for level in range(mipmaps):
+		levels.append(max(1, (w + 3) // 4) * max(1, (h + 3) // 4) * block_size)
+		w, h = max(1, w // 2), max(1, h // 2)
+	header = struct.pack('<4s7I44x8I4I4x', b'DDS ', 124,
+		0x1 | 0x2 | 0x4 | 0x1000 | 0x20000 | 0x80000, height, width, levels[0], 0, mipmaps,
+		32, 0x4, struct.unpack('<I', fourcc)[0], 0, 0, 0, 0, 0,
+		0x1000 | 0x8 | 0x400000, 0, 0, 0)
+	data = bytes(bytearray([(i * 37) & 0xff for i in range(256)])) * (sum(levels) // 256 + 1)
+	return header + data[:sum(levels)]
+
+def write_wta_wtp(wta_file, wtp_file, identifiers, size=256, alignment=0x1000):
+	"""texture table and texture pack of identifiers, one DDS each"""
+	count = len(identifiers)
+	wtp = BlobWriter()
+	offsets = []
+	sizes = []
+	for i, identifier in enumerate(identifiers):
+		dds = make_dds(size >> (i % 3), size >> (i % 3))
+		offsets.append(wtp.add(dds, alignment))
+		sizes.append(len(dds))
+	header_size = 0x20
+	table = struct.pack('<%dI' % count, *offsets) + struct.pack('<%dI' % count, *sizes) + \
+		struct.pack('<%dI' % count, *([0x20000020] * count)) + struct.pack('<%dI' % count, *identifiers)
+	offset_array = header_size
+	wta = struct.pack('<4s7I', b'WTB\x00', 1, count, offset_array, offset_array + count * 4,
+		offset_array + count * 8, offset_array + count * 12, offset_array + count * 16)
+	# unknownArray2 runs to the end of the file
+	wta += table + struct.pack('<%dI' % count, *([0] * count))
+	with open(wta_file, 'wb') as wta_fp:
+		wta_fp.write(wta)
+	with open(wtp_file, 'wb') as wtp_fp:
+		wtp_fp.write(wtp.data)
+	return {'wta': wta_file, 'wtp': wtp_file, 'textures': count, 'bytes': len(wtp.data)}
+
+def make_model(out_dir, name='pl0000', texture_count=4, texture_size=256, seed=0, **wmb_args):
+	"""a model in the unpacked dtt/dat folder layout the importer and WMB3 expect"""
+	dtt_dir = os.path.join(out_dir, name + '.dtt')
+	dat_dir = os.path.join(out_dir, name + '.dat')
+	create_dir(dtt_dir)
+	wmb_file = os.path.join(dtt_dir, name + '.wmb')
+	identifiers = [(0x10000000 + seed * 0x1000 + i * 0x11) & 0xffffffff for i in range(texture_count)]
+	summary = write_wmb3(wmb_file, textures=identifiers, seed=seed, **wmb_args)
+	if texture_count:
+		create_dir(dat_dir)
+		summary['textures'] = write_wta_wtp(os.path.join(dat_dir, name + '.wta'), os.path.join(dtt_dir, name + '.wtp'), identifiers, texture_size)
+	return summary
+
+def compress_float(value):
+	"""16 bit code of the MOT header float nearest to value"""
+	table = MOT_FLOAT_DECOMPRESSOR.table
+	finite = np.isfinite(table)
+	codes = np.nonzero(finite)[0]
+	return int(codes[np.argmin(np.abs(table[finite].astype(np.float64) - value))])
+
+def quantize(values, levels, rng_low, rng_high):
+	"""(base, extent, codes) with base + extent * code ~ values"""
+	base, extent = rng_low, (rng_high - rng_low) / levels if rng_high > rng_low else 1.0
+	codes = np.clip(np.round((values - base) / extent), 0, levels).astype(np.int64)
+	return base, extent, codes
+
+def make_track_data(comtype, frame_count, keys, rng):
+	"""(keycount, data) of one animated track, data starts with the keyframe header"""
+	if comtype in (1, 2, 3):
+		keycount = frame_count
+		values = np.sin(np.linspace(0, rng.uniform(1, 6), keycount)) * rng.uniform(0.1, 2)
+		if comtype == 1:
+			return keycount, values.astype('<f4').tobytes()
+		levels = comtype == 2 and 0xffff or 0xff
+		if comtype == 2:
+			base, extent, codes = quantize(values, levels, values.min(), values.max())
+			return keycount, struct.pack('<2f', base, extent) + codes.astype('<u2').tobytes()
+		header = [compress_float(values.min()), compress_float((values.max() - values.min()) / levels)]
+		base, extent = [float(v) for v in MOT_FLOAT_DECOMPRESSOR.decompress_array(header)]
+		codes = np.clip(np.round((values - base) / (extent or 1.0)), 0, levels).astype(np.int64)
+		return keycount, struct.pack('<2H', *header) + codes.astype('u1').tobytes()
+
+	# evenly spaced keys, the byte sized frames of type 6 and 7 limit the range
+	keycount = max(2, keys)
+	max_frame = frame_count - 1
+	if comtype == 6:
+		max_frame = min(max_frame, 0xff)
+	elif comtype == 7:
+		max_frame = min(max_frame, 0xff * (keycount - 1))
+	frames = np.unique(np.round(np.linspace(0, max_frame, min(keycount, max_frame + 1))).astype(np.int64))
+	keycount = len(frames)
+	p = np.sin(frames / max(frame_count, 1) * 6.0) * rng.uniform(0.1, 2)
+	a = rng.uniform(-0.05, 0.05, keycount)
+	d = rng.uniform(-0.05, 0.05, keycount)
+	dtype = np.dtype([(field, '<' + fmt) for field, fmt in KEYFRAME_FIELDS[comtype]])
+	keyframes = np.zeros(keycount, dtype)
+	keyframes['frame'] = np.diff(frames, prepend=0) if comtype == 7 else frames
+	if comtype == 4:
+		keyframes['p'], keyframes['a'], keyframes['d'] = p, a, d
+		return keycount, keyframes.tobytes()
+	levels = comtype == 5 and 0xffff or 0xff
+	header = []
+	for values in (p, a, d):
+		low, high = values.min(), values.max()
+		header += [low, (high - low) / levels if high > low else 1.0]
+	if comtype == 5:
+		header_data = struct.pack('<6f', *header)
+	else:
+		codes = [compress_float(v) for v in header]
+		header = [float(v) for v in MOT_FLOAT_DECOMPRESSOR.decompress_array(codes)]
+		header_data = struct.pack('<6H', *codes)
+	for i, (field, values) in enumerate((('p', p), ('a', a), ('d', d))):
+		extent = header[i * 2 + 1] or 1.0
+		keyframes[field] = np.clip(np.round((values - header[i * 2]) / extent), 0, levels)
+	return keycount, header_data + keyframes.tobytes()
+
+def write_mot(mot_file, bones=10, frames=100, keys=10, comtypes=range(9), name='synthetic', seed=0):
+	"""write a MOT file, the tracks of every bone cycle through comtypes (0 is a constant track)"""
+	rng = np.random.default_rng(seed)
+	comtypes = list(comtypes)
+	tracks = []
+	channel = 0
+	for bone in range(bones):
+		for track_type in (0, 1, 2, 3, 4, 5, 7, 8, 9):
+			comtype = comtypes[channel % len(comtypes)]
+			channel += 1
+			if comtype == 0 or frames < 2:
+				const = 1.0 if track_type >= 7 else float(rng.uniform(-1, 1))
+				tracks.append((bone, track_type, 0, 0, const, None))
+			else:
+				keycount, data = make_track_data(comtype, frames, keys, rng)
+				tracks.append((bone, track_type, comtype, keycount, None, data))
+	header_size = 0x2c
+	track_offset = header_size
+	data_offset = track_offset + (len(tracks) + 1) * 0xc
+	records = bytearray()
+	data = bytearray()
+	for i, (bone, track_type, comtype, keycount, const, track_data) in enumerate(tracks):
+		if track_data is None:
+			records += struct.pack('<hBBIf', bone, track_type, 0, 0, const)
+			continue
+		# offsets are relative to the track record, chunks are 4 byte aligned
+		offset = data_offset + len(data) - (track_offset + i * 0xc)
+		records += struct.pack('<hBBII', bone, track_type, comtype, keycount, offset)
+		data += track_data + b'\x00' * ((-len(track_data)) % 4)
+	records += struct.pack('<hBBIf', -1, 0, 0, 0, 0.0)
+	header = struct.pack('<4sIHHIII20s', MOT_SIGN, MOT_VERSION, 0, frames, track_offset, len(tracks), 0, name.encode('utf8')[:20])
+	with open(mot_file, 'wb') as mot_fp:
+		mot_fp.write(header + records + data)
+	return {'file': mot_file, 'bytes': len(header) + len(records) + len(data), 'tracks': len(tracks),
+		'bones': bones, 'frames': frames}
+
+def write_dat(archive_file, files, alignment=0x10):
+	"""DAT/DTT archive of [(filename, data)]"""
+	count = len(files)
+	name_size = max([len(name) for name, data in files] + [1]) + 1
+	file_table = 0x20
+	extension_table = file_table + count * 4
+	name_table = extension_table + count * 4
+	size_table = name_table + 4 + count * name_size
+	blob = BlobWriter(align4(size_table + count * 4))
+	offsets = [blob.add(data, alignment) for name, data in files]
+	blob.patch(0, '<4s7I', b'DAT\x00', count, file_table, extension_table, name_table, size_table, 0, 0)
+	for i, (name, data) in enumerate(files):
+		blob.patch(file_table + i * 4, '<I', offsets[i])
+		blob.patch(extension_table + i * 4, '<4s', name.split('.')[-1].encode('ascii')[:3])
+		blob.patch(size_table + i * 4, '<I', len(data))
+		blob.patch(name_table + 4 + i * name_size, '%ds' % name_size, name.encode('ascii'))
+	blob.patch(name_table, '<I', name_size)
+	with open(archive_file, 'wb') as archive_fp:
+		archive_fp.write(blob.data)
+	return archive_file
@@ -1,6 +1,7 @@
 #encoding = utf-8
 import os
 import sys
+import mmap
 import struct
 import numpy as np
 
@@ -17,6 +18,121 @@ def to_string(bs, encoding = 'utf8'):
 	return bs.split(b'\x00')[0].decode(encoding)
 
 
+_struct_cache = {}
+
+def get_struct(fmt):
+	"""compiled struct.Struct of fmt, shared by every reader"""
+	compiled = _struct_cache.get(fmt)
+	if compiled is None:
+		compiled = _struct_cache[fmt] = struct.Struct(fmt)
+	return compiled
+
+class BufferReader(object):
+	"""file-like reader over bytes or an mmap, get() unpacks in place with cached structs
+
+	read/seek/tell keep the parsers written against open() files working,
+	the data is sliced from memory instead of one read syscall per field.
+	"""
+	def __init__(self, data, endian = '<', offset = 0, source = None):
+		self.data = data
+		self.endian = endian
+		self.offset = offset
+		self.size = len(data)
+		self.source = source
+
+	def seek(self, offset, whence = 0):
+		assert whence in (0, 1, 2)
+		if whence == 0:
+			self.offset = offset
+		elif whence == 1:
+			self.offset += offset
+		else:
+			self.offset = self.size + offset
+		return self.offset
+
+	def tell(self):
+		return self.offset
+
+	def skip(self, size):
+		self.offset += size
+
+	def read(self, size = -1):
+		if size is None or size < 0:
+			size = self.size - self.offset
+		data_seg = self.data[self.offset: self.offset + size]
+		self.offset += len(data_seg)
+		return data_seg
+
+	def get_raw(self, size):
+		data_seg = self.data[self.offset: self.offset + size]
+		self.offset += size
+		return data_seg
+
+	def get(self, fmt, offset = None, force_tuple = False):
+		if offset is not None:
+			self.offset = offset
+		compiled = get_struct(self.endian + fmt)
+		res = compiled.unpack_from(self.data, self.offset)
+		self.offset += compiled.size
+		if not force_tuple and len(res) == 1:
+			return res[0]
+		return res
+
+	def pad(self, size, pad_pattern = b"\x00"):
+		pad_data = self.get_raw(size)
+		pattern_size = len(pad_pattern)
+		for i in range(size // pattern_size):
+			assert pad_pattern.startswith(
+				pad_data[i * pattern_size: (i + 1) * pattern_size])
+
+	def align(self, size):
+		rem = self.offset % size
+		if rem:
+			self.pad(size - rem)
+
+	def get_cstring(self, encoding = 'utf8'):
+		end = self.data.find(b"\x00", self.offset)
+		if end < 0:
+			end = self.size
+		s = self.data[self.offset: end]
+		self.offset = min(end + 1, self.size)
+		return bytes(s).decode(encoding)
+
+	def block(self, size, endian = None):
+		if endian is None:
+			endian = self.endian
+		return BufferReader(self.get_raw(size), endian)
+
+	def assert_end(self):
+		assert self.offset == self.size
+
+	def close(self):
+		if isinstance(self.data, mmap.mmap):
+			self.data.close()
+		self.data = b''
+		self.size = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+		return False
+
+def open_reader(filename, endian = '<', use_mmap = True):
+	"""BufferReader over the whole file, mapped when possible, else read once"""
+	with open(filename, 'rb') as fp:
+		data = None
+		if use_mmap:
+			try:
+				data = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+			except (ValueError, OSError):
+				# empty files can not be mapped
+				data = None
+		if data is None:
+			data = fp.read()
+	return BufferReader(data, endian, source = filename)
+
 def create_dir(dirpath):
 	if not os.path.exists(dirpath):
 		os.makedirs(dirpath)
@@ -31,8 +147,11 @@ def find_files(dir_name,ext):
 				filenameArray.append(filename)
 	return filenameArray
 
+def format_class(obj):
+	return '\n'.join(sorted(['%s:\t%s ' % item for item in obj.__dict__.items() if item[0].find('Offset') < 0 or item[0].find('unknown') < 0 ]))
+
 def print_class(obj):
-	print ('\n'.join(sorted(['%s:\t%s ' % item for item in obj.__dict__.items() if item[0].find('Offset') < 0 or item[0].find('unknown') < 0 ])))
+	print (format_class(obj))
 	print('\n')
 
 def current_postion(fp):
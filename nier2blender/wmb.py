@@ -1,5 +1,27 @@
 from nier2blender.util import *
 from nier2blender.wta import *
+from nier2blender.profiler import profiler
+from nier2blender.log import get_logger, DEBUG
+
+log = get_logger('wmb')
+
+def decode_bounding_box(values):
+	"""(min xyz, max xyz) of the six floats of a wmb box: center xyz and half size xyz"""
+	center = values[0:3]
+	halfSize = [abs(value) for value in values[3:6]]
+	return (tuple([center[i] - halfSize[i] for i in range(3)]), tuple([center[i] + halfSize[i] for i in range(3)]))
+
+def make_region(low, high):
+	"""(min xyz, max xyz) box from two corners in any order, in wmb coordinates"""
+	return (tuple([min(low[i], high[i]) for i in range(3)]), tuple([max(low[i], high[i]) for i in range(3)]))
+
+def box_intersects(box, region):
+	"""boxes touching on a face count as intersecting"""
+	for i in range(3):
+		if box[0][i] > region[1][i] or box[1][i] < region[0][i]:
+			return False
+	return True
+
 class WMB_Header(object):
 	""" fucking header	"""
 	def __init__(self, wmb_fp):
@@ -15,6 +37,8 @@ class WMB_Header(object):
 			self.bounding_box4 = to_float(wmb_fp.read(4))
 			self.bounding_box5 = to_float(wmb_fp.read(4))
 			self.bounding_box6 = to_float(wmb_fp.read(4))
+			self.bounding_box = decode_bounding_box((self.bounding_box1, self.bounding_box2, self.bounding_box3,
+				self.bounding_box4, self.bounding_box5, self.bounding_box6))
 			self.boneArrayOffset = to_int(wmb_fp.read(4))
 			self.boneCount = to_int(wmb_fp.read(4))
 			self.unknownChunk1Offset = to_int(wmb_fp.read(4))
@@ -62,19 +86,20 @@ class wmb3_vertex(object):
 	"""docstring for wmb3_vertex"""
 	def __init__(self, wmb_fp , stride):
 		super(wmb3_vertex, self).__init__()
-		self.positionX = to_float(wmb_fp.read(4))
-		self.positionY = to_float(wmb_fp.read(4))
-		self.positionZ = to_float(wmb_fp.read(4))
-		self.normalX = to_int(wmb_fp.read(1)) * 2 / 255			
-		self.normalY = to_int(wmb_fp.read(1)) * 2 / 255	
-		self.normalZ = to_int(wmb_fp.read(1)) * 2 / 255	
-		wmb_fp.read(1)											
-		self.textureU = to_float16(wmb_fp.read(2))				
-		self.textureV = to_float16(wmb_fp.read(2))				
+		# position, normal, pad, half float uv
+		data = wmb_fp.read(0x14)
+		(self.positionX, self.positionY, self.positionZ,
+			normalX, normalY, normalZ, pad) = get_struct('<3f4B').unpack_from(data)
+		textureUV = np.frombuffer(data, np.float16, 2, 0x10)
+		self.textureU = float(textureUV[0])
+		self.textureV = float(textureUV[1])
+		self.normalX = normalX * 2 / 255
+		self.normalY = normalY * 2 / 255
+		self.normalZ = normalZ * 2 / 255
 		if stride > 0x14:										
-			self.boneIndices = [to_int(wmb_fp.read(1)) for i in range(4)]
+			self.boneIndices = list(wmb_fp.read(4))
 		if stride > 0x18:										
-			self.boneWeights = [to_int(wmb_fp.read(1))/255 for i in range(4)]
+			self.boneWeights = [weight / 255 for weight in wmb_fp.read(4)]
 
 class wmb3_boneWeight(object):
 	"""docstring for wmb3_boneWeight"""
@@ -93,6 +118,21 @@ class wmb3_boneWeight(object):
 		if stride > 0x18:
 			self.unknown18 = hex(to_int(wmb_fp.read(4))) 
 		
+def get_vertex_dtype(stride):
+	"""numpy layout of a vertex buffer, the fields wmb3_vertex reads"""
+	names = ['position', 'normal', 'uv']
+	formats = [('<f4', 3), ('u1', 4), ('<f2', 2)]
+	offsets = [0x0, 0xc, 0x10]
+	if stride > 0x14:
+		names.append('boneIndices')
+		formats.append(('u1', 4))
+		offsets.append(0x14)
+	if stride > 0x18:
+		names.append('boneWeights')
+		formats.append(('u1', 4))
+		offsets.append(0x18)
+	return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': stride})
+
 class wmb3_vertexGroup(object):
 	"""docstring for wmb3_vertexGroup"""
 	def __init__(self, wmb_fp, faceSize):
@@ -101,10 +141,16 @@ class wmb3_vertexGroup(object):
 		self.vertexGroupHeader = wmb3_vertexHeader(wmb_fp)
 		
 		
-		self.vertexArray = []
+		# the raw buffers are kept as arrays for the exporters
+		stride = self.vertexGroupHeader.vertexStride
+		vertexCount = self.vertexGroupHeader.vertexCount
 		wmb_fp.seek(self.vertexGroupHeader.vertexArrayOffset)
-		for vertex_index in range(self.vertexGroupHeader.vertexCount):
-			vertex = wmb3_vertex(wmb_fp, self.vertexGroupHeader.vertexStride)
+		vertexBuffer = wmb_fp.read(vertexCount * stride)
+		self.vertexData = np.frombuffer(vertexBuffer, get_vertex_dtype(stride), vertexCount)
+		vertexReader = BufferReader(vertexBuffer)
+		self.vertexArray = []
+		for vertex_index in range(vertexCount):
+			vertex = wmb3_vertex(vertexReader, stride)
 			self.vertexArray.append(vertex)
 
 		self.boneWeightArray = []
@@ -114,11 +160,23 @@ class wmb3_vertexGroup(object):
 
 		self.faceRawArray = []
 		wmb_fp.seek(self.vertexGroupHeader.faceArrayOffset)
-		for face_index in range(self.vertexGroupHeader.faceCount):
-			if faceSize == 2:
-				self.faceRawArray.append(to_int(wmb_fp.read(2)) + 1)
-			else:
-				self.faceRawArray.append(to_int(wmb_fp.read(4)) + 1)
+		faceCount = self.vertexGroupHeader.faceCount
+		self.faceData = np.frombuffer(wmb_fp.read(faceCount * faceSize), faceSize == 2 and '<u2' or '<u4', faceCount)
+		self.faceRawArray = (self.faceData.astype(np.int64) + 1).tolist()
+
+	def get_positions(self):
+		return self.vertexData['position'].astype(np.float64)
+
+	def get_normals(self):
+		return self.vertexData['normal'][:, :3] * 2 / 255
+
+	def get_uvs(self):
+		return self.vertexData['uv'].astype(np.float64)
+
+	def get_faces(self, mesh):
+		"""(n, 3) zero based vertex indices of a mesh of this vertex group"""
+		faceData = self.faceData[mesh.faceStart: mesh.faceStart + mesh.faceCount - mesh.faceCount % 3]
+		return faceData.astype(np.int64).reshape(-1, 3)
 
 class wmb3_mesh(object):
 	"""docstring for wmb3_mesh"""
@@ -248,7 +306,7 @@ class wmb3_meshGroup(object):
 	def __init__(self, wmb_fp):
 		super(wmb3_meshGroup, self).__init__()
 		nameOffset = to_int(wmb_fp.read(4))
-		bounding_box = wmb_fp.read(24)								
+		self.bounding_box = decode_bounding_box(get_struct('<6f').unpack(wmb_fp.read(24)))
 		materialIndexArrayOffset = to_int(wmb_fp.read(4))
 		materialIndexArrayCount =  to_int(wmb_fp.read(4))
 		boneIndexArrayOffset =to_int(wmb_fp.read(4))
@@ -295,86 +353,116 @@ class wmb3_meshGroupInfo(object):
 		
 			
 		
+def get_wta_file(wmb_file):
+	"""the wta of a wmb lives in the .dat folder next to its .dtt folder"""
+	return wmb_file.replace('.dtt','.dat').replace('.wmb','.wta')
+
+def get_wtp_file(wmb_file):
+	"""the wtp next to the wmb or None"""
+	wtp_file = wmb_file.replace('.wmb','.wtp')
+	if os.path.exists(wtp_file):
+		log.debug('found wtp file')
+		return wtp_file
+	return None
+
+def load_wta(wta_file):
+	"""parsed WTA, 0 when the file is missing (WMB3.wta keeps the old falsy value)"""
+	if not os.path.exists(wta_file):
+		return 0
+	log.debug('open wta file')
+	with open_reader(wta_file) as wta_fp:
+		return WTA(wta_fp)
+
 class WMB3(object):
 	"""docstring for WMB3"""
-	def __init__(self, wmb_file):
+	def __init__(self, wmb_file, load_textures = True):
+		"""load_textures False leaves wta to the caller, e.g. a background thread"""
 		super(WMB3, self).__init__()
 		wmb_fp = 0
-		wta_fp = 0
-		wtp_fp = 0
 		self.wta = 0
+		self.wtp_file = get_wtp_file(wmb_file)
 		if os.path.exists(wmb_file):
-			wmb_fp = open(wmb_file, "rb")
-		if os.path.exists(wmb_file.replace('.dtt','.dat').replace('.wmb','.wta')):
-			print('open wta file')
-			wta_fp = open(wmb_file.replace('.dtt','.dat').replace('.wmb','.wta'),'rb')
-		if os.path.exists(wmb_file.replace('.wmb','.wtp')):	
-			print('open wtp file')
-			self.wtp_fp = open(wmb_file.replace('.wmb','.wtp'),'rb')
-		
-		if wta_fp:
-			self.wta = WTA(wta_fp)
-			wta_fp.close()
-		self.wmb3_header = WMB_Header(wmb_fp)
+			wmb_fp = profiler.wrap_reader(open_reader(wmb_file))
+		if load_textures:
+			with profiler.phase('parse.wta'):
+				self.wta = load_wta(get_wta_file(wmb_file))
+		with profiler.phase('parse.header'):
+			self.wmb3_header = WMB_Header(wmb_fp)
 		self.hasBone = False
 		if self.wmb3_header.boneCount > 0:
 			self.hasBone = True
-		print_class(self.wmb3_header)
-		wmb_fp.seek(self.wmb3_header.boneArrayOffset)
+		if log.isEnabledFor(DEBUG):
+			log.debug('WMB3 header:\n%s', format_class(self.wmb3_header))
 
-		self.boneArray = []
-		for boneIndex in range(self.wmb3_header.boneCount):
-			self.boneArray.append(wmb3_bone(wmb_fp,boneIndex))
+		with profiler.phase('parse.bones'):
+			wmb_fp.seek(self.wmb3_header.boneArrayOffset)
+			self.boneArray = []
+			for boneIndex in range(self.wmb3_header.boneCount):
+				self.boneArray.append(wmb3_bone(wmb_fp,boneIndex))
 
-		# init useful custom property
-		for bone in self.boneArray:
-			if bone.parentIndex != -1 and bone.parentIndex != 0xffff:
-				bone.parentName = self.boneArray[bone.parentIndex].boneName
+			# init useful custom property
+			for bone in self.boneArray:
+				if bone.parentIndex != -1 and bone.parentIndex != 0xffff:
+					bone.parentName = self.boneArray[bone.parentIndex].boneName
 
 		wmb_fp.seek(self.wmb3_header.unknownChunk1Offset)
 		unknownData1Array = []
 		for i in range(self.wmb3_header.unknownChunk1DataCount):
 			unknownData1Array.append(to_int(wmb_fp.read(1)))
 
-		self.vertexGroupArray = []
-		for vertexGroupIndex in range(self.wmb3_header.vertexGroupCount):
-			wmb_fp.seek(self.wmb3_header.vertexGroupArrayOffset + 0x30 * vertexGroupIndex)
-
-			vertexGroup = wmb3_vertexGroup(wmb_fp,((self.wmb3_header.flags & 0x8) and 4 or 2))
-			self.vertexGroupArray.append(vertexGroup)
-
-		self.meshArray = []
-		wmb_fp.seek(self.wmb3_header.meshArrayOffset)
-		for meshIndex in range(self.wmb3_header.meshCount):
-			mesh = wmb3_mesh(wmb_fp)
-			self.meshArray.append(mesh)
-
-		self.meshGroupInfoArray = []
-		for meshGroupInfoArrayIndex in range(self.wmb3_header.meshGroupInfoArrayCount):
-			wmb_fp.seek(self.wmb3_header.meshGroupInfoArrayHeaderOffset + meshGroupInfoArrayIndex * 0x14)
-			meshGroupInfo= wmb3_meshGroupInfo(wmb_fp)
-			self.meshGroupInfoArray.append(meshGroupInfo)
-
-		self.meshGroupArray = []
-		for meshGroupIndex in range(self.wmb3_header.meshGroupCount):
-			wmb_fp.seek(self.wmb3_header.meshGroupOffset + meshGroupIndex * 0x2c)
-			meshGroup = wmb3_meshGroup(wmb_fp)
-			
-			self.meshGroupArray.append(meshGroup)
-
-		self.materialArray = []
-		for materialIndex in range(self.wmb3_header.materialCount):
-			wmb_fp.seek(self.wmb3_header.materialArrayOffset + materialIndex * 0x30)
-			material = wmb3_material(wmb_fp)
-			self.materialArray.append(material)
-
-		wmb_fp.seek(self.wmb3_header.boneMapOffset)
-		self.boneMap = []
-		for index in range(self.wmb3_header.boneMapCount):
-			self.boneMap.append(to_int(wmb_fp.read(4)))
-		wmb_fp.seek(self.wmb3_header.bonesetOffset)
-		self.boneSetArray = wmb3_boneSet(wmb_fp, self.wmb3_header.bonesetCount).boneSetArray
+		with profiler.phase('parse.vertex_groups'):
+			self.vertexGroupArray = []
+			for vertexGroupIndex in range(self.wmb3_header.vertexGroupCount):
+				wmb_fp.seek(self.wmb3_header.vertexGroupArrayOffset + 0x30 * vertexGroupIndex)
+
+				vertexGroup = wmb3_vertexGroup(wmb_fp,((self.wmb3_header.flags & 0x8) and 4 or 2))
+				self.vertexGroupArray.append(vertexGroup)
+
+		with profiler.phase('parse.meshes'):
+			self.meshArray = []
+			wmb_fp.seek(self.wmb3_header.meshArrayOffset)
+			for meshIndex in range(self.wmb3_header.meshCount):
+				mesh = wmb3_mesh(wmb_fp)
+				self.meshArray.append(mesh)
+
+			self.meshGroupInfoArray = []
+			for meshGroupInfoArrayIndex in range(self.wmb3_header.meshGroupInfoArrayCount):
+				wmb_fp.seek(self.wmb3_header.meshGroupInfoArrayHeaderOffset + meshGroupInfoArrayIndex * 0x14)
+				meshGroupInfo= wmb3_meshGroupInfo(wmb_fp)
+				self.meshGroupInfoArray.append(meshGroupInfo)
+
+			self.meshGroupArray = []
+			for meshGroupIndex in range(self.wmb3_header.meshGroupCount):
+				wmb_fp.seek(self.wmb3_header.meshGroupOffset + meshGroupIndex * 0x2c)
+				meshGroup = wmb3_meshGroup(wmb_fp)
+				
+				self.meshGroupArray.append(meshGroup)
+
+		with profiler.phase('parse.materials'):
+			self.materialArray = []
+			for materialIndex in range(self.wmb3_header.materialCount):
+				wmb_fp.seek(self.wmb3_header.materialArrayOffset + materialIndex * 0x30)
+				material = wmb3_material(wmb_fp)
+				self.materialArray.append(material)
+
+		with profiler.phase('parse.bone_sets'):
+			wmb_fp.seek(self.wmb3_header.boneMapOffset)
+			self.boneMap = []
+			for index in range(self.wmb3_header.boneMapCount):
+				self.boneMap.append(to_int(wmb_fp.read(4)))
+			wmb_fp.seek(self.wmb3_header.bonesetOffset)
+			self.boneSetArray = wmb3_boneSet(wmb_fp, self.wmb3_header.bonesetCount).boneSetArray
+		wmb_fp.close()
 		#print_class(self.boneSets)
+
+	def get_region_mesh_groups(self, region = None):
+		"""indices of the mesh groups whose box intersects region, None selects every group"""
+		if region is None:
+			return set(range(len(self.meshGroupArray)))
+		if not box_intersects(self.wmb3_header.bounding_box, region):
+			return set()
+		return set([meshGroupIndex for meshGroupIndex, meshGroup in enumerate(self.meshGroupArray)
+			if box_intersects(meshGroup.bounding_box, region)])
 		
 	def clear_unused_vertex(self, meshArrayIndex,vertexGroupIndex):
 		mesh = self.meshArray[meshArrayIndex]
@@ -399,6 +487,8 @@ class WMB3(object):
 		meshVertices = self.vertexGroupArray[vertexGroupIndex].vertexArray
 		if self.hasBone:
 			boneWeightInfos = [0] * len(usedVertexIndexArray)
+		badWeightCount = 0
+		worstWeightSum = 1.0
 		for newIndex in range(len(usedVertexIndexArray)):
 			i = usedVertexIndexArray[newIndex]
 			usedVertices[newIndex] = (meshVertices[i].positionX, meshVertices[i].positionY, meshVertices[i].positionZ)
@@ -412,113 +502,149 @@ class WMB3(object):
 					boneWeightInfos[newIndex] = [boneIndices, meshVertices[i].boneWeights]
 					s = sum([weight for weight in meshVertices[i].boneWeights]) 
 					if s > 1.000000001 or s < 0.999999:
-						print('[-] error weight detect %f' % s)
-						print(meshVertices[i].boneWeights) 
+						badWeightCount += 1
+						if abs(s - 1) > abs(worstWeightSum - 1):
+							worstWeightSum = s
 				else:
 					self.hasBone = False
+		if badWeightCount:
+			log.warning('mesh %d: %d vertices with a bone weight sum != 1 (worst %f)', meshArrayIndex, badWeightCount, worstWeightSum)
 		return usedVertices ,faces, usedVertexIndexArray, boneWeightInfos
 
 
-def export_obj(wmb, wta, wtp_fp, obj_file):
-	if not obj_file:
-		obj_file = 'test'
-	create_dir('out/%s'%obj_file)
-	obj_file = 'out/%s/%s'%(obj_file, obj_file)
-	textureArray = []
-	
-	if (wta and wtp_fp):
-		for materialIndex in range(wmb.wmb3_header.materialCount):
-			material = wmb.materialArray[materialIndex]
-			materialName = material.materialName
-			if 'g_AlbedoMap' in material.textureArray.keys():
-				identifier = material.textureArray['g_AlbedoMap']
-				textureFile = "%s%s"%('out/texture/',identifier)
-				textureArray.append(textureFile)
-			if 'g_NormalMap' in material.textureArray.keys():
-				identifier = material.textureArray['g_NormalMap']
-				textureFile = "%s%s"%('out/texture/',identifier)
-				textureArray.append(textureFile)
-		for textureFile in textureArray:
-			texture = wta.getTextureByIdentifier(textureFile.replace('out/texture/',''), wtp_fp)
-			if texture:
-				texture_fp = open("%s.dds"%textureFile, "wb")
-				print('dumping %s.dds'%textureFile)
-				texture_fp.write(texture)
-				texture_fp.close()
-
-	mtl = open("%s.mtl"%obj_file, 'w')
-	for materialIndex in range(wmb.wmb3_header.materialCount):
-		material = wmb.materialArray[materialIndex]
-		materialName = material.materialName
+def read_bounding_boxes(wmb_file):
+	"""model box and [(meshGroupname, box)] of a wmb, only the header and mesh group table are read
+
+	the model box is None for files that are not WMB3
+	"""
+	with open_reader(wmb_file) as wmb_fp:
+		header = WMB_Header(wmb_fp)
+		if header.magicNumber != b'WMB3':
+			return None, []
+		meshGroups = []
+		for meshGroupIndex in range(header.meshGroupCount):
+			offset = header.meshGroupOffset + meshGroupIndex * 0x2c
+			nameOffset = wmb_fp.get('I', offset)
+			box = decode_bounding_box(wmb_fp.get('6f'))
+			wmb_fp.seek(nameOffset)
+			meshGroups.append((to_string(wmb_fp.read(256)), box))
+	return header.bounding_box, meshGroups
+
+def get_obj_meshes(wmb, lods = None, region = None):
+	"""obj file key -> [(meshArrayIndex, materialIndex)], computed once for the whole export
+
+	a key is (lodIndex, meshGroupIndex, vertexGroupIndex), lods None exports every LOD,
+	region (min xyz, max xyz) keeps the mesh groups whose bounding box intersects it
+	"""
+	objMeshes = {}
+	meshGroups = wmb.get_region_mesh_groups(region)
+	for lodIndex, meshGroupInfo in enumerate(wmb.meshGroupInfoArray):
+		if lods is not None and not lodIndex in lods:
+			continue
+		for groupedMeshIndex, groupedMesh in enumerate(meshGroupInfo.groupedMeshArray):
+			if not groupedMesh.meshGroupIndex in meshGroups:
+				continue
+			meshArrayIndex = meshGroupInfo.meshStart + groupedMeshIndex
+			vertexGroupIndex = wmb.meshArray[meshArrayIndex].vertexGroupIndex
+			key = (lodIndex, groupedMesh.meshGroupIndex, vertexGroupIndex)
+			objMeshes.setdefault(key, []).append((meshArrayIndex, groupedMesh.materialIndex))
+	return [(key, objMeshes[key]) for key in sorted(objMeshes.keys())]
+
+def format_rows(fmt, rows):
+	"""format every row of a 2d array with one % operation"""
+	if not len(rows):
+		return ''
+	return (fmt * len(rows)) % tuple(rows.ravel().tolist())
+
+def get_obj_vertex_arrays(vertexGroup):
+	"""positions, obj uvs (v flipped) and normals of a vertex group"""
+	uvs = vertexGroup.get_uvs()
+	uvs[:, 1] = 1 - uvs[:, 1]
+	return vertexGroup.get_positions(), uvs, vertexGroup.get_normals()
+
+def format_obj(wmb, vertexGroupIndex, vertexArrays, meshes, mtlName, groupName):
+	"""text of one .obj file, only the vertices used by its meshes are written"""
+	vertexGroup = wmb.vertexGroupArray[vertexGroupIndex]
+	meshFaces = [vertexGroup.get_faces(wmb.meshArray[meshArrayIndex]) for meshArrayIndex, materialIndex in meshes]
+	usedVertices = np.unique(np.concatenate(meshFaces)) if meshFaces else np.zeros(0, np.int64)
+	positions, uvs, normals = vertexArrays
+	text = ['mtllib ./%s.mtl\n' % mtlName,
+		format_rows('v %f %f %f\n', positions[usedVertices]),
+		format_rows('vt %f %f\n', uvs[usedVertices]),
+		format_rows('vn %f %f %f\n', normals[usedVertices])]
+	for (meshArrayIndex, materialIndex), faces in zip(meshes, meshFaces):
+		if materialIndex < len(wmb.materialArray):
+			textureArray = wmb.materialArray[materialIndex].textureArray
+			if 'g_AlbedoMap' in textureArray:
+				text.append('usemtl %s\n' % textureArray['g_AlbedoMap'])
+		text.append('g %s\n' % groupName)
+		# obj indices are one based, v/vt/vn share the same index
+		faces = np.searchsorted(usedVertices, faces) + 1
+		text.append(format_rows('f %d/%d/%d %d/%d/%d %d/%d/%d\n', np.repeat(faces, 3, axis = 1)))
+	return ''.join(text)
+
+def format_mtl(wmb, textureDir):
+	text = []
+	for material in wmb.materialArray:
 		if 'g_AlbedoMap' in material.textureArray.keys():
-			identifier = material.textureArray['g_AlbedoMap']
-			textureFile = "%s%s"%('out/texture/',identifier)
-			mtl.write('newmtl %s\n'%(identifier))
-			mtl.write('Ns 96.0784\nNi 1.5000\nd 1.0000\nTr 0.0000\nTf 1.0000 1.0000 1.0000 \nillum 2\nKa 0.0000 0.0000 0.0000\nKd 0.6400 0.6400 0.6400\nKs 0.0873 0.0873 0.0873\nKe 0.0000 0.0000 0.0000\n')
-			mtl.write('map_Ka %s.dds\nmap_Kd %s.dds\n'%(textureFile.replace('out','..'),textureFile.replace('out','..')))
+			textureFile = '%s%s' % (textureDir, material.textureArray['g_AlbedoMap'])
+			text.append('newmtl %s\n' % material.textureArray['g_AlbedoMap'])
+			text.append('Ns 96.0784\nNi 1.5000\nd 1.0000\nTr 0.0000\nTf 1.0000 1.0000 1.0000 \nillum 2\nKa 0.0000 0.0000 0.0000\nKd 0.6400 0.6400 0.6400\nKs 0.0873 0.0873 0.0873\nKe 0.0000 0.0000 0.0000\n')
+			text.append('map_Ka %s.dds\nmap_Kd %s.dds\n' % (textureFile, textureFile))
 		if 'g_NormalMap' in material.textureArray.keys():
-			identifier = material.textureArray['g_NormalMap']
-			textureFile2 = "%s%s"%('out/texture/',identifier)	
-			mtl.write("bump %s.dds\n"%textureFile2.replace('out','..'))
-		mtl.write('\n')
-	mtl.close()
-
-	
-	for vertexGroupIndex in range(wmb.wmb3_header.vertexGroupCount):
-		
-		for meshGroupIndex in range(wmb.wmb3_header.meshGroupCount):
-			meshIndexArray = []
-			
-			groupedMeshArray = wmb.meshGroupInfoArray[0].groupedMeshArray
-			for groupedMeshIndex in range(len(groupedMeshArray)):
-				if groupedMeshArray[groupedMeshIndex].meshGroupIndex == meshGroupIndex:
-					meshIndexArray.append(groupedMeshIndex)
-			meshGroup = wmb.meshGroupArray[meshGroupIndex]
-			for meshArrayIndex in (meshIndexArray):
-				meshVertexGroupIndex = wmb.meshArray[meshArrayIndex].vertexGroupIndex
-				if meshVertexGroupIndex == vertexGroupIndex:
-					if  not os.path.exists('%s_%s_%d.obj'%(obj_file,meshGroup.meshGroupname,vertexGroupIndex)):
-						obj = open('%s_%s_%d.obj'%(obj_file,meshGroup.meshGroupname,vertexGroupIndex),"w")
-						obj.write('mtllib ./%s.mtl\n'%obj_file.split('/')[-1])
-						for vertexIndex in range(wmb.vertexGroupArray[vertexGroupIndex].vertexGroupHeader.vertexCount):
-							vertex = wmb.vertexGroupArray[vertexGroupIndex].vertexArray[vertexIndex]
-							obj.write('v %f %f %f\n'%(vertex.positionX,vertex.positionY,vertex.positionZ))
-							obj.write('vt %f %f\n'%(vertex.textureU,1 - vertex.textureV))
-							obj.write('vn %f %f %f\n'%(vertex.normalX, vertex.normalY, vertex.normalZ))
-					else:
-						obj = open('%s_%s_%d.obj'%(obj_file,meshGroup.meshGroupname,vertexGroupIndex),"a+")
-					if 'g_AlbedoMap' in wmb.materialArray[groupedMeshArray[meshArrayIndex].materialIndex].textureArray.keys():
-						textureFile = wmb.materialArray[groupedMeshArray[meshArrayIndex].materialIndex].textureArray["g_AlbedoMap"]
-						obj.write('usemtl %s\n'%textureFile.split('/')[-1])
-					print('dumping %s_%s_%d.obj'%(obj_file,meshGroup.meshGroupname,vertexGroupIndex))
-					obj.write('g %s%d\n'% (meshGroup.meshGroupname,vertexGroupIndex))
-					faceRawStart = wmb.meshArray[meshArrayIndex].faceStart
-					faceRawNum = wmb.meshArray[meshArrayIndex].faceCount
-					vertexStart = wmb.meshArray[meshArrayIndex].vertexStart
-					vertexNum = wmb.meshArray[meshArrayIndex].vertexCount
-					faceRawArray = wmb.vertexGroupArray[meshVertexGroupIndex].faceRawArray
-					
-					for i in range(int(faceRawNum/3)):
-						obj.write('f %d/%d/%d %d/%d/%d %d/%d/%d\n'%(
-								faceRawArray[faceRawStart + i * 3],faceRawArray[faceRawStart + i * 3],faceRawArray[faceRawStart + i * 3],
-								faceRawArray[faceRawStart + i * 3 + 1],faceRawArray[faceRawStart + i * 3 + 1],faceRawArray[faceRawStart + i * 3 + 1],
-								faceRawArray[faceRawStart + i * 3 + 2],faceRawArray[faceRawStart + i * 3 + 2],faceRawArray[faceRawStart + i * 3 + 2],
-							)
-						)
-					obj.close()
-
-def main(arg, wmb_fp, wta_fp, wtp_fp, dump):
-	wmb = WMB3(wmb_fp)
-	wmb_fp.close()
-	wta = 0
-	if wta_fp:
-		wta = WTA(wta_fp)
-		wta_fp.close()
-	if dump:
-		obj_file = arg.split('\\')[-1].replace('.wmb','')
-		export_obj(wmb, wta, wtp_fp, obj_file)
-		if wtp_fp:
-			wtp_fp.close()
+			text.append('bump %s%s.dds\n' % (textureDir, material.textureArray['g_NormalMap']))
+		text.append('\n')
+	return ''.join(text)
+
+def export_obj(wmb, obj_file, out_dir = 'out', lods = None, dump_textures = True, region = None):
+	"""write out_dir/obj_file/obj_file_<meshGroup>_<vertexGroup>[_lod<n>].obj files and their .mtl
+
+	albedo and normal textures are copied to out_dir/texture, lods None exports every LOD,
+	region limits the export to the mesh groups intersecting it
+	"""
+	if not obj_file:
+		obj_file = 'test'
+	create_dir('%s/%s' % (out_dir, obj_file))
+	obj_path = '%s/%s/%s' % (out_dir, obj_file, obj_file)
+
+	if dump_textures and wmb.wta and wmb.wtp_file:
+		texture_dir = '%s/texture' % out_dir
+		create_dir(texture_dir)
+		identifiers = set()
+		for material in wmb.materialArray:
+			for textureType in ('g_AlbedoMap', 'g_NormalMap'):
+				if textureType in material.textureArray:
+					identifiers.add(material.textureArray[textureType])
+		for identifier in sorted(identifiers):
+			index = wmb.wta.getTextureIndexByIdentifier(identifier)
+			if index is not None:
+				wmb.wta.extractTextureByIndex(index, wmb.wtp_file, '%s/%s.dds' % (texture_dir, identifier))
+		log.info('dumped %d textures to %s', len(identifiers), texture_dir)
+
+	with open('%s.mtl' % obj_path, 'w') as mtl:
+		mtl.write(format_mtl(wmb, '../texture/'))
+
+	objFiles = []
+	vertexArrays = {}
+	for (lodIndex, meshGroupIndex, vertexGroupIndex), meshes in get_obj_meshes(wmb, lods, region):
+		meshGroupName = wmb.meshGroupArray[meshGroupIndex].meshGroupname
+		fileName = '%s_%s_%d' % (obj_path, meshGroupName, vertexGroupIndex)
+		if lodIndex > 0:
+			fileName += '_lod%d' % lodIndex
+		if not vertexGroupIndex in vertexArrays:
+			vertexArrays[vertexGroupIndex] = get_obj_vertex_arrays(wmb.vertexGroupArray[vertexGroupIndex])
+		text = format_obj(wmb, vertexGroupIndex, vertexArrays[vertexGroupIndex], meshes, obj_file, '%s%d' % (meshGroupName, vertexGroupIndex))
+		with open('%s.obj' % fileName, 'w') as obj:
+			obj.write(text)
+		objFiles.append('%s.obj' % fileName)
+	log.info('dumped %d obj files to %s/%s', len(objFiles), out_dir, obj_file)
+	return objFiles
+
+def main(wmb_file, out_dir = 'out', lods = None):
+	wmb = WMB3(wmb_file)
+	obj_file = os.path.basename(wmb_file.replace('\\', '/')).replace('.wmb','')
+	return export_obj(wmb, obj_file, out_dir, lods)
 
 if __name__ == '__main__':
-	pass
+	for wmb_file in sys.argv[1:]:
+		main(wmb_file)
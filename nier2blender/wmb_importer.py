@@ -1,9 +1,20 @@
-import bpy, bmesh, math
+import bpy, bmesh, math, hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from mathutils import Vector, Matrix
 from nier2blender.wmb import *
+from nier2blender.profiler import profiler, format_report, format_memory_report
+from nier2blender.log import get_logger, DEBUG, INFO, Tally
+
+log = get_logger('import')
 
 ModelName = ''
 
+# caches shared by every import of the session, cache key -> datablock name
+CACHE_KEY_PROP = 'nier_cache_key'
+ImageCache = {}
+MaterialCache = {}
+FileHashCache = {}
+
 def reset_blend():
     bpy.ops.object.mode_set(mode='OBJECT')
     for scene in bpy.data.scenes:
@@ -21,7 +32,7 @@ def reset_blend():
         obj.user_clear()
 
 def construct_armature(name, wmb_bone_array):			# bone_data =[boneIndex, boneName, parentIndex, parentName, bone_pos, bone_rot, bone_number ]
-    print('[+] importing armature')
+    log.info('importing armature %s', name)
     bpy.ops.object.add(
         type='ARMATURE', 
         enter_editmode=True,
@@ -35,7 +46,8 @@ def construct_armature(name, wmb_bone_array):			# bone_data =[boneIndex, boneNam
     amt = ob.data
     amt.name = name +'Amt'
 
-    print('\n[Info]Construct armature --> %s(bpy.context.object.data.edit_bones)\n' % (amt.name))
+    log.debug('Construct armature --> %s(bpy.context.object.data.edit_bones)', amt.name)
+    debug_bones = log.isEnabledFor(DEBUG)
 
     for wmb_bone in wmb_bone_array:
         # 键是骨骼名称字符串，值是骨骼索引
@@ -47,8 +59,9 @@ def construct_armature(name, wmb_bone_array):			# bone_data =[boneIndex, boneNam
         bone.head = Vector(wmb_bone.world_position)
         bone.tail = Vector(wmb_bone.world_position) + Vector((0 , 0.01, 0))
 
-        print('Create Bone:%s, index = %d, bone_num = %d, parentIndex = %d, parentName:%s, position:%s, rotation:%s' %
-              (wmb_bone.boneName, wmb_bone.boneIndex, wmb_bone.boneNumber, wmb_bone.parentIndex, wmb_bone.parentName, wmb_bone.world_position, wmb_bone.world_rotation))
+        if debug_bones:
+            log.debug('Create Bone:%s, index = %d, bone_num = %d, parentIndex = %d, parentName:%s, position:%s, rotation:%s',
+                wmb_bone.boneName, wmb_bone.boneIndex, wmb_bone.boneNumber, wmb_bone.parentIndex, wmb_bone.parentName, wmb_bone.world_position, wmb_bone.world_rotation)
     
 
     bones = amt.edit_bones
@@ -68,18 +81,20 @@ def construct_armature(name, wmb_bone_array):			# bone_data =[boneIndex, boneNam
             bone.parent = None
 
     # check bone length
+    fixed_bones = Tally(log, INFO)
     for bone in bones:
         if bone.head == bone.tail:
-            print("[Warning] %s's length == 0"%bone.name)
             if len(bone.children) > 0:
-                print("[Info] try to fix %s's length"%bone.name)
                 bone.tail = bone.children[0].head
                 if bone.head == bone.tail:
-                    print("[Info] use custom length: 0.01")
                     bone.tail = bone.head + Vector((0, 0.01, 0))
+                    fixed_bones.add('custom length 0.01', bone.name)
+                else:
+                    fixed_bones.add('tail moved to child', bone.name)
             else:
-                print("[Info] use custom length: 0.01")
                 bone.tail = bone.head + Vector((0, 0.01, 0))
+                fixed_bones.add('custom length 0.01', bone.name)
+    fixed_bones.report('%d bones, zero length bones fixed' % len(bones))
 
     bpy.ops.object.mode_set(mode='OBJECT')
     ob.rotation_euler = (math.tan(1),0,0)
@@ -135,19 +150,27 @@ def construct_mesh(mesh_data):
     bpy.context.scene.objects.link(obj)
     objmesh.from_pydata(vertices, [], faces)
     objmesh.update(calc_edges=True)
-    if has_bone:
-        weight_infos = mesh_data[4]
-        group_names = sorted(list(set(["bone%d" % i  for weight_info in weight_infos for i in weight_info[0]])))
-        for group_name in group_names:
-            obj.vertex_groups.new(group_name)
-        for i in range(len(weight_infos)):
-            for index in range(4):
-                group_name = "bone%d"%weight_infos[i][0][index]
-                weight = weight_infos[i][1][index]
-                group = obj.vertex_groups[group_name]
-                if weight:
-                    group.add([i], weight, "REPLACE")
     obj.rotation_euler = (math.tan(1),0,0)
+    if profiler.enabled:
+        profiler.count('objects')
+        profiler.count('vertices', len(vertices))
+        profiler.count('faces', len(faces))
+        profiler.count('rna_calls', 7)
+    if has_bone:
+        with profiler.phase('import.weights'):
+            weight_infos = mesh_data[4]
+            group_names = sorted(list(set(["bone%d" % i  for weight_info in weight_infos for i in weight_info[0]])))
+            for group_name in group_names:
+                obj.vertex_groups.new(group_name)
+            for i in range(len(weight_infos)):
+                for index in range(4):
+                    group_name = "bone%d"%weight_infos[i][0][index]
+                    weight = weight_infos[i][1][index]
+                    group = obj.vertex_groups[group_name]
+                    if weight:
+                        group.add([i], weight, "REPLACE")
+            if profiler.enabled:
+                profiler.count('rna_calls', len(group_names) + len([w for weight_info in weight_infos for w in weight_info[1] if w]))
     return obj
 
 def set_partent(parent, child):
@@ -158,12 +181,70 @@ def set_partent(parent, child):
     child.select = False
     parent.select = False
 
-def consturct_materials(texture_dir ,material):
+def sync_datablock_cache(cache, collection):
+    """index datablocks tagged by earlier imports, e.g. after an addon reload or loading a .blend"""
+    cache.clear()
+    for block in collection:
+        key = block.get(CACHE_KEY_PROP)
+        if key is not None:
+            cache[key] = block.name
+
+def get_cached_datablock(cache, collection, key):
+    name = cache.get(key)
+    if name is None:
+        return None
+    block = collection.get(name)
+    if block is None or block.get(CACHE_KEY_PROP) != key:
+        # removed or renamed by the user
+        del cache[key]
+        return None
+    return block
+
+def set_cached_datablock(cache, block, key):
+    block[CACHE_KEY_PROP] = key
+    cache[key] = block.name
+
+def texture_file_hash(texture_file):
+    """cheap content hash of a dds file: size, head and tail of the file"""
+    stat = os.stat(texture_file)
+    stat_key = (texture_file, stat.st_size, stat.st_mtime)
+    if not stat_key in FileHashCache:
+        md5 = hashlib.md5(str(stat.st_size).encode('ascii'))
+        with open(texture_file, 'rb') as texture_fp:
+            md5.update(texture_fp.read(0x10000))
+            if stat.st_size > 0x20000:
+                texture_fp.seek(-0x10000, 2)
+                md5.update(texture_fp.read())
+        FileHashCache[stat_key] = md5.hexdigest()
+    return FileHashCache[stat_key]
+
+def load_texture_image(identifier, texture_file):
+    """load a dds once per session, every material and model using it shares the image"""
+    key = 'image_%s_%s' % (identifier.lower(), texture_file_hash(texture_file))
+    image = get_cached_datablock(ImageCache, bpy.data.images, key)
+    if image is None:
+        image = bpy.data.images.load(texture_file)
+        set_cached_datablock(ImageCache, image, key)
+    return image
+
+def get_material_key(material_name, textures, uniforms, variant = ''):
+    params = repr((material_name, sorted(textures.items()), sorted(uniforms.items())))
+    if variant:
+        params += variant
+    return 'material_%s' % hashlib.md5(params.encode('utf8')).hexdigest()
+
+def consturct_materials(texture_dir ,material, variant = ''):
+    """variant keeps e.g. preview textures apart from the full resolution ones"""
     material_name = material[0]
     textures = material[1]
     uniforms = material[2]
+    material_key = get_material_key(material_name, textures, uniforms, variant)
+    material = get_cached_datablock(MaterialCache, bpy.data.materials, material_key)
+    if material is not None:
+        return material
     # print('[+] importing material %s' % material_name)
     material = bpy.data.materials.new( '%s' % (material_name))
+    set_cached_datablock(MaterialCache, material, material_key)
     #print("\n".join(["%s:%f" %(key, uniforms[key]) for key in sorted(uniforms.keys())]))
     for key in uniforms.keys():
         if key.lower().find("g_glossiness") > -1:
@@ -176,6 +257,8 @@ def consturct_materials(texture_dir ,material):
                 flag = True
         if flag:
             texture_name = "%s_%s"%(textures[texturesType],texturesType)
+            if variant:
+                texture_name = "%s_%s" % (texture_name, variant)
             # texture_file = "%s/%s.dds" % (texture_dir, textures[texturesType])
             texture_file = "%s%s.dds" % (texture_dir, textures[texturesType].upper())
 
@@ -185,7 +268,7 @@ def consturct_materials(texture_dir ,material):
                 if not texture_name in bpy.data.textures.keys():
                     # print('[+] importing texture %s' % texture_name)
                     texture = bpy.data.textures.new('%s' % (texture_name), type = 'IMAGE')
-                    texture.image = bpy.data.images.load(texture_file)
+                    texture.image = load_texture_image(textures[texturesType], texture_file)
                 else:
                     texture = bpy.data.textures[texture_name]
                 material_textureslot = material.texture_slots.add()
@@ -213,9 +296,9 @@ def consturct_materials(texture_dir ,material):
                 material_textureslot.texture = texture
                 material_textureslot.texture_coords = 'UV'
         else:
-            print("[!] not supported texture %s_%s" % (textures[texturesType], texturesType))
+            log.debug("not supported texture %s_%s", textures[texturesType], texturesType)
     if not material.texture_slots[0]:
-        print("[!] no textute found for material %s" % material_name)
+        log.warning("no textute found for material %s", material_name)
     return material
 
 def add_material_to_mesh(mesh, materials , uvs):
@@ -238,41 +321,69 @@ def add_material_to_mesh(mesh, materials , uvs):
     bpy.ops.object.shade_smooth()
     #mesh.hide = True
     mesh.select = False
+    if profiler.enabled:
+        profiler.count('rna_calls', len(materials) + 3 * len(mesh.data.polygons) + 4)
     
-def format_wmb_mesh(wmb):
+def select_lod_infos(wmb, lods=(0,)):
+    """return [(lodIndex, meshGroupInfo)] for the requested LOD levels, None means all"""
+    lodCount = len(wmb.meshGroupInfoArray)
+    if lods is None:
+        return list(enumerate(wmb.meshGroupInfoArray))
+    lodInfos = []
+    for lod in sorted(set(lods)):
+        if 0 <= lod < lodCount:
+            lodInfos.append((lod, wmb.meshGroupInfoArray[lod]))
+        else:
+            log.warning('LOD%d not found, model has %d LOD(s)', lod, lodCount)
+    return lodInfos
+
+def format_wmb_mesh(wmb, lods=(0,), after_mesh=None, region=None):
+    """build the meshes of the selected LODs, region (min xyz, max xyz) keeps the
+    mesh groups whose bounding box intersects it"""
     meshes = []
-    uvs = []
+    uvs = {}
     usedVerticeIndexArrays = []
-    mesh_array = wmb.meshArray
-    #each vertexgroup -> each lod -> each group -> mesh
+    materialIndexArray = []
+    lodInfos = select_lod_infos(wmb, lods)
+    regionMeshGroups = wmb.get_region_mesh_groups(region)
+    if region is not None:
+        log.info('region %s - %s: %d of %d mesh groups', region[0], region[1], len(regionMeshGroups), len(wmb.meshGroupArray))
+    #each vertexgroup -> each selected lod -> each group -> mesh
     for vertexGroupIndex in range(wmb.wmb3_header.vertexGroupCount):
-        uv = [(vertex.textureU, 1 - vertex.textureV) for vertex in wmb.vertexGroupArray[vertexGroupIndex].vertexArray]
-        uvs.append(uv)
-        for meshGroupInfoArrayIndex in range(len(wmb.meshGroupInfoArray)):
-            meshGroupInfo =  wmb.meshGroupInfoArray[meshGroupInfoArrayIndex]
+        for lodIndex, meshGroupInfo in lodInfos:
             groupedMeshArray = meshGroupInfo.groupedMeshArray
             mesh_start = meshGroupInfo.meshStart
             for meshGroupIndex in range(wmb.wmb3_header.meshGroupCount):
+                if not meshGroupIndex in regionMeshGroups:
+                    continue
                 meshIndexArray = []
                 for groupedMeshIndex in range(len(groupedMeshArray)):
                     if groupedMeshArray[groupedMeshIndex].meshGroupIndex == meshGroupIndex:
-                        meshIndexArray.append(mesh_start + groupedMeshIndex)
+                        meshIndexArray.append(groupedMeshIndex)
                 meshGroup = wmb.meshGroupArray[meshGroupIndex]
-                for meshArrayIndex in (meshIndexArray):
+                for groupedMeshIndex in (meshIndexArray):
+                    meshArrayIndex = mesh_start + groupedMeshIndex
                     meshVertexGroupIndex = wmb.meshArray[meshArrayIndex].vertexGroupIndex
                     if meshVertexGroupIndex == vertexGroupIndex:
+                        # uv of a vertex group is only formatted when a selected lod uses it
+                        if not vertexGroupIndex in uvs:
+                            uvs[vertexGroupIndex] = [(vertex.textureU, 1 - vertex.textureV) for vertex in wmb.vertexGroupArray[vertexGroupIndex].vertexArray]
                         meshName = "%s_%d_%d"%(meshGroup.meshGroupname, meshArrayIndex, vertexGroupIndex)
-                        meshInfo = wmb.clear_unused_vertex(meshArrayIndex, meshVertexGroupIndex)
+                        with profiler.phase('import.clear_unused_vertex'):
+                            meshInfo = wmb.clear_unused_vertex(meshArrayIndex, meshVertexGroupIndex)
                         vertices = meshInfo[0]
                         faces =  meshInfo[1]
                         usedVerticeIndexArray = meshInfo[2]
                         boneWeightInfoArray = meshInfo[3]
                         usedVerticeIndexArrays.append(usedVerticeIndexArray)
-                        flag = False
+                        materialIndexArray.append(groupedMeshArray[groupedMeshIndex].materialIndex)
                         has_bone = wmb.hasBone
-                        obj = construct_mesh([meshName, vertices, faces, has_bone, boneWeightInfoArray])
+                        with profiler.phase('import.mesh'):
+                            obj = construct_mesh([meshName, vertices, faces, has_bone, boneWeightInfoArray])
                         meshes.append(obj)
-    return meshes, uvs, usedVerticeIndexArrays
+                        if after_mesh is not None:
+                            after_mesh()
+    return meshes, uvs, usedVerticeIndexArrays, materialIndexArray
 
 def get_wmb_material(wmb, texture_dir):
     materials = []
@@ -282,62 +393,224 @@ def get_wmb_material(wmb, texture_dir):
             material_name = material.materialName
             uniforms = material.uniformArray
             textures = material.textureArray
-            for key in textures.keys():
-                identifier = textures[key]
-                texture_stream = wmb.wta.getTextureByIdentifier(identifier,wmb.wtp_fp)
-                if texture_stream:
-                    if not os.path.exists("%s\%s.dds" %(texture_dir, identifier)):
-                        create_dir(texture_dir)
-                        texture_fp = open("%s\%s.dds" %(texture_dir, identifier), "wb")
-                        print('[+] dumping %s.dds'% identifier)
-                        texture_fp.write(texture_stream)
-                        texture_fp.close()
             materials.append([material_name,textures,uniforms])
     else:
-        print('missing wta')
+        log.warning('missing wta')
     return materials
 
-def main(wmb_file = os.path.split(os.path.realpath(__file__))[0] + '\\test\\pl0000.dtt\\pl0000.wmb'):
+class TexturePipeline(object):
+    """parse the wta and dump its textures on background threads
+
+    started before the wmb is parsed, so the texture I/O overlaps with parsing
+    and building the geometry. every texture of the wta is dumped, the referenced
+    ones are not known before the wmb materials are parsed. max_size dumps preview
+    textures with only the mips at or below it
+    """
+    def __init__(self, wmb_file, texture_dir, max_workers = 4, max_size = None):
+        self.texture_dir = texture_dir
+        self.max_size = max_size
+        self.wtp_file = get_wtp_file(wmb_file)
+        self.texture_jobs = {}
+        self.failed = set()
+        self.executor = ThreadPoolExecutor(max_workers = max_workers)
+        self.wta_job = self.executor.submit(self.load_wta, get_wta_file(wmb_file))
+
+    def load_wta(self, wta_file):
+        wta = load_wta(wta_file)
+        if not wta or not self.wtp_file:
+            return wta
+        jobs = {}
+        for index in wta.getUniqueTextureIndices():
+            identifier = wta.getTextureIdentifier(index)
+            texture_file = "%s\%s.dds" %(self.texture_dir, identifier)
+            if os.path.exists(texture_file):
+                continue
+            if not jobs:
+                create_dir(self.texture_dir)
+            jobs[identifier] = self.executor.submit(wta.extractTextureByIndex, index, self.wtp_file, texture_file, max_size = self.max_size)
+        if jobs:
+            log.info('dumping %d textures to %s', len(jobs), self.texture_dir)
+        # set before the wta job is done, the main thread only reads it after that
+        self.texture_jobs = jobs
+        return wta
+
+    def get_wta(self):
+        """wait for the wta, 0 when the model has none"""
+        return self.wta_job.result()
+
+    def get_jobs(self, identifiers):
+        return [self.texture_jobs[identifier] for identifier in identifiers if identifier in self.texture_jobs]
+
+    def is_ready(self, identifiers):
+        return self.wta_job.done() and all([job.done() for job in self.get_jobs(identifiers)])
+
+    def wait_any(self, identifiers):
+        """block until the wta or one more of the textures is done"""
+        if not self.wta_job.done():
+            self.wta_job.result()
+            return
+        pending = [job for job in self.get_jobs(identifiers) if not job.done()]
+        if pending:
+            wait(pending, return_when = FIRST_COMPLETED)
+
+    def check(self, identifiers):
+        """log the textures that failed to dump, once each"""
+        for identifier in identifiers:
+            job = self.texture_jobs.get(identifier)
+            if job is None or identifier in self.failed:
+                continue
+            error = job.exception()
+            if error is not None:
+                self.failed.add(identifier)
+                log.error('failed to dump texture %s: %s', identifier, error)
+
+    def close(self):
+        # running jobs keep going, the pool is released once they are done
+        self.executor.shutdown(wait = False)
+        if profiler.enabled:
+            profiler.count('textures_dumped', len(self.texture_jobs))
+
+class MaterialBuilder(object):
+    """build the wmb materials on the main thread, each one once its textures are dumped"""
+    def __init__(self, wmb, texture_dir, textures, variant = ''):
+        self.wmb = wmb
+        self.texture_dir = texture_dir
+        self.variant = variant
+        self.textures = textures
+        self.wmb_materials = None
+        self.materials = []
+        self.pending = []
+
+    def get_pending(self):
+        if self.wmb_materials is None:
+            self.wmb.wta = self.textures.get_wta()
+            self.wmb_materials = get_wmb_material(self.wmb, self.texture_dir)
+            self.materials = [None] * len(self.wmb_materials)
+            self.pending = list(range(len(self.wmb_materials)))
+        return self.pending
+
+    def build(self, materialIndex):
+        material = self.wmb_materials[materialIndex]
+        identifiers = list(material[1].values())
+        self.textures.check(identifiers)
+        with profiler.phase('import.materials'):
+            self.materials[materialIndex] = consturct_materials(self.texture_dir, material, self.variant)
+        self.pending.remove(materialIndex)
+
+    def build_ready(self):
+        """build the materials whose textures are on disk, never blocks"""
+        if self.wmb_materials is None and not self.textures.wta_job.done():
+            return
+        for materialIndex in list(self.get_pending()):
+            if self.textures.is_ready(self.wmb_materials[materialIndex][1].values()):
+                self.build(materialIndex)
+
+    def build_all(self):
+        """build the remaining materials in the order their textures arrive"""
+        self.build_ready()
+        while self.get_pending():
+            identifiers = set()
+            for materialIndex in self.pending:
+                identifiers.update(self.wmb_materials[materialIndex][1].values())
+            with profiler.phase('import.wait_textures'):
+                self.textures.wait_any(identifiers)
+            self.build_ready()
+        return self.materials
+
+def main(wmb_file = os.path.split(os.path.realpath(__file__))[0] + '\\test\\pl0000.dtt\\pl0000.wmb', lods = (0,), profile = False, profile_file = None, profile_memory = False, texture_size = None, region = None):
+    """import a wmb file, lods is a sequence of LOD levels to import (None imports every LOD)
+
+    region (min xyz, max xyz) in wmb coordinates only imports the mesh groups whose
+    bounding box intersects it, None imports everything
+
+    texture_size None imports full resolution textures, a size imports preview
+    textures with only the mips at or below it, dumped to a preview_<size> folder
+
+    with profile (or a profile_file to dump the json to) the per-phase timings and
+    counters are collected, the report is kept in profiler.last_report. profile_memory
+    adds tracemalloc peaks per phase and the top allocation sites between the phases
+    """
+    if profile or profile_file or profile_memory:
+        profiler.enable(profile_memory)
+    try:
+        with profiler.phase('import.total'):
+            import_wmb(wmb_file, lods, texture_size, region)
+    finally:
+        if profiler.enabled:
+            report = profiler.finish(profile_file)
+            log.info('import profile: %s', format_report(report))
+            if 'memory' in report:
+                log.info('import memory: %s', format_memory_report(report))
+    return {'FINISHED'}
+
+def import_index_region(index_file, region, lods = (0,), texture_size = None):
+    """import every model of a spatial index (spatial_index.py) intersecting region,
+    each one only with its intersecting mesh groups, returns the imported files"""
+    from nier2blender.spatial_index import SpatialIndex
+    index = SpatialIndex.load(index_file)
+    wmb_files = sorted(index.get_models(index.query_box(region)).keys())
+    log.info('region %s - %s: %d models', region[0], region[1], len(wmb_files))
+    for wmb_file in wmb_files:
+        main(wmb_file, lods, texture_size = texture_size, region = region)
+    return wmb_files
+
+def import_wmb(wmb_file, lods, texture_size = None, region = None):
     # reset_blend()
-    wmb = WMB3(wmb_file)
     wmbname = wmb_file.split('\\')[-1]
     texture_dir = wmb_file.replace(wmbname, '')
+    variant = ''
+    if texture_size:
+        variant = 'preview_%d' % texture_size
+        texture_dir = '%s%s\\' % (texture_dir, variant)
+    # textures are parsed and written in the background from the start
+    textures = TexturePipeline(wmb_file, texture_dir, max_size = texture_size)
+    try:
+        import_wmb_pipelined(wmb_file, wmbname, texture_dir, textures, lods, variant, region)
+    finally:
+        textures.close()
+
+def import_wmb_pipelined(wmb_file, wmbname, texture_dir, textures, lods, variant = '', region = None):
+    with profiler.phase('parse'):
+        wmb = WMB3(wmb_file, load_textures = False)
+    profiler.snapshot('parse')
     global ModelName
     ModelName = wmbname.replace('.wmb','')
+    sync_datablock_cache(ImageCache, bpy.data.images)
+    sync_datablock_cache(MaterialCache, bpy.data.materials)
 
     if wmb.hasBone:
         # boneArray = [[bone.boneIndex, bone.boneName, bone.parentIndex, bone.parentName, bone.world_position, bone.world_rotation, bone.boneNumber] for bone in wmb.boneArray]
-        construct_armature(wmbname.replace('.wmb', ''), wmb.boneArray)
+        with profiler.phase('import.armature'):
+            construct_armature(wmbname.replace('.wmb', ''), wmb.boneArray)
 
-    meshes, uvs, usedVerticeIndexArrays = format_wmb_mesh(wmb)
-    wmb_materials = get_wmb_material(wmb, texture_dir)
-    materials = []
-    for materialIndex in range(len(wmb_materials)):
-        material = wmb_materials[materialIndex]
-        materials.append(consturct_materials(texture_dir, material))
-    for meshGroupInfo in wmb.meshGroupInfoArray:
-        for Index in range(len(meshGroupInfo.groupedMeshArray)):
-            mesh_start = meshGroupInfo.meshStart
-            meshIndex = int(meshes[Index + mesh_start].name.split('_')[-2])
-            materialIndex = meshGroupInfo.groupedMeshArray[meshIndex - mesh_start].materialIndex
-            groupIndex = int(meshes[Index + mesh_start].name.split('_')[-1])
+    # materials whose textures are done are built between the meshes
+    material_builder = MaterialBuilder(wmb, texture_dir, textures, variant)
+    meshes, uvs, usedVerticeIndexArrays, materialIndexArray = format_wmb_mesh(wmb, lods, material_builder.build_ready, region)
+    profiler.snapshot('geometry')
+    materials = material_builder.build_all()
+    profiler.snapshot('materials')
+    with profiler.phase('import.uv_and_material_assign'):
+        for Index in range(len(meshes)):
+            materialIndex = materialIndexArray[Index]
+            groupIndex = int(meshes[Index].name.split('_')[-1])
             uv = []
-            for i in range(len(usedVerticeIndexArrays[Index + mesh_start])):
-                VertexIndex = usedVerticeIndexArrays[Index + mesh_start][i]
+            for i in range(len(usedVerticeIndexArrays[Index])):
+                VertexIndex = usedVerticeIndexArrays[Index][i]
                 uv.append( uvs[groupIndex][VertexIndex])
             # TODO:fix some wmb files materialIndex may be out of range
             if materialIndex < len(materials):
-                add_material_to_mesh(meshes[Index + mesh_start], 
+                add_material_to_mesh(meshes[Index], 
                     [materials[materialIndex]], uv)
             else:
-                print("[Error] materialIndex out of materials range.")
+                log.error("materialIndex %d out of materials range.", materialIndex)
+    profiler.snapshot('uv_and_material_assign')
 
     amt = bpy.data.objects.get(ModelName)
     if wmb.hasBone:
-        for mesh in meshes:
-            set_partent(amt,mesh)
-
-    return {'FINISHED'}
+        with profiler.phase('import.parenting'):
+            for mesh in meshes:
+                set_partent(amt,mesh)
+        profiler.count('rna_calls', 7 * len(meshes))
 
 if __name__ == '__main__':
     main()
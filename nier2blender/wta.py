@@ -1,46 +1,102 @@
 import os
 import sys
+import mmap
+import numpy as np
 from nier2blender.util import *
+from nier2blender.dds import write_preview
+
+def get_wta_data(wta_source):
+	"""bytes-like data of bytes, an mmap, a BufferReader or a file object"""
+	if isinstance(wta_source, (bytes, bytearray, memoryview, mmap.mmap)):
+		return wta_source
+	if isinstance(wta_source, BufferReader):
+		return wta_source.data
+	wta_source.seek(0)
+	return wta_source.read()
+
+def read_table(data, offset, count):
+	"""count uint32 at offset, copied unless data is immutable bytes so an mmap can be closed"""
+	table = np.frombuffer(data, '<u4', count, offset)
+	if not isinstance(data, bytes):
+		table = table.copy()
+	return table
 
 class WTA(object):
-	def __init__(self, wta_fp):
+	"""texture table of a wtp, every table is read with one np.frombuffer
+
+	identifiers are kept as uint32, material textures (hex strings) and ints are both
+	looked up through identifierIndex
+	"""
+	def __init__(self, wta_source):
 		super(WTA, self).__init__()
-		self.magicNumber = wta_fp.read(4)
+		data = get_wta_data(wta_source)
+		self.magicNumber = bytes(data[:4])
 		if self.magicNumber == b'WTB\x00':
-			self.unknown04 = to_int(wta_fp.read(4))
-			self.textureCount = to_int(wta_fp.read(4))
-			self.textureOffsetArrayOffset = to_int(wta_fp.read(4))
-			self.textureSizeArrayOffset = to_int(wta_fp.read(4))
-			self.unknownArrayOffset1 = to_int(wta_fp.read(4))
-			self.textureIdentifierArrayOffset = to_int(wta_fp.read(4))
-			self.unknownArrayOffset2 = to_int(wta_fp.read(4))
-			self.wtaTextureOffset = [0] * self.textureCount
-			self.wtaTextureSize = [0] * self.textureCount
-			self.wtaTextureIdentifier = [0] * self.textureCount
-			self.unknownArray1 = [0] * self.textureCount
-			self.unknownArray2 = [] 
-			for i in range(self.textureCount):
-				wta_fp.seek(self.textureOffsetArrayOffset + i * 4)
-				self.wtaTextureOffset[i] = to_int(wta_fp.read(4))
-				wta_fp.seek(self.textureSizeArrayOffset + i * 4)
-				self.wtaTextureSize[i] =  to_int(wta_fp.read(4)) 
-				wta_fp.seek(self.textureIdentifierArrayOffset + i * 4)
-				self.wtaTextureIdentifier[i] = "%08x"%to_int(wta_fp.read(4))
-				wta_fp.seek(self.unknownArrayOffset1 + i * 4)
-				self.unknownArray1[i] = "%08x"%to_int(wta_fp.read(4))
-			wta_fp.seek(self.unknownArrayOffset2 )
-			unknownval =  (wta_fp.read(4))
-			while unknownval:
-				self.unknownArray2.append(to_int(unknownval))
-				unknownval =  (wta_fp.read(4))
-			self.pointer2 = hex(wta_fp.tell())	
+			(self.unknown04, self.textureCount, self.textureOffsetArrayOffset, self.textureSizeArrayOffset,
+				self.unknownArrayOffset1, self.textureIdentifierArrayOffset,
+				self.unknownArrayOffset2) = get_struct('<7I').unpack_from(data, 4)
+			count = self.textureCount
+			self.wtaTextureOffset = read_table(data, self.textureOffsetArrayOffset, count)
+			self.wtaTextureSize = read_table(data, self.textureSizeArrayOffset, count)
+			self.identifiers = read_table(data, self.textureIdentifierArrayOffset, count)
+			self.unknownArray1 = read_table(data, self.unknownArrayOffset1, count)
+			# runs to the end of the file
+			self.unknownArray2 = read_table(data, self.unknownArrayOffset2, max(0, len(data) - self.unknownArrayOffset2) // 4)
+			self.pointer2 = hex(len(data))
+			# first texture wins, same as the old linear search
+			identifiers, first_indices = np.unique(self.identifiers, return_index = True)
+			self.identifierIndex = dict(zip(identifiers.tolist(), first_indices.tolist()))
+		else:
+			self.textureCount = 0
+			self.identifiers = np.zeros(0, '<u4')
+			self.identifierIndex = {}
+
+	@property
+	def wtaTextureIdentifier(self):
+		"""identifiers as the %08x strings the materials use"""
+		return ['%08x' % identifier for identifier in self.identifiers.tolist()]
+
+	def getTextureIdentifier(self, texture_index):
+		return '%08x' % self.identifiers[texture_index]
+
+	def getUniqueTextureIndices(self):
+		"""first index of every identifier, in table order"""
+		return sorted(self.identifierIndex.values())
+
 	def getTextureByIndex(self, texture_index, texture_fp):
-		texture_fp.seek(self.wtaTextureOffset[texture_index])
-		texture = texture_fp.read(self.wtaTextureSize[texture_index])
+		texture_fp.seek(int(self.wtaTextureOffset[texture_index]))
+		texture = texture_fp.read(int(self.wtaTextureSize[texture_index]))
 		return texture
 
+	def getTextureIndexByIdentifier(self, textureIdentifier):
+		if not isinstance(textureIdentifier, int):
+			try:
+				textureIdentifier = int(textureIdentifier, 16)
+			except (TypeError, ValueError):
+				return None
+		return self.identifierIndex.get(textureIdentifier)
+
 	def getTextureByIdentifier(self, textureIdentifier, texture_fp):
-		for index in range(self.textureCount):
-			if self.wtaTextureIdentifier[index] == textureIdentifier:
-				return self.getTextureByIndex(index,texture_fp)
-		return False
\ No newline at end of file
+		index = self.getTextureIndexByIdentifier(textureIdentifier)
+		if index is None:
+			return False
+		return self.getTextureByIndex(index,texture_fp)
+
+	def extractTextureByIndex(self, texture_index, wtp_file, texture_file, chunk_size = 0x100000, max_size = None):
+		"""copy the texture slice of wtp_file to texture_file without loading the whole texture
+
+		with max_size only the mips at or below max_size are written (preview textures)
+		"""
+		offset = int(self.wtaTextureOffset[texture_index])
+		remain = int(self.wtaTextureSize[texture_index])
+		with open(wtp_file, 'rb') as texture_fp, open(texture_file, 'wb') as out_fp:
+			if max_size and write_preview(texture_fp, offset, out_fp, max_size, chunk_size):
+				return texture_file
+			texture_fp.seek(offset)
+			while remain > 0:
+				chunk = texture_fp.read(min(chunk_size, remain))
+				if not chunk:
+					break
+				out_fp.write(chunk)
+				remain -= len(chunk)
+		return texture_file